@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import ObrazTla, Trasa, PunktTrasy
+from .models import ObrazTla, Trasa, PunktTrasy, ZmianaTrasy, Zadanie, ImportTras
+from .rewizje import grupuj_zmiany, zglos_zmiany
+from .metryki import przelicz_metryki
 
 class PunktTrasynline(admin.TabularInline):
     model = PunktTrasy
@@ -7,17 +9,42 @@ class PunktTrasynline(admin.TabularInline):
 
 @admin.register(ObrazTla)
 class ObrazTlaAdmin(admin.ModelAdmin):
-    list_display = ('nazwa', 'szerokosc', 'wysokosc', 'data_dodania')
+    list_display = ('nazwa', 'szerokosc', 'wysokosc', 'status', 'data_dodania')
+    list_filter = ('status',)
     search_fields = ('nazwa', 'opis')
+    readonly_fields = ('szerokosc', 'wysokosc', 'miniatura', 'status')
 
 @admin.register(Trasa)
 class TrasaAdmin(admin.ModelAdmin):
-    list_display = ('nazwa', 'uzytkownik', 'obraz_tla', 'data_utworzenia', 'data_modyfikacji')
+    list_display = ('nazwa', 'uzytkownik', 'obraz_tla', 'liczba_punktow', 'dlugosc', 'data_utworzenia', 'data_modyfikacji')
     list_filter = ('uzytkownik', 'obraz_tla', 'data_utworzenia')
     search_fields = ('nazwa', 'opis')
+    readonly_fields = ('liczba_punktow', 'dlugosc', 'min_x', 'min_y', 'max_x', 'max_y')
     inlines = [PunktTrasynline]
 
 @admin.register(PunktTrasy)
 class PunktTrasyAdmin(admin.ModelAdmin):
     list_display = ('trasa', 'kolejnosc', 'x', 'y')
-    list_filter = ('trasa',)
\ No newline at end of file
+    list_filter = ('trasa',)
+    
+    def delete_queryset(self, request, queryset):
+        # Masowe usuwanie omija PunktTrasy.delete() - rewizje tras podbijamy ręcznie
+        with grupuj_zmiany():
+            trasy = set(queryset.values_list('trasa_id', flat=True))
+            super().delete_queryset(request, queryset)
+            przelicz_metryki(trasy)
+            for trasa_id in trasy:
+                zglos_zmiany(trasa_id, [{'operacja': ZmianaTrasy.PRZEBUDOWA}])
+
+@admin.register(Zadanie)
+class ZadanieAdmin(admin.ModelAdmin):
+    list_display = ('funkcja', 'status', 'proby', 'data_utworzenia', 'data_modyfikacji')
+    list_filter = ('status',)
+    readonly_fields = ('funkcja', 'argumenty', 'proby', 'blad', 'data_utworzenia', 'data_modyfikacji')
+
+@admin.register(ImportTras)
+class ImportTrasAdmin(admin.ModelAdmin):
+    list_display = ('id', 'uzytkownik', 'obraz_tla', 'format', 'status', 'liczba_tras', 'liczba_punktow',
+                    'data_utworzenia')
+    list_filter = ('status', 'format')
+    readonly_fields = ('status', 'liczba_tras', 'liczba_punktow', 'blad', 'data_utworzenia')
@@ -1,9 +1,51 @@
-from rest_framework import viewsets, permissions, status
-from rest_framework.decorators import action
+from rest_framework import viewsets, mixins, permissions, status, filters
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from .models import ObrazTla, Trasa, PunktTrasy
-from .serializers import ObrazTlaSerializer, TrasaSerializer, PunktTrasySerializer
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.exceptions import NotFound, ValidationError
+from .models import ObrazTla, Trasa, PunktTrasy, ImportTras, GeometriaTrasy
+from .serializers import (ObrazTlaSerializer, TrasaSerializer, TrasaPodsumowanieSerializer, PunktTrasySerializer,
+                          PunktTrasyBulkSerializer, PozycjaPunktuSerializer, OperacjeTrasySerializer,
+                          ImportTrasSerializer, parametr_listy)
+from .services import dodaj_punkt, dodaj_punkty, tablica_punktow, wstaw_punkt, przesun_na_pozycje, wykonaj_operacje
+from .magazyn import geometria_trasy, rozpakuj_geometrie, rozpakuj_trase
+from .kodowanie import TYP_SPAKOWANY, KOLUMNY, spakuj_punkty
+from .rewizje import zmiany_od
+from .geometria import parametry_uproszczenia, punkty_uproszczone
+from .nakladki import parametry_podgladu, podglad_trasy
+from .trafienia import parametry_trafienia, najblizsze_trafienie
+from .eksport import FORMATY as FORMATY_EKSPORTU, bez_transformacji
+from .importowanie import wykonaj_import
+from .zadania import zlec
+from .stronicowanie import KursorPunktow, KursorTras, WierszePunktow
+from .pamiec import statystyki, wyzeruj_statystyki
+from .warunkowe import odpowiedz_dla_trasy, odpowiedz_warunkowo, znacznik
+from .siatka import parametry_obszaru, punkty_spakowane_przez_obszar, trasy_przez_obszar, w_poblizu, w_prostokacie
+from .views import odpowiedz_plikiem
+from django.core.files.storage import default_storage
+from django.db.models import Count, Max, Prefetch
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from functools import partial
+import numpy as np
+
+# Parametry zapytania filtrujące listę tras po metrykach
+FILTRY_METRYK = {
+    'liczba_punktow_min': 'liczba_punktow__gte',
+    'liczba_punktow_max': 'liczba_punktow__lte',
+    'dlugosc_min': 'dlugosc__gte',
+    'dlugosc_max': 'dlugosc__lte',
+}
+
+def obszar_z_zapytania(request):
+    """
+    Obszar mapy z parametrów ?bbox= i ?near=&radius= (patrz siatka.parametry_obszaru)
+    """
+    try:
+        return parametry_obszaru(request.query_params)
+    except ValueError as e:
+        raise ValidationError({'detail': str(e)})
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     """
@@ -15,12 +57,91 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         
         return obj.uzytkownik == request.user
 
+class BinarnyRenderer(BaseRenderer):
+    """
+    Renderer danych binarnych - widok zwraca gotowe bajty
+    """
+    charset = None
+    render_style = 'binary'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        # Błędy (np. 404) nie mają postaci binarnej - zwracamy je jako JSON
+        odpowiedz = (renderer_context or {}).get('response')
+        if odpowiedz is not None:
+            odpowiedz['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data, renderer_context=renderer_context)
+
+class SpakowanePunktyRenderer(BinarnyRenderer):
+    """
+    Renderer spakowanego formatu punktów (patrz kodowanie.py)
+    """
+    media_type = TYP_SPAKOWANY
+    format = 'packed'
+
+class ObrazPngRenderer(BinarnyRenderer):
+    media_type = 'image/png'
+    format = 'png'
+
+class ObrazWebpRenderer(BinarnyRenderer):
+    media_type = 'image/webp'
+    format = 'webp'
+
+class GeoJsonRenderer(BinarnyRenderer):
+    media_type = 'application/geo+json'
+    format = 'geojson'
+
+class CsvRenderer(BinarnyRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+class GpxRenderer(BinarnyRenderer):
+    media_type = 'application/gpx+xml'
+    format = 'gpx'
+
 class ObrazTlaViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoint dla obrazów tła - tylko do odczytu
     """
     queryset = ObrazTla.objects.all()
     serializer_class = ObrazTlaSerializer
+    
+    @action(detail=True, methods=['get'])
+    def punkty(self, request, pk=None):
+        """
+        Punkty tras użytkownika na tym tle: w prostokącie ?bbox=x0,y0,x1,y1
+        albo w promieniu ?radius= od ?near=x,y (od najbliższego)
+        """
+        tlo = self.get_object()
+        prostokat, poblize = obszar_z_zapytania(request)
+        if prostokat is None and poblize is None:
+            raise ValidationError({'detail': 'Podaj parametr bbox lub near.'})
+        
+        punkty = PunktTrasy.objects.filter(trasa__obraz_tla=tlo, trasa__uzytkownik=request.user)
+        if prostokat is not None:
+            punkty = w_prostokacie(punkty, prostokat).order_by('trasa_id', 'kolejnosc')
+        if poblize is not None:
+            punkty = w_poblizu(punkty, *poblize)
+        spakowane = punkty_spakowane_przez_obszar(
+            Trasa.objects.filter(obraz_tla=tlo, uzytkownik=request.user), prostokat, poblize
+        )
+        if not len(spakowane):
+            strona = self.paginate_queryset(punkty)
+            return self.get_paginated_response(PunktTrasySerializer(strona, many=True).data)
+        
+        # Punkty spakowanych tras (magazyn.py) są dołączane do wierszy i sortowane tak samo jak one
+        wiersze = punkty.values_list(*KOLUMNY, 'trasa_id')
+        tablica = np.concatenate([np.array(list(wiersze), dtype=np.int64).reshape(-1, 5), spakowane])
+        if poblize is not None:
+            x, y, _ = poblize
+            klucze = (tablica[:, 0], (tablica[:, 1] - x) ** 2 + (tablica[:, 2] - y) ** 2)
+        else:
+            klucze = (tablica[:, 3], tablica[:, 4])
+        strona = self.paginate_queryset(tablica[np.lexsort(klucze)])
+        return self.get_paginated_response(
+            [dict(zip(KOLUMNY, wiersz[:4]), trasa=wiersz[4]) for wiersz in (w.tolist() for w in strona)]
+        )
 
 class TrasaViewSet(viewsets.ModelViewSet):
     """
@@ -28,20 +149,200 @@ class TrasaViewSet(viewsets.ModelViewSet):
     """
     serializer_class = TrasaSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    pagination_class = KursorTras
+    # Sortowanie po metrykach odbywa się w bazie, np. ?ordering=-dlugosc
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['nazwa', 'data_utworzenia', 'data_modyfikacji', 'liczba_punktow', 'dlugosc']
     
     def get_queryset(self):
         # Zwracaj tylko trasy należące do zalogowanego użytkownika
-        return Trasa.objects.filter(uzytkownik=self.request.user)
+        queryset = Trasa.objects.filter(uzytkownik=self.request.user).order_by('-data_modyfikacji', '-id')
+        rozwiniete = parametr_listy(self.request, 'expand')
+        if self.action in ('list', 'eksport'):
+            queryset = self._filtruj_metryki(queryset)
+            queryset = self._filtruj_obszar(queryset)
+        if self.action == 'retrieve' or 'obraz_tla_details' in rozwiniete:
+            queryset = queryset.select_related('obraz_tla')
+        if self.action == 'retrieve' or 'punkty' in rozwiniete:
+            # Punkty pobierane zbiorczo - stała liczba zapytań niezależnie od liczby tras;
+            # trasy spakowane mają je w geometrii (magazyn.py)
+            queryset = queryset.select_related('geometria').prefetch_related(
+                Prefetch('punkty', queryset=PunktTrasy.objects.order_by('kolejnosc'))
+            )
+        return queryset
     
-    @action(detail=True, methods=['get'], url_path='punkty-details')
+    def _filtruj_metryki(self, queryset):
+        # Zakresy metryk, np. ?dlugosc_min=100&liczba_punktow_max=50 - filtrowane w bazie
+        for parametr, warunek in FILTRY_METRYK.items():
+            wartosc = self.request.query_params.get(parametr)
+            if wartosc is None:
+                continue
+            try:
+                queryset = queryset.filter(**{warunek: float(wartosc)})
+            except ValueError:
+                raise ValidationError({parametr: ['Podaj liczbę.']})
+        return queryset
+    
+    def _filtruj_obszar(self, queryset):
+        # Trasy przechodzące przez obszar mapy, np. ?obraz_tla=1&bbox=0,0,500,500 - indeks siatki punktów
+        obraz_tla = self.request.query_params.get('obraz_tla')
+        if obraz_tla is not None:
+            if not obraz_tla.isdigit():
+                raise ValidationError({'obraz_tla': ['Podaj identyfikator obrazu tła.']})
+            queryset = queryset.filter(obraz_tla_id=int(obraz_tla))
+        return trasy_przez_obszar(queryset, *obszar_z_zapytania(self.request))
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return TrasaPodsumowanieSerializer
+        return TrasaSerializer
+    
+    def list(self, request, *args, **kwargs):
+        # Stan listy to najnowsza data modyfikacji i liczba tras (usunięcie też zmienia listę)
+        trasy = self.filter_queryset(self.get_queryset())
+        stan = trasy.aggregate(ostatnia=Max('data_modyfikacji'), liczba=Count('id'))
+        ostatnia = stan['ostatnia']
+        tla = []
+        if 'obraz_tla_details' in parametr_listy(request, 'expand'):
+            # Rozwinięte tła należą do stanu listy, a nie mają daty modyfikacji - wtedy tylko ETag
+            tla = ObrazTla.objects.filter(trasy__in=trasy).distinct().order_by('id').values_list(*ObrazTlaSerializer.Meta.fields)
+            ostatnia = None
+        etag = znacznik(request, stan['liczba'], stan['ostatnia'].isoformat() if stan['ostatnia'] else '', *tla)
+        return odpowiedz_warunkowo(request, etag, ostatnia, partial(super().list, request, *args, **kwargs))
+    
+    def retrieve(self, request, *args, **kwargs):
+        # Szczegóły trasy zawsze zawierają obraz_tla_details
+        return odpowiedz_dla_trasy(request, kwargs['pk'], partial(super().retrieve, request, *args, **kwargs), z_tlem=True)
+    
+    @action(detail=False, methods=['get'], renderer_classes=[GeoJsonRenderer, CsvRenderer, GpxRenderer])
+    def eksport(self, request):
+        """
+        Eksport tras użytkownika jako GeoJSON, CSV lub GPX (?format= albo nagłówek Accept),
+        przesyłany strumieniowo. Przyjmuje te same filtry co lista tras, np. ?obraz_tla=
+        dla tras jednej mapy. ?coords=world zamienia piksele na współrzędne geograficzne.
+        """
+        trasy = self.filter_queryset(self.get_queryset())
+        wspolrzedne = request.query_params.get('coords', 'pixel')
+        if wspolrzedne not in ('pixel', 'world'):
+            raise ValidationError({'coords': ['Dozwolone wartości: pixel, world.']})
+        
+        format = request.accepted_renderer.format
+        swiat = wspolrzedne == 'world' or format == GpxRenderer.format
+        if swiat and bez_transformacji(trasy):
+            raise ValidationError({'coords': ['Nie wszystkie obrazy tła mają przekształcenie na współrzędne geograficzne.']})
+        
+        odpowiedz = StreamingHttpResponse(
+            FORMATY_EKSPORTU[format](trasy, swiat), content_type=f'{request.accepted_renderer.media_type}; charset=utf-8'
+        )
+        odpowiedz['Content-Disposition'] = f'attachment; filename="trasy.{format}"'
+        return odpowiedz
+    
+    @action(detail=True, methods=['get'], url_path='punkty-details',
+            renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES + [SpakowanePunktyRenderer])
     def punkty(self, request, pk=None):
         """
         Pobierz wszystkie punkty dla konkretnej trasy
+        (Accept: application/x-trasa-punkty zwraca spakowany format binarny,
+        ?tolerance= lub ?max_points= zwraca trasę uproszczoną; lista JSON jest stronicowana kursorem)
         """
+        return odpowiedz_dla_trasy(request, pk, partial(self._punkty, request))
+    
+    def _punkty(self, request):
         trasa = self.get_object()
-        punkty = PunktTrasy.objects.filter(trasa=trasa).order_by('kolejnosc')
-        serializer = PunktTrasySerializer(punkty, many=True)
-        return Response(serializer.data)
+        try:
+            tolerancja, max_punktow = parametry_uproszczenia(request.query_params)
+        except ValueError as e:
+            raise ValidationError({'detail': str(e)})
+        
+        if tolerancja is not None or max_punktow is not None:
+            tablica = punkty_uproszczone(trasa.id, trasa.rewizja, tolerancja, max_punktow)
+            if request.accepted_renderer.format == SpakowanePunktyRenderer.format:
+                return Response(spakuj_punkty(tablica))
+            return Response([dict(zip(KOLUMNY, wiersz), trasa=trasa.id) for wiersz in tablica.tolist()])
+        
+        if request.accepted_renderer.format == SpakowanePunktyRenderer.format:
+            return Response(spakuj_punkty(tablica_punktow(trasa.id)))
+        
+        # Bez widoku - ?ordering= dotyczy listy tras, a punkty są zawsze w kolejności trasy
+        stronicowanie = KursorPunktow()
+        spakowana = geometria_trasy(trasa.id)
+        if spakowana is not None:
+            # Spakowana trasa jest stronicowana z blobu, bez przywracania wierszy (magazyn.py)
+            return stronicowanie.get_paginated_response(
+                stronicowanie.paginate_queryset(WierszePunktow(spakowana, trasa=trasa.id), request)
+            )
+        strona = stronicowanie.paginate_queryset(PunktTrasy.objects.filter(trasa=trasa), request)
+        return stronicowanie.get_paginated_response(PunktTrasySerializer(strona, many=True).data)
+    
+    @action(detail=True, methods=['get'], renderer_classes=[ObrazPngRenderer, ObrazWebpRenderer])
+    def podglad(self, request, pk=None):
+        """
+        Podgląd trasy narysowanej na tle jako PNG lub WebP (?format=webp albo nagłówek Accept).
+        Rozmiar: ?width= i/lub ?height= (obraz mieści się w obu), ?crop=bbox przycina do trasy.
+        """
+        trasa = self.get_object()
+        try:
+            szerokosc, wysokosc, przyciecie = parametry_podgladu(request.query_params)
+        except ValueError as e:
+            raise ValidationError({'detail': str(e)})
+        
+        renderer = request.accepted_renderer
+        nazwa = podglad_trasy(trasa, szerokosc, wysokosc, przyciecie, renderer.format)
+        return odpowiedz_plikiem(default_storage, nazwa, renderer.media_type)
+    
+    @action(detail=True, methods=['get'])
+    def trafienie(self, request, pk=None):
+        """
+        Punkt i odcinek trasy najbliższe kliknięciu ?x=&y= w promieniu ?radius= (domyślnie 10 px).
+        Pozycja odcinka to miejsce wstawienia punktu na nim (parametr pozycja przy dodawaniu punktu).
+        """
+        trasa = self.get_object()
+        try:
+            x, y, promien = parametry_trafienia(request.query_params)
+        except ValueError as e:
+            raise ValidationError({'detail': str(e)})
+        return Response(najblizsze_trafienie(trasa.id, trasa.rewizja, x, y, promien))
+    
+    @action(detail=True, methods=['post'])
+    def operacje(self, request, pk=None):
+        """
+        Wykonaj listę operacji na punktach {"operacje": [{"operacja": "add", "x": 1, "y": 2}, ...]}
+        atomowo, jako jedną rewizję trasy. Operacje: add (x, y), insert (x, y, pozycja),
+        delete (id), move (id i pozycja albo kierunek up/down), update (id, x i/lub y).
+        """
+        trasa = self.get_object()
+        serializer = OperacjeTrasySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            punkty = wykonaj_operacje(trasa, serializer.validated_data['operacje'])
+        except ValueError as e:
+            raise ValidationError({'operacje': [str(e)]})
+        
+        trasa.refresh_from_db(fields=['rewizja'])
+        return Response({'rewizja': trasa.rewizja, 'punkty': punkty})
+    
+    @action(detail=True, methods=['get'])
+    def zmiany(self, request, pk=None):
+        """
+        Zmiany punktów trasy od rewizji podanej w parametrze ?rewizja=N.
+        Jeśli nie da się ich odtworzyć, odpowiedź zawiera pełną listę punktów.
+        """
+        # Odpowiedź zależy od rewizji klienta - nie warto jej zapamiętywać
+        return odpowiedz_dla_trasy(request, pk, partial(self._zmiany, request), zapamietaj=False)
+    
+    def _zmiany(self, request):
+        trasa = self.get_object()
+        try:
+            od_rewizji = int(request.query_params.get('rewizja', ''))
+        except ValueError:
+            return Response({'rewizja': ['Podaj numer rewizji.']}, status=status.HTTP_400_BAD_REQUEST)
+        
+        rewizja, zmiany = zmiany_od(trasa.id, od_rewizji)
+        if zmiany is not None:
+            return Response({'rewizja': rewizja, 'zmiany': zmiany})
+        
+        punkty = [dict(zip(KOLUMNY, wiersz)) for wiersz in tablica_punktow(trasa.id).tolist()]
+        return Response({'rewizja': rewizja, 'punkty': punkty})
 
 class PunktTrasyViewSet(viewsets.ModelViewSet):
     """
@@ -49,6 +350,25 @@ class PunktTrasyViewSet(viewsets.ModelViewSet):
     """
     serializer_class = PunktTrasySerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KursorPunktow
+    
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Zmiany pojedynczych punktów działają na wierszach - spakowana trasa wraca do nich (magazyn.py).
+        # Odczyty są obsługiwane z blobu (_spakowana)
+        trasa_id = kwargs.get('trasa_id')
+        if (trasa_id and request.method not in permissions.SAFE_METHODS
+                and GeometriaTrasy.objects.filter(trasa_id=trasa_id, trasa__uzytkownik=request.user).exists()):
+            rozpakuj_trase(trasa_id)
+    
+    def _spakowana(self):
+        """
+        Tablica punktów spakowanej trasy użytkownika z adresu albo None
+        """
+        dane = GeometriaTrasy.objects.filter(
+            trasa_id=self.kwargs['trasa_id'], trasa__uzytkownik=self.request.user
+        ).values_list('dane', flat=True).first()
+        return None if dane is None else rozpakuj_geometrie(dane)
     
     def get_queryset(self):
         # Filtruj punkty na podstawie ID trasy, jeśli zostało podane
@@ -57,13 +377,97 @@ class PunktTrasyViewSet(viewsets.ModelViewSet):
             return PunktTrasy.objects.filter(trasa_id=trasa_id, trasa__uzytkownik=self.request.user)
         return PunktTrasy.objects.filter(trasa__uzytkownik=self.request.user)
     
+    def list(self, request, *args, **kwargs):
+        return odpowiedz_dla_trasy(request, kwargs['trasa_id'], partial(self._lista, request, *args, **kwargs))
+    
+    def _lista(self, request, *args, **kwargs):
+        spakowana = self._spakowana()
+        if spakowana is None:
+            return super().list(request, *args, **kwargs)
+        return self.get_paginated_response(self.paginate_queryset(WierszePunktow(spakowana, trasa=kwargs['trasa_id'])))
+    
+    def retrieve(self, request, *args, **kwargs):
+        spakowana = self._spakowana()
+        if spakowana is None:
+            return super().retrieve(request, *args, **kwargs)
+        wiersze = spakowana[spakowana[:, KOLUMNY.index('id')] == kwargs['pk']].tolist()
+        if not wiersze:
+            raise NotFound()
+        return Response(dict(zip(KOLUMNY, wiersze[0]), trasa=kwargs['trasa_id']))
+    
     def perform_create(self, serializer):
         # Pobierz trasę na podstawie URL-a
         trasa_id = self.kwargs.get('trasa_id')
         trasa = get_object_or_404(Trasa, id=trasa_id, uzytkownik=self.request.user)
         
-        # Ustal kolejność
-        ostatni_punkt = PunktTrasy.objects.filter(trasa=trasa).order_by('-kolejnosc').first()
-        kolejnosc = 1 if not ostatni_punkt else ostatni_punkt.kolejnosc + 1
+        # Wstawienie między istniejące punkty
+        pozycja = serializer.validated_data.pop('pozycja', None)
+        if pozycja is not None:
+            serializer.instance = wstaw_punkt(
+                trasa, serializer.validated_data['x'], serializer.validated_data['y'], pozycja
+            )
+            return
         
-        serializer.save(trasa=trasa, kolejnosc=kolejnosc)
\ No newline at end of file
+        # Punkt na końcu trasy - kolejność nadawana atomowo
+        serializer.instance = dodaj_punkt(PunktTrasy(trasa=trasa, **serializer.validated_data))
+    
+    def perform_update(self, serializer):
+        # Pozycja dotyczy tylko wstawiania - do przenoszenia służy move_to
+        serializer.validated_data.pop('pozycja', None)
+        serializer.save()
+    
+    def move_to(self, request, trasa_id=None, pk=None):
+        """
+        Przenieś punkt na podaną pozycję trasy (od 1) - zmienia się tylko jeden wiersz
+        """
+        punkt = self.get_object()
+        serializer = PozycjaPunktuSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        przesun_na_pozycje(punkt, serializer.validated_data['pozycja'])
+        return Response(PunktTrasySerializer(punkt).data)
+    
+    def bulk_create(self, request, trasa_id=None):
+        """
+        Dodaj wiele punktów na koniec trasy w jednym żądaniu
+        """
+        trasa = get_object_or_404(Trasa, id=trasa_id, uzytkownik=request.user)
+        
+        # Akceptujemy zarówno samą listę punktów, jak i obiekt {"punkty": [...]}
+        dane = {'punkty': request.data} if isinstance(request.data, list) else request.data
+        serializer = PunktTrasyBulkSerializer(data=dane)
+        serializer.is_valid(raise_exception=True)
+        
+        wspolrzedne = serializer.validated_data['punkty']
+        pierwsza, ostatnia = dodaj_punkty(trasa, wspolrzedne)
+        return Response({
+            'liczba': len(wspolrzedne),
+            'pierwsza_kolejnosc': pierwsza,
+            'ostatnia_kolejnosc': ostatnia,
+        }, status=status.HTTP_201_CREATED)
+
+class ImportTrasViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin,
+                        viewsets.GenericViewSet):
+    """
+    API endpoint importu tras z plików GPX, GeoJSON i CSV - plik jest przetwarzany w tle,
+    a status i postęp importu są widoczne w jego szczegółach
+    """
+    serializer_class = ImportTrasSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        return ImportTras.objects.filter(uzytkownik=self.request.user).order_by('-data_utworzenia', '-id')
+    
+    def perform_create(self, serializer):
+        zlecenie = serializer.save(uzytkownik=self.request.user)
+        zlec(wykonaj_import, zlecenie.id)
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([permissions.IsAdminUser])
+def pamiec_statystyki(request):
+    """
+    Liczniki trafień i chybień pamięci odpowiedzi tras (DELETE je zeruje) - tylko dla administratorów
+    """
+    if request.method == 'DELETE':
+        wyzeruj_statystyki()
+    return Response(statystyki())
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class TrasyAppConfig(AppConfig):
     name = 'trasy_app'
+
+    def ready(self):
+        # Odbiorniki sygnałów unieważniające pamięć odpowiedzi tras, publikujące rewizje
+        # w kanałach zmian i ustawiające nowe połączenia z bazą; sprawdzenie pamięci postępu importów
+        from . import baza, importowanie, kanaly, pamiec  # noqa: F401
@@ -0,0 +1,214 @@
+"""
+Asynchroniczne wersje widoków odczytu tras - punkty trasy, lista i szczegóły tras, eksport.
+
+Pod serwerem ASGI (trasy_projekt/asgi.py) odpowiedzi są wysyłane strumieniowo z pętli
+zdarzeń, a punkty czytane paczkami przez asynchroniczny ORM. Powolny klient pobierający
+długą trasę nie zajmuje więc wątku na czas przesyłania - wątek obsługujący zapytania do
+bazy jest potrzebny tylko na chwilę odczytu kolejnej paczki. Pod WSGI te same adresy też
+działają, ale bez tej korzyści; odpowiedzi są takie same jak w widokach synchronicznych.
+
+Logowanie: sesja albo nagłówek 'Authorization: Token ...' jak w API.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Max
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.authtoken.models import Token
+
+from .api_views import CsvRenderer, GeoJsonRenderer, GpxRenderer
+from .eksport import FORMATY as FORMATY_EKSPORTU, PUNKTY_NA_FRAGMENT, ROZMIAR_PACZKI_EKSPORTU, bez_transformacji
+from .geometria import parametry_uproszczenia
+from .kodowanie import KOLUMNY, akceptuje_spakowane
+from .magazyn import rozpakuj_geometrie
+from .models import GeometriaTrasy, PunktTrasy, Trasa
+from .serializers import TrasaPodsumowanieSerializer
+from .views import odpowiedz_punktami
+from .warunkowe import odpowiedz_dla_trasy, odpowiedz_warunkowo, znacznik
+
+TYPY_EKSPORTU = {renderer.format: renderer.media_type for renderer in (GeoJsonRenderer, CsvRenderer, GpxRenderer)}
+
+
+async def _uzytkownik(request):
+    """
+    Zalogowany użytkownik zapytania albo None
+    """
+    naglowek = request.headers.get('Authorization', '').split()
+    if len(naglowek) == 2 and naglowek[0] == 'Token':
+        token = await Token.objects.select_related('user').filter(key=naglowek[1]).afirst()
+        return token.user if token is not None and token.user.is_active else None
+    uzytkownik = await request.auser()
+    return uzytkownik if uzytkownik.is_authenticated else None
+
+
+def _blad(tresc, status):
+    return JsonResponse({'detail': tresc}, status=status)
+
+
+def _brak_logowania():
+    return _blad('Nie podano danych uwierzytelniających.', 401)
+
+
+async def _punkty_json(trasa_id, **dodatkowe):
+    """
+    Punkty trasy (słowniki id, x, y, kolejnosc) w kolejności - z bazy paczkami albo ze spakowanej geometrii
+    """
+    dane = await GeometriaTrasy.objects.filter(trasa_id=trasa_id).values_list('dane', flat=True).afirst()
+    if dane is not None:
+        for wiersz in rozpakuj_geometrie(dane).tolist():
+            yield dict(zip(KOLUMNY, wiersz), **dodatkowe)
+        return
+    # values() zamiast values_list() - aiterator() wykonałby zapytanie values_list() od razu, w pętli zdarzeń
+    wiersze = PunktTrasy.objects.filter(trasa_id=trasa_id).order_by('kolejnosc').values(*KOLUMNY)
+    async for wiersz in wiersze.aiterator(chunk_size=ROZMIAR_PACZKI_EKSPORTU):
+        yield dict(wiersz, **dodatkowe)
+
+
+async def _paczki(elementy, rozmiar=PUNKTY_NA_FRAGMENT):
+    paczka = []
+    async for element in elementy:
+        paczka.append(element)
+        if len(paczka) == rozmiar:
+            yield paczka
+            paczka = []
+    if paczka:
+        yield paczka
+
+
+async def _lista_json(poczatek, elementy, koniec):
+    """
+    Fragmenty dokumentu JSON z listą słowników czytanych z asynchronicznego iteratora
+    """
+    yield poczatek
+    pierwsza = True
+    async for paczka in _paczki(elementy):
+        yield ('' if pierwsza else ', ') + json.dumps(paczka)[1:-1]
+        pierwsza = False
+    yield koniec
+
+
+async def punkty_trasy(request, trasa_id):
+    """
+    Asynchroniczny odpowiednik views.get_punkty - pełna lista punktów w JSON jest wysyłana
+    strumieniowo; format spakowany i trasy uproszczone korzystają z widoku synchronicznego
+    """
+    uzytkownik = await _uzytkownik(request)
+    if uzytkownik is None:
+        return _brak_logowania()
+    trasa = await Trasa.objects.filter(id=trasa_id, uzytkownik=uzytkownik).afirst()
+    if trasa is None:
+        return _blad('Nie znaleziono.', 404)
+    try:
+        tolerancja, max_punktow = parametry_uproszczenia(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    stan = (trasa.rewizja, trasa.data_modyfikacji)
+    if tolerancja is not None or max_punktow is not None or akceptuje_spakowane(request):
+        # Odpowiedź w jednym kawałku - z pamięci odpowiedzi albo wyliczona w wątku
+        return await sync_to_async(odpowiedz_dla_trasy)(
+            request, trasa.id, lambda: odpowiedz_punktami(request, trasa.id, tolerancja, max_punktow), stan=stan
+        )
+
+    def widok():
+        # Rewizja przeczytana przed punktami - jak w views.odpowiedz_punktami
+        response = StreamingHttpResponse(
+            _lista_json(f'{{"success": true, "rewizja": {trasa.rewizja}, "punkty": [', _punkty_json(trasa.id), ']}'),
+            content_type='application/json',
+        )
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    etag = znacznik(request, trasa.id, trasa.rewizja, trasa.data_modyfikacji.isoformat())
+    return odpowiedz_warunkowo(request, etag, trasa.data_modyfikacji, widok)
+
+
+async def lista_tras(request):
+    """
+    Lista tras użytkownika (podsumowania bez punktów) od ostatnio zmienianej, wysyłana strumieniowo.
+    ?obraz_tla= zawęża ją do tras jednej mapy.
+    """
+    uzytkownik = await _uzytkownik(request)
+    if uzytkownik is None:
+        return _brak_logowania()
+    queryset = Trasa.objects.filter(uzytkownik=uzytkownik).order_by('-data_modyfikacji', '-id')
+    obraz_tla = request.GET.get('obraz_tla')
+    if obraz_tla is not None:
+        if not obraz_tla.isdigit():
+            return _blad('Podaj identyfikator obrazu tła.', 400)
+        queryset = queryset.filter(obraz_tla_id=int(obraz_tla))
+
+    async def podsumowania():
+        async for trasa in queryset.aiterator(chunk_size=100):
+            yield TrasaPodsumowanieSerializer(trasa).data
+
+    stan = await queryset.aaggregate(ostatnia=Max('data_modyfikacji'), liczba=Count('id'))
+    ostatnia = stan['ostatnia']
+    etag = znacznik(request, stan['liczba'], ostatnia.isoformat() if ostatnia else '')
+    return odpowiedz_warunkowo(request, etag, ostatnia, lambda: StreamingHttpResponse(
+        _lista_json('[', podsumowania(), ']'), content_type='application/json'
+    ))
+
+
+async def szczegoly_trasy(request, trasa_id):
+    """
+    Szczegóły trasy z punktami (pola jak w podsumowaniu z listy tras), wysyłane strumieniowo
+    """
+    uzytkownik = await _uzytkownik(request)
+    if uzytkownik is None:
+        return _brak_logowania()
+    trasa = await Trasa.objects.filter(id=trasa_id, uzytkownik=uzytkownik).afirst()
+    if trasa is None:
+        return _blad('Nie znaleziono.', 404)
+
+    def widok():
+        dane = json.dumps(TrasaPodsumowanieSerializer(trasa).data)
+        return StreamingHttpResponse(
+            _lista_json(dane[:-1] + ', "punkty": [', _punkty_json(trasa.id, trasa=trasa.id), ']}'),
+            content_type='application/json',
+        )
+
+    etag = znacznik(request, trasa.id, trasa.rewizja, trasa.data_modyfikacji.isoformat())
+    return odpowiedz_warunkowo(request, etag, trasa.data_modyfikacji, widok)
+
+
+async def _asynchronicznie(fragmenty):
+    # Generatory eksportu czytają bazę kursorem - kolejne fragmenty powstają w wątku
+    # zapytań do bazy, a pętla zdarzeń w tym czasie obsługuje innych klientów
+    nastepny = sync_to_async(next)
+    while (fragment := await nastepny(fragmenty, None)) is not None:
+        yield fragment
+
+
+async def eksport_tras(request):
+    """
+    Eksport tras użytkownika jak w API (?format=geojson|csv|gpx, ?coords=pixel|world,
+    ?obraz_tla=), przesyłany strumieniowo
+    """
+    uzytkownik = await _uzytkownik(request)
+    if uzytkownik is None:
+        return _brak_logowania()
+    format = request.GET.get('format', GeoJsonRenderer.format)
+    if format not in TYPY_EKSPORTU:
+        return _blad(f'Dozwolone formaty: {", ".join(TYPY_EKSPORTU)}.', 400)
+    wspolrzedne = request.GET.get('coords', 'pixel')
+    if wspolrzedne not in ('pixel', 'world'):
+        return _blad('Dozwolone wartości coords: pixel, world.', 400)
+
+    trasy = Trasa.objects.filter(uzytkownik=uzytkownik)
+    obraz_tla = request.GET.get('obraz_tla')
+    if obraz_tla is not None:
+        if not obraz_tla.isdigit():
+            return _blad('Podaj identyfikator obrazu tła.', 400)
+        trasy = trasy.filter(obraz_tla_id=int(obraz_tla))
+    swiat = wspolrzedne == 'world' or format == GpxRenderer.format
+    if swiat and await sync_to_async(bez_transformacji)(trasy):
+        return _blad('Nie wszystkie obrazy tła mają przekształcenie na współrzędne geograficzne.', 400)
+
+    odpowiedz = StreamingHttpResponse(
+        _asynchronicznie(FORMATY_EKSPORTU[format](trasy, swiat)),
+        content_type=f'{TYPY_EKSPORTU[format]}; charset=utf-8',
+    )
+    odpowiedz['Content-Disposition'] = f'attachment; filename="trasy.{format}"'
+    return odpowiedz
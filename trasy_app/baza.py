@@ -0,0 +1,19 @@
+"""
+Ustawienia połączeń z bazą SQLite - pragmy z TRASY_SQLITE_PRAGMY (patrz settings.py)
+wykonywane przy każdym nowym połączeniu, bo większość z nich dotyczy tylko połączenia.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def ustaw_pragmy_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmy = getattr(settings, 'TRASY_SQLITE_PRAGMY', {})
+    if not pragmy:
+        return
+    with connection.cursor() as cursor:
+        for nazwa, wartosc in pragmy.items():
+            cursor.execute(f'PRAGMA {nazwa} = {wartosc}')
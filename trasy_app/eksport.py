@@ -0,0 +1,168 @@
+"""
+Eksport tras do plików GeoJSON, CSV i GPX przesyłanych strumieniowo.
+
+Punkty wszystkich eksportowanych tras są czytane jednym zapytaniem w kolejności
+(trasa, kolejnosc) - z indeksu unikalności - paczkami przez .iterator(), a wynik
+jest wysyłany fragmentami w trakcie czytania. Pamięć nie zależy więc od liczby
+punktów, tylko od liczby tras (ich nazwy i opisy są pobierane z góry). Trasy spakowane
+(magazyn.py) są dekodowane po jednej, po trasach zapisanych w wierszach.
+
+Współrzędne są domyślnie pikselami obrazu tła; z parametrem swiat=True są
+przeliczane przekształceniem ObrazTla.transformacja na długość i szerokość geograficzną.
+Trasy bez punktów są pomijane.
+"""
+import csv
+import io
+import json
+from itertools import chain, groupby, islice
+from operator import itemgetter
+from xml.sax.saxutils import escape
+
+from .magazyn import geometrie_tras
+from .models import PunktTrasy
+
+# Liczba wierszy pobieranych z bazy naraz
+ROZMIAR_PACZKI_EKSPORTU = 2000
+# Liczba punktów w jednym fragmencie odpowiedzi
+PUNKTY_NA_FRAGMENT = 1000
+
+
+def przeksztalcenie(transformacja):
+    """
+    Funkcja (x, y) -> (dl, szer) dla współczynników [a, b, c, d, e, f] albo None
+    """
+    if not transformacja:
+        return None
+    a, b, c, d, e, f = transformacja
+    return lambda x, y: (a * x + b * y + c, d * x + e * y + f)
+
+
+def przeksztalcenie_odwrotne(transformacja):
+    """
+    Funkcja (dl, szer) -> (x, y) odwrotna do przeksztalcenie() albo None,
+    jeśli przekształcenia nie ma lub nie da się go odwrócić
+    """
+    if not transformacja:
+        return None
+    a, b, c, d, e, f = transformacja
+    wyznacznik = a * e - b * d
+    if wyznacznik == 0:
+        return None
+    return lambda dl, szer: ((e * (dl - c) - b * (szer - f)) / wyznacznik,
+                             (a * (szer - f) - d * (dl - c)) / wyznacznik)
+
+
+def bez_transformacji(trasy):
+    """
+    Czy wśród tras są takie, których tło nie ma przekształcenia na współrzędne geograficzne
+    """
+    return trasy.filter(obraz_tla__transformacja__isnull=True).exists()
+
+
+def _trasy_z_punktami(trasy, swiat):
+    """
+    Pary (trasa, wspolrzedne) - trasa to słownik id, nazwa, opis, a wspolrzedne
+    to iterator par w kolejności trasy, czytany wprost z kursora bazy
+    """
+    opisy = {
+        trasa['id']: trasa
+        for trasa in trasy.order_by().values('id', 'nazwa', 'opis', 'obraz_tla__transformacja')
+    }
+    punkty = (
+        PunktTrasy.objects.filter(trasa_id__in=trasy.order_by().values('id'))
+        .order_by('trasa_id', 'kolejnosc').values_list('trasa_id', 'x', 'y')
+        .iterator(chunk_size=ROZMIAR_PACZKI_EKSPORTU)
+    )
+    grupy = chain(
+        groupby(punkty, key=itemgetter(0)),
+        # Trasy spakowane (magazyn.py) nie mają wierszy - ich punkty są w blobie
+        ((trasa_id, ((trasa_id, x, y) for x, y in tablica[:, 1:3].tolist()))
+         for trasa_id, tablica in geometrie_tras(trasy) if len(tablica)),
+    )
+    for trasa_id, grupa in grupy:
+        trasa = opisy[trasa_id]
+        funkcja = przeksztalcenie(trasa['obraz_tla__transformacja']) if swiat else None
+        if funkcja is None:
+            yield trasa, ((x, y) for _, x, y in grupa)
+        else:
+            yield trasa, (funkcja(x, y) for _, x, y in grupa)
+
+
+def _paczki(elementy, rozmiar=PUNKTY_NA_FRAGMENT):
+    elementy = iter(elementy)
+    while paczka := list(islice(elementy, rozmiar)):
+        yield paczka
+
+
+def _punkt(swiat):
+    if swiat:
+        return lambda x, y: f'[{x:.7f},{y:.7f}]'
+    return lambda x, y: f'[{x},{y}]'
+
+
+def eksport_geojson(trasy, swiat=False):
+    """
+    FeatureCollection z trasami jako LineString
+    """
+    punkt = _punkt(swiat)
+    yield '{"type": "FeatureCollection", "features": ['
+    for i, (trasa, wspolrzedne) in enumerate(_trasy_z_punktami(trasy, swiat)):
+        wlasciwosci = json.dumps(
+            {'id': trasa['id'], 'nazwa': trasa['nazwa'], 'opis': trasa['opis']}, ensure_ascii=False
+        )
+        yield (f'{"," if i else ""}\n{{"type": "Feature", "properties": {wlasciwosci}, '
+               f'"geometry": {{"type": "LineString", "coordinates": [')
+        for j, paczka in enumerate(_paczki(wspolrzedne)):
+            yield ('' if j == 0 else ',') + ','.join(punkt(x, y) for x, y in paczka)
+        yield ']}}'
+    yield '\n]}\n'
+
+
+def eksport_csv(trasy, swiat=False):
+    """
+    Jeden wiersz na punkt: trasa, pozycja punktu w trasie (od 1) i współrzędne
+    """
+    bufor = io.StringIO()
+    zapis = csv.writer(bufor)
+
+    def fragment(wiersze):
+        zapis.writerows(wiersze)
+        tekst = bufor.getvalue()
+        bufor.seek(0)
+        bufor.truncate()
+        return tekst
+
+    yield fragment([['trasa_id', 'trasa', 'pozycja', 'dl', 'szer'] if swiat else
+                    ['trasa_id', 'trasa', 'pozycja', 'x', 'y']])
+    for trasa, wspolrzedne in _trasy_z_punktami(trasy, swiat):
+        if swiat:
+            wspolrzedne = ((round(dl, 7), round(szer, 7)) for dl, szer in wspolrzedne)
+        for paczka in _paczki(enumerate(wspolrzedne, start=1)):
+            yield fragment([trasa['id'], trasa['nazwa'], pozycja, x, y] for pozycja, (x, y) in paczka)
+
+
+def eksport_gpx(trasy, swiat=True):
+    """
+    Plik GPX 1.1 z trasami jako ścieżkami (trk). GPX ma zawsze współrzędne geograficzne,
+    więc wszystkie trasy muszą leżeć na tłach z przekształceniem (patrz bez_transformacji).
+    """
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="trasy" xmlns="http://www.topografix.com/GPX/1/1">\n')
+    for trasa, wspolrzedne in _trasy_z_punktami(trasy, swiat=True):
+        yield f'<trk><name>{escape(trasa["nazwa"])}</name>'
+        if trasa['opis']:
+            yield f'<desc>{escape(trasa["opis"])}</desc>'
+        yield '<trkseg>\n'
+        for paczka in _paczki(wspolrzedne):
+            yield ''.join(
+                f'<trkpt lat="{szer:.7f}" lon="{dl:.7f}"/>\n' for dl, szer in paczka
+            )
+        yield '</trkseg></trk>\n'
+    yield '</gpx>\n'
+
+
+FORMATY = {
+    'geojson': eksport_geojson,
+    'csv': eksport_csv,
+    'gpx': eksport_gpx,
+}
@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from .models import Trasa, PunktTrasy, ObrazTla
+from .services import dodaj_punkt, zarezerwuj_kolejnosc
 
 class UserRegisterForm(UserCreationForm):
     email = forms.EmailField()
@@ -28,9 +29,10 @@ class PunktTrasyForm(forms.ModelForm):
         punkt = super(PunktTrasyForm, self).save(commit=False)
         if self.trasa:
             punkt.trasa = self.trasa
-            # Ustaw kolejność punktu na ostatni + 1
-            ostatni_punkt = PunktTrasy.objects.filter(trasa=self.trasa).order_by('-kolejnosc').first()
-            punkt.kolejnosc = 1 if not ostatni_punkt else ostatni_punkt.kolejnosc + 1
+            # Punkt na końcu trasy - kolejność nadawana atomowo
+            if commit:
+                return dodaj_punkt(punkt)
+            punkt.kolejnosc = zarezerwuj_kolejnosc(self.trasa.id)
         
         if commit:
             punkt.save()
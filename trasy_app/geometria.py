@@ -0,0 +1,109 @@
+"""
+Upraszczanie łamanych tras (algorytm Douglasa-Peuckera) i poziomy szczegółowości.
+
+Zamiast liczyć uproszczenie osobno dla każdej tolerancji, dla każdego punktu liczymy jego
+"ważność" - największą tolerancję, przy której Douglas-Peucker jeszcze go zachowuje.
+Ważność punktu nie przekracza ważności punktu, który podzielił odcinek nad nim, więc punkty
+uproszczonej trasy to dokładnie punkty o ważności większej od tolerancji, a trasa
+ograniczona do k punktów to k najważniejszych punktów. Jedna tablica obsługuje więc
+dowolny poziom szczegółowości i jest trzymana w pamięci podręcznej dla rewizji trasy.
+"""
+import numpy as np
+from django.core.cache import cache
+
+from .services import tablica_punktow
+
+# Czas przechowywania poziomów szczegółowości w pamięci podręcznej (sekundy).
+# Klucz zawiera rewizję trasy, więc zmiana punktów nie wymaga czyszczenia wpisów.
+CZAS_PAMIECI_LOD = 60 * 60
+
+
+def _odleglosci(punkty, a, b):
+    """
+    Odległości punktów (m, 2) od odcinka ab
+    """
+    ab = b - a
+    dlugosc2 = ab @ ab
+    if dlugosc2 == 0:
+        return np.hypot(*(punkty - a).T)
+    t = np.clip((punkty - a) @ ab / dlugosc2, 0.0, 1.0)
+    return np.hypot(*(punkty - a - t[:, None] * ab).T)
+
+
+def waznosc_punktow(xy):
+    """
+    Ważność punktów łamanej xy (n, 2) według Douglasa-Peuckera.
+    Końce łamanej mają ważność nieskończoną, punkty współliniowe - zero.
+    """
+    xy = np.asarray(xy, dtype=np.float64)
+    n = len(xy)
+    waznosc = np.zeros(n)
+    if n == 0:
+        return waznosc
+    waznosc[[0, -1]] = np.inf
+
+    # Rekurencję zastępuje stos - trasy mają nawet setki tysięcy punktów
+    stos = [(0, n - 1, np.inf)]
+    while stos:
+        poczatek, koniec, limit = stos.pop()
+        if koniec - poczatek < 2:
+            continue
+        odleglosci = _odleglosci(xy[poczatek + 1:koniec], xy[poczatek], xy[koniec])
+        i = int(np.argmax(odleglosci))
+        podzial = poczatek + 1 + i
+        waznosc[podzial] = min(odleglosci[i], limit)
+        stos.append((poczatek, podzial, waznosc[podzial]))
+        stos.append((podzial, koniec, waznosc[podzial]))
+    return waznosc
+
+
+def parametry_uproszczenia(parametry):
+    """
+    Odczytuje (tolerancja, max_punktow) z parametrów zapytania ?tolerance= i ?max_points=.
+    Brakujący parametr to None; niepoprawne wartości zgłaszają ValueError.
+    """
+    tolerancja = parametry.get('tolerance')
+    max_punktow = parametry.get('max_points')
+    if tolerancja is not None:
+        try:
+            tolerancja = float(tolerancja)
+        except ValueError:
+            raise ValueError('Parametr tolerance musi być liczbą.')
+        if not tolerancja >= 0:
+            raise ValueError('Parametr tolerance nie może być ujemny.')
+    if max_punktow is not None:
+        if not max_punktow.isdigit() or int(max_punktow) < 2:
+            raise ValueError('Parametr max_points musi być liczbą całkowitą nie mniejszą niż 2.')
+        max_punktow = int(max_punktow)
+    return tolerancja, max_punktow
+
+
+def _poziomy_szczegolowosci(trasa_id, rewizja):
+    """
+    Punkty trasy posortowane od najważniejszego wraz z ich ważnością - z pamięci podręcznej
+    """
+    klucz = f'trasy:lod:{trasa_id}:{rewizja}'
+    poziomy = cache.get(klucz)
+    if poziomy is None:
+        tablica = tablica_punktow(trasa_id)
+        waznosc = waznosc_punktow(tablica[:, 1:3])
+        porzadek = np.argsort(-waznosc, kind='stable')
+        poziomy = (tablica[porzadek], waznosc[porzadek])
+        cache.set(klucz, poziomy, CZAS_PAMIECI_LOD)
+    return poziomy
+
+
+def punkty_uproszczone(trasa_id, rewizja, tolerancja=None, max_punktow=None):
+    """
+    Tablica punktów jak z tablica_punktow, ograniczona do punktów uproszczonej trasy:
+    ważniejszych niż tolerancja i nie więcej niż max_punktow
+    """
+    tablica, waznosc = _poziomy_szczegolowosci(trasa_id, rewizja)
+    n = len(waznosc)
+    if tolerancja is not None:
+        # Ważności są malejące - liczba punktów o ważności większej od tolerancji
+        n = int(np.searchsorted(-waznosc, -tolerancja, side='left'))
+    if max_punktow is not None:
+        n = min(n, max_punktow)
+    wybrane = tablica[:n]
+    return wybrane[np.argsort(wybrane[:, 3], kind='stable')]
@@ -0,0 +1,390 @@
+"""
+Import tras z plików GPX, GeoJSON i CSV - odwrotność eksport.py.
+
+Pliki są czytane przyrostowo: GPX przez iterparse z usuwaniem przetworzonych elementów,
+GeoJSON własnym przyrostowym analizatorem JSON, CSV wiersz po wierszu. Każdy analizator
+zwraca zdarzenia ('punkt', (x, y)) oraz ('koniec', {'nazwa': ..., 'opis': ...}) na końcu
+trasy. Punkty są zapisywane paczkami przez services.dodaj_punkty, więc pamięć nie zależy
+od rozmiaru pliku. Cały import to jedna transakcja i jedna rewizja na trasę
+(rewizje.grupuj_zmiany) - błąd w środku pliku nie zostawia połowy tras.
+"""
+import csv
+import io
+import json
+import logging
+import math
+import posixpath
+import re
+import xml.etree.ElementTree as ET
+from json.decoder import scanstring
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db.models import Sum
+
+from .eksport import przeksztalcenie_odwrotne
+from .models import ImportTras, Trasa
+from .rewizje import grupuj_zmiany
+from .services import ROZMIAR_PACZKI, dodaj_punkty
+
+ROZMIAR_FRAGMENTU = 1 << 16
+# Zapas znaków w buforze analizatora JSON - liczby i stałe są krótsze, więc nie zostaną przecięte
+ZAPAS = 64
+MAKS_WSPOLRZEDNA = 2 ** 31 - 1
+MAKS_NAZWA = Trasa._meta.get_field('nazwa').max_length
+# Czas przechowywania postępu importu w pamięci podręcznej (sekundy)
+CZAS_POSTEPU = 60 * 60
+# Backendy pamięci widoczne tylko w jednym procesie
+PAMIECI_PROCESU = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+logger = logging.getLogger(__name__)
+
+_BIALE = re.compile(r'[ \t\n\r]*')
+_LICZBA = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?')
+_STALE = {'true': True, 'false': False, 'null': None}
+
+
+def zdarzenia_json(plik, rozmiar_fragmentu=ROZMIAR_FRAGMENTU):
+    """
+    Przyrostowy analizator JSON dla pliku tekstowego czytanego fragmentami.
+    Zwraca zdarzenia (typ, wartosc): '{', '}', '[', ']' z wartością None,
+    'klucz' z nazwą klucza obiektu oraz 'wartosc' z napisem, liczbą, True, False lub None.
+    Pamięć zależy od najdłuższego pojedynczego napisu, a nie od rozmiaru pliku.
+    """
+    bufor, i, koniec_pliku = '', 0, False
+    kontenery = []
+    klucz = False
+
+    while True:
+        if len(bufor) - i < ZAPAS and not koniec_pliku:
+            bufor = bufor[i:]
+            i = 0
+            while len(bufor) < ZAPAS and not koniec_pliku:
+                fragment = plik.read(rozmiar_fragmentu)
+                koniec_pliku = not fragment
+                bufor += fragment
+        i = _BIALE.match(bufor, i).end()
+        if i == len(bufor):
+            if koniec_pliku:
+                break
+            continue
+
+        znak = bufor[i]
+        if znak == '"':
+            try:
+                tekst, i_konca = scanstring(bufor, i + 1)
+            except json.JSONDecodeError:
+                if koniec_pliku:
+                    raise ValueError('Niedokończony napis w pliku JSON.')
+                # Napis dłuższy niż bufor - dociągamy dane i próbujemy jeszcze raz
+                fragment = plik.read(rozmiar_fragmentu)
+                koniec_pliku = not fragment
+                bufor += fragment
+                continue
+            i = i_konca
+            yield ('klucz' if klucz else 'wartosc'), tekst
+            klucz = False
+        elif znak in '{[':
+            kontenery.append(znak)
+            klucz = znak == '{'
+            i += 1
+            yield znak, None
+        elif znak in '}]':
+            if not kontenery or kontenery.pop() != '{['[znak == ']']:
+                raise ValueError('Niedopasowany nawias w pliku JSON.')
+            klucz = False
+            i += 1
+            yield znak, None
+        elif znak == ',':
+            klucz = bool(kontenery) and kontenery[-1] == '{'
+            i += 1
+        elif znak == ':':
+            i += 1
+        elif (m := _LICZBA.match(bufor, i)) is not None:
+            tekst = m.group()
+            i = m.end()
+            yield 'wartosc', float(tekst) if any(z in tekst for z in '.eE') else int(tekst)
+        else:
+            stala = next((s for s in _STALE if bufor.startswith(s, i)), None)
+            if stala is None:
+                raise ValueError(f'Niepoprawny znak {znak!r} w pliku JSON.')
+            i += len(stala)
+            yield 'wartosc', _STALE[stala]
+    if kontenery:
+        raise ValueError('Niedokończony plik JSON.')
+
+
+def _zdarzenia_geojson(plik, swiat):
+    """
+    Trasy z pliku GeoJSON: każdy obiekt Feature (lub plik będący jednym Feature) to trasa,
+    a jej punkty to wszystkie pozycje z geometry.coordinates (LineString, MultiLineString...).
+    Nazwa i opis pochodzą z właściwości nazwa/name i opis/description.
+    """
+    plik = io.TextIOWrapper(plik, encoding='utf-8')
+    # Klucze, pod którymi otwarto kolejne kontenery ('*' - element tablicy, '' - korzeń)
+    sciezka = []
+    kontenery = []
+    biezacy_klucz = None
+    liczby = []
+    wspolrzedne = None
+    wlasciwosci = {}
+
+    for typ, wartosc in zdarzenia_json(plik):
+        if typ == 'klucz':
+            biezacy_klucz = wartosc
+            continue
+        nazwa = biezacy_klucz if kontenery and kontenery[-1] == '{' else ('*' if kontenery else '')
+
+        if typ in '{[':
+            sciezka.append(nazwa)
+            kontenery.append(typ)
+            biezacy_klucz = None
+            if typ == '{' and sciezka in ([''], ['', 'features', '*']):
+                wlasciwosci = {}
+            elif nazwa == 'coordinates' and sciezka[-2:-1] == ['geometry']:
+                wspolrzedne = len(sciezka)
+            continue
+
+        if typ in '}]':
+            if liczby:
+                if len(liczby) < 2:
+                    raise ValueError('Pozycja w GeoJSON musi mieć co najmniej dwie współrzędne.')
+                yield 'punkt', (liczby[0], liczby[1])
+                liczby = []
+            if wspolrzedne == len(sciezka):
+                wspolrzedne = None
+            if typ == '}' and sciezka in ([''], ['', 'features', '*']):
+                yield 'koniec', {'nazwa': wlasciwosci.get('nazwa') or wlasciwosci.get('name'),
+                                 'opis': wlasciwosci.get('opis') or wlasciwosci.get('description')}
+            sciezka.pop()
+            kontenery.pop()
+            biezacy_klucz = None
+            continue
+
+        if wspolrzedne is not None:
+            if not isinstance(wartosc, (int, float)) or isinstance(wartosc, bool):
+                raise ValueError('Współrzędne w GeoJSON muszą być liczbami.')
+            liczby.append(wartosc)
+        elif sciezka[-1:] == ['properties'] and isinstance(wartosc, str):
+            wlasciwosci[nazwa] = wartosc
+
+
+def _zdarzenia_gpx(plik, swiat):
+    """
+    Trasy z pliku GPX: ścieżki (trk) i trasy (rte) z punktami trkpt/rtept.
+    Przetworzone elementy są usuwane z drzewa, więc nie rośnie ono z rozmiarem pliku.
+    """
+    stos = []
+    nazwa = opis = None
+    try:
+        for zdarzenie, element in ET.iterparse(plik, events=('start', 'end')):
+            znacznik = element.tag.rpartition('}')[2]
+            if zdarzenie == 'start':
+                stos.append(element)
+                if znacznik in ('trk', 'rte'):
+                    nazwa = opis = None
+                continue
+
+            stos.pop()
+            rodzic = stos[-1].tag.rpartition('}')[2] if stos else None
+            if znacznik in ('trkpt', 'rtept'):
+                try:
+                    punkt = (float(element.get('lon')), float(element.get('lat')))
+                except (TypeError, ValueError):
+                    raise ValueError('Punkt GPX musi mieć liczbowe atrybuty lat i lon.')
+                yield 'punkt', punkt
+            elif znacznik == 'name' and rodzic in ('trk', 'rte'):
+                nazwa = (element.text or '').strip()
+            elif znacznik == 'desc' and rodzic in ('trk', 'rte'):
+                opis = (element.text or '').strip()
+            elif znacznik in ('trk', 'rte'):
+                yield 'koniec', {'nazwa': nazwa, 'opis': opis}
+            if stos:
+                # Zakończony element jest jedynym dzieckiem rodzica - usunięcie nic nie kosztuje
+                stos[-1].remove(element)
+    except ET.ParseError as e:
+        raise ValueError(f'Niepoprawny plik GPX: {e}')
+
+
+def _zdarzenia_csv(plik, swiat):
+    """
+    Trasy z pliku CSV w układzie eksportu: kolumny x, y (albo dl, szer przy współrzędnych
+    geograficznych), opcjonalnie trasa_id i trasa. Kolejne wiersze o tym samym trasa_id
+    (lub nazwie trasy) tworzą jedną trasę.
+    """
+    czytnik = csv.reader(io.TextIOWrapper(plik, encoding='utf-8', newline=''))
+    naglowek = [kolumna.strip().lower() for kolumna in next(czytnik, [])]
+    kolumny_xy = ('dl', 'szer') if swiat else ('x', 'y')
+    if not set(kolumny_xy) <= set(naglowek):
+        raise ValueError(f'Plik CSV musi mieć kolumny {kolumny_xy[0]} i {kolumny_xy[1]}.')
+    ix, iy = (naglowek.index(kolumna) for kolumna in kolumny_xy)
+    inazwa = naglowek.index('trasa') if 'trasa' in naglowek else None
+    iklucz = naglowek.index('trasa_id') if 'trasa_id' in naglowek else inazwa
+
+    poprzedni = nazwa = None
+    pierwszy = True
+    for numer, wiersz in enumerate(czytnik, start=2):
+        if not wiersz:
+            continue
+        try:
+            klucz = wiersz[iklucz] if iklucz is not None else None
+            if not pierwszy and klucz != poprzedni:
+                yield 'koniec', {'nazwa': nazwa}
+            poprzedni, pierwszy = klucz, False
+            nazwa = wiersz[inazwa] if inazwa is not None else None
+            punkt = (float(wiersz[ix]), float(wiersz[iy]))
+        except (IndexError, ValueError):
+            raise ValueError(f'Niepoprawny wiersz {numer} pliku CSV.')
+        yield 'punkt', punkt
+    yield 'koniec', {'nazwa': nazwa}
+
+
+PARSERY = {
+    'gpx': _zdarzenia_gpx,
+    'geojson': _zdarzenia_geojson,
+    'csv': _zdarzenia_csv,
+}
+
+
+def format_pliku(nazwa_pliku):
+    """
+    Format importu wynikający z rozszerzenia pliku albo None
+    """
+    rozszerzenie = nazwa_pliku.rpartition('.')[2].lower()
+    return {'json': 'geojson'}.get(rozszerzenie, rozszerzenie if rozszerzenie in PARSERY else None)
+
+
+def importuj_trasy(plik, format, uzytkownik, obraz_tla, swiat=None, nazwa=None, postep=None):
+    """
+    Tworzy trasy użytkownika na obrazie tła z pliku (strumień binarny) w podanym formacie.
+    swiat=True oznacza współrzędne geograficzne przeliczane przekształceniem tła
+    (domyślnie tylko dla GPX). Funkcja postep(liczba_tras, liczba_punktow) jest wywoływana
+    po każdej zapisanej paczce punktów. Zwraca listę utworzonych tras; niepoprawny plik
+    zgłasza ValueError i nie zostawia żadnych zmian.
+    """
+    if swiat is None:
+        swiat = format == 'gpx'
+    przeksztalc = przeksztalcenie_odwrotne(obraz_tla.transformacja) if swiat else None
+    if swiat and przeksztalc is None:
+        raise ValueError('Obraz tła nie ma przekształcenia ze współrzędnych geograficznych na piksele.')
+    nazwa = nazwa or 'Import'
+
+    trasy = []
+    liczba_punktow = 0
+    trasa = None
+    paczka = []
+
+    def zapisz_paczke():
+        nonlocal paczka, liczba_punktow
+        if paczka:
+            dodaj_punkty(trasa, paczka)
+            liczba_punktow += len(paczka)
+            paczka = []
+            if postep is not None:
+                postep(len(trasy), liczba_punktow)
+
+    with grupuj_zmiany():
+        for zdarzenie, wartosc in PARSERY[format](plik, swiat):
+            if zdarzenie == 'punkt':
+                x, y = przeksztalc(*wartosc) if przeksztalc else wartosc
+                if not (math.isfinite(x) and math.isfinite(y)) or max(abs(x), abs(y)) > MAKS_WSPOLRZEDNA:
+                    raise ValueError(f'Współrzędne punktu ({x}, {y}) są poza zakresem.')
+                if trasa is None:
+                    # Trasa powstaje przy pierwszym punkcie - puste ścieżki są pomijane
+                    trasa = Trasa.objects.create(
+                        nazwa=f'{nazwa} {len(trasy) + 1}'[:MAKS_NAZWA], uzytkownik=uzytkownik, obraz_tla=obraz_tla
+                    )
+                    trasy.append(trasa)
+                paczka.append((round(x), round(y)))
+                if len(paczka) >= ROZMIAR_PACZKI:
+                    zapisz_paczke()
+            elif trasa is not None:
+                zapisz_paczke()
+                opis = {pole: wartosc[pole][:MAKS_NAZWA] if pole == 'nazwa' else wartosc[pole]
+                        for pole in ('nazwa', 'opis') if wartosc.get(pole)}
+                if opis:
+                    Trasa.objects.filter(id=trasa.id).update(**opis)
+                    for pole, tekst in opis.items():
+                        setattr(trasa, pole, tekst)
+                trasa = None
+    return trasy
+
+
+def klucz_postepu(import_id):
+    return f'trasy:import:{import_id}'
+
+
+def pamiec_postepu():
+    """
+    Pamięć z postępem importów - alias z CACHES wskazany w TRASY_PAMIEC_POSTEPU. Import
+    zapisuje punkty w jednej transakcji, więc postęp nie może być w wierszu ImportTras -
+    inne połączenia zobaczyłyby go dopiero po zakończeniu importu.
+    """
+    return caches[getattr(settings, 'TRASY_PAMIEC_POSTEPU', 'default')]
+
+
+@checks.register()
+def sprawdz_pamiec_postepu(app_configs, **kwargs):
+    """
+    Zadania wykonywane w osobnym procesie (KolejkaBazodanowa) wymagają wspólnej pamięci postępu
+    """
+    kolejka = getattr(settings, 'TRASY_KOLEJKA_ZADAN', '')
+    alias = getattr(settings, 'TRASY_PAMIEC_POSTEPU', 'default')
+    if kolejka.endswith('.KolejkaBazodanowa') and settings.CACHES.get(alias, {}).get('BACKEND') in PAMIECI_PROCESU:
+        return [checks.Warning(
+            f'Pamięć "{alias}" z TRASY_PAMIEC_POSTEPU działa tylko w jednym procesie - postęp importów '
+            'wykonywanych przez uruchom_zadania nie będzie widoczny w API.',
+            hint='Ustaw TRASY_CACHE na Redis lub katalog albo wskaż w TRASY_PAMIEC_POSTEPU inną wspólną pamięć.',
+            id='trasy_app.W001',
+        )]
+    return []
+
+
+def postep_importu(import_id):
+    """
+    Bieżący postęp importu w tle jako {'trasy': ..., 'punkty': ...} albo None
+    """
+    postep = pamiec_postepu().get(klucz_postepu(import_id))
+    if postep is None:
+        return None
+    return {'trasy': postep[0], 'punkty': postep[1]}
+
+
+def wykonaj_import(import_id):
+    """
+    Zadanie w tle: import tras z pliku zapisanego w ImportTras. Postęp jest widoczny
+    we wspólnej pamięci (postep_importu), a wynik w polach status, liczba_tras i blad.
+    """
+    zlecenie = ImportTras.objects.select_related('uzytkownik', 'obraz_tla').filter(
+        id=import_id, status=ImportTras.OCZEKUJE
+    ).first()
+    if zlecenie is None or not zlecenie.plik:
+        return
+    ImportTras.objects.filter(id=import_id).update(status=ImportTras.W_TOKU)
+    klucz = klucz_postepu(import_id)
+    pamiec = pamiec_postepu()
+
+    def postep(liczba_tras, liczba_punktow):
+        pamiec.set(klucz, (liczba_tras, liczba_punktow), CZAS_POSTEPU)
+
+    nazwa = posixpath.splitext(posixpath.basename(zlecenie.plik.name))[0]
+    try:
+        with zlecenie.plik.open('rb') as plik:
+            trasy = importuj_trasy(
+                plik, zlecenie.format, zlecenie.uzytkownik, zlecenie.obraz_tla,
+                swiat=zlecenie.wspolrzedne_geograficzne, nazwa=nazwa, postep=postep,
+            )
+    except (ValueError, OSError, csv.Error) as e:
+        logger.warning('Import tras %s nie powiódł się: %s', import_id, e)
+        ImportTras.objects.filter(id=import_id).update(status=ImportTras.BLAD, blad=str(e))
+        return
+    finally:
+        pamiec.delete(klucz)
+
+    liczba_punktow = Trasa.objects.filter(id__in=[trasa.id for trasa in trasy]).aggregate(
+        suma=Sum('liczba_punktow'))['suma'] or 0
+    zlecenie.plik.delete(save=False)
+    ImportTras.objects.filter(id=import_id).update(
+        status=ImportTras.ZAKONCZONY, plik='', liczba_tras=len(trasy), liczba_punktow=liczba_punktow,
+    )
@@ -0,0 +1,214 @@
+"""
+Kanały powiadomień o zmianach tras - edytory tej samej trasy otwarte w kilku przeglądarkach
+dostają zmiany punktów strumieniem Server-Sent Events zamiast odpytywać serwer.
+
+Każda nowa rewizja punktów trasy (rewizje.rewizja_trasy) jest publikowana w kanale po
+zatwierdzeniu transakcji. Kanał przenosi tylko numer rewizji - strumień sam pobiera zmiany
+z dziennika (rewizje.zmiany_od), więc klient, który przegapił kilka rewizji albo połączył
+się ponownie (nagłówek Last-Event-ID), dostaje wszystko od swojej rewizji.
+
+Strumień jest obsługiwany tylko pod serwerem ASGI (trasy_projekt/asgi.py): czekający
+subskrybent to zadanie w pętli zdarzeń, a nie wątek. Pod WSGI każdy otwarty edytor zająłby
+wątek roboczy serwera na cały czas połączenia, więc widok odpowiada tam 501
+(views.trasa_strumien), a edytor nie otwiera strumienia.
+
+Implementację wybiera ustawienie TRASY_KANAL_ZMIAN (ścieżka klasy):
+    KanalPamieci     - subskrybenci w pamięci procesu (domyślnie); wystarcza, gdy serwer
+                       działa w jednym procesie
+    KanalBazodanowy  - KanalPamieci, do którego jeden wątek na proces dokłada rewizje
+                       subskrybowanych tras odczytane z bazy; działa przy wielu procesach
+                       i serwerach korzystających z tej samej bazy
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Trasa
+from .rewizje import rewizja_trasy, zmiany_od
+
+logger = logging.getLogger(__name__)
+
+DOMYSLNY_KANAL = 'trasy_app.kanaly.KanalPamieci'
+
+# Co ile sekund strumień wysyła komentarz podtrzymujący połączenie
+ODSTEP_PODTRZYMANIA = 15
+# Po tylu sekundach strumień się kończy, a przeglądarka łączy się ponownie od swojej rewizji
+CZAS_POLACZENIA = 5 * 60
+# Po ilu milisekundach przeglądarka ma wznowić przerwane połączenie
+PRZERWA_PONOWIENIA = 1000
+
+_kanaly = {}
+_blokada = threading.Lock()
+
+
+class _Subskrypcja:
+    """
+    Najnowsza rewizja trasy znana subskrybentowi - zmieniana tylko w jego pętli zdarzeń
+    """
+    def __init__(self):
+        self._petla = asyncio.get_running_loop()
+        self._rewizja = 0
+        self._nowa = asyncio.Event()
+
+    def powiadom(self, rewizja):
+        """
+        Przekazuje rewizję z dowolnego wątku do pętli zdarzeń subskrybenta
+        """
+        try:
+            self._petla.call_soon_threadsafe(self._zapisz, rewizja)
+        except RuntimeError:
+            # Pętla już zamknięta - subskrybent zaraz się wypisze
+            pass
+
+    def _zapisz(self, rewizja):
+        if rewizja > self._rewizja:
+            self._rewizja = rewizja
+            self._nowa.set()
+
+    async def czekaj(self, po_rewizji, limit_czasu):
+        """
+        Najnowsza opublikowana rewizja większa od po_rewizji albo None po upływie limitu czasu
+        """
+        koniec = time.monotonic() + limit_czasu
+        while self._rewizja <= po_rewizji:
+            self._nowa.clear()
+            try:
+                await asyncio.wait_for(self._nowa.wait(), max(0, koniec - time.monotonic()))
+            except asyncio.TimeoutError:
+                return None
+        return self._rewizja
+
+
+class KanalPamieci:
+    """
+    Rewizje rozsyłane do subskrybentów tej samej trasy w procesie serwera
+    """
+    def __init__(self):
+        self._subskrybenci = defaultdict(set)
+        self._blokada = threading.Lock()
+
+    def opublikuj(self, trasa_id, rewizja):
+        with self._blokada:
+            subskrypcje = list(self._subskrybenci.get(trasa_id, ()))
+        for subskrypcja in subskrypcje:
+            subskrypcja.powiadom(rewizja)
+
+    @contextmanager
+    def subskrybuj(self, trasa_id):
+        """
+        Subskrypcja zmian trasy - tylko wewnątrz pętli zdarzeń
+        """
+        subskrypcja = _Subskrypcja()
+        with self._blokada:
+            self._subskrybenci[trasa_id].add(subskrypcja)
+        try:
+            yield subskrypcja
+        finally:
+            with self._blokada:
+                self._subskrybenci[trasa_id].discard(subskrypcja)
+                if not self._subskrybenci[trasa_id]:
+                    del self._subskrybenci[trasa_id]
+
+
+class KanalBazodanowy(KanalPamieci):
+    """
+    Rewizje z procesu jak w KanalPamieci, a zapisane przez inne procesy - z bazy. Jeden wątek
+    sprawdza naraz rewizje wszystkich subskrybowanych tras i kończy się bez subskrybentów.
+    """
+    # Co ile sekund wątek sprawdza rewizje tras
+    interwal = 1.0
+
+    def __init__(self):
+        super().__init__()
+        self._watek = None
+
+    @contextmanager
+    def subskrybuj(self, trasa_id):
+        with super().subskrybuj(trasa_id) as subskrypcja:
+            with self._blokada:
+                if self._watek is None:
+                    self._watek = threading.Thread(target=self._odpytuj, name='kanal-zmian-tras', daemon=True)
+                    self._watek.start()
+            yield subskrypcja
+
+    def _odpytuj(self):
+        ostatnie = {}
+        try:
+            while True:
+                time.sleep(self.interwal)
+                with self._blokada:
+                    trasy = list(self._subskrybenci)
+                    if not trasy:
+                        self._watek = None
+                        return
+                try:
+                    rewizje = dict(Trasa.objects.filter(id__in=trasy).values_list('id', 'rewizja'))
+                except DatabaseError as e:
+                    logger.warning('Nie można odczytać rewizji tras: %s', e)
+                    connection.close()
+                    continue
+                for trasa_id, rewizja in rewizje.items():
+                    if ostatnie.get(trasa_id) != rewizja:
+                        self.opublikuj(trasa_id, rewizja)
+                ostatnie = rewizje
+        finally:
+            connection.close()
+
+
+def kanal():
+    """
+    Kanał zmian wybrany w ustawieniach (jedna instancja na proces)
+    """
+    sciezka = getattr(settings, 'TRASY_KANAL_ZMIAN', DOMYSLNY_KANAL)
+    with _blokada:
+        if sciezka not in _kanaly:
+            _kanaly[sciezka] = import_string(sciezka)()
+        return _kanaly[sciezka]
+
+
+def zdarzenie(rewizja, dane):
+    """
+    Zdarzenie Server-Sent Events 'zmiany' - identyfikatorem jest rewizja trasy
+    """
+    return f'id: {rewizja}\nevent: zmiany\ndata: {json.dumps(dane)}\n\n'
+
+
+async def strumien_zmian(trasa_id, od_rewizji):
+    """
+    Zdarzenia ze zmianami punktów trasy od podanej rewizji, aż do końca czasu połączenia.
+    Gdy zmian nie da się odtworzyć z dziennika, zdarzenie ma zmiany równe None.
+    """
+    yield f'retry: {PRZERWA_PONOWIENIA}\n\n'
+    koniec = time.monotonic() + CZAS_POLACZENIA
+    # Subskrypcja przed odczytem rewizji - zmiana zatwierdzona pomiędzy nie przepadnie
+    with kanal().subskrybuj(trasa_id) as subskrypcja:
+        rewizja = od_rewizji
+        while True:
+            biezaca = await Trasa.objects.filter(id=trasa_id).values_list('rewizja', flat=True).afirst()
+            if biezaca is None:
+                return
+            if biezaca != rewizja:
+                rewizja, zmiany = await sync_to_async(zmiany_od)(trasa_id, rewizja)
+                yield zdarzenie(rewizja, {'rewizja': rewizja, 'zmiany': zmiany})
+
+            pozostalo = koniec - time.monotonic()
+            if pozostalo <= 0:
+                return
+            if await subskrypcja.czekaj(rewizja, min(ODSTEP_PODTRZYMANIA, pozostalo)) is None:
+                yield ': podtrzymanie\n\n'
+
+
+@receiver(rewizja_trasy)
+def _nowa_rewizja(sender, trasa_id, rewizja, **kwargs):
+    # Subskrybenci czytają zmiany z bazy - muszą je już widzieć
+    transaction.on_commit(lambda: kanal().opublikuj(trasa_id, rewizja))
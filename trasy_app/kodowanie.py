@@ -0,0 +1,56 @@
+"""
+Spakowany (binarny) format geometrii trasy.
+
+Układ danych (little-endian):
+    4 bajty   - sygnatura b'TRP1'
+    uint32    - liczba punktów n
+    int32 * n - id punktów (delta względem poprzedniego)
+    int32 * n - x (delta)
+    int32 * n - y (delta)
+    int32 * n - kolejność (delta)
+
+Pierwsza wartość każdej kolumny jest deltą względem zera. Kolumny są wyrównane
+do 4 bajtów, więc po stronie przeglądarki można je czytać bezpośrednio przez Int32Array.
+"""
+import struct
+
+import numpy as np
+
+TYP_SPAKOWANY = 'application/x-trasa-punkty'
+SYGNATURA = b'TRP1'
+KOLUMNY = ('id', 'x', 'y', 'kolejnosc')
+
+_NAGLOWEK = struct.Struct('<4sI')
+_INT32_MIN, _INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+
+
+def spakuj_punkty(tablica):
+    """
+    Koduje tablicę (n, 4) z kolumnami id, x, y, kolejnosc do formatu binarnego.
+    """
+    tablica = np.asarray(tablica, dtype=np.int64).reshape(-1, len(KOLUMNY))
+    delty = np.diff(tablica, axis=0, prepend=0)
+    if delty.size and (delty.min() < _INT32_MIN or delty.max() > _INT32_MAX):
+        raise ValueError('Różnice wartości nie mieszczą się w int32')
+
+    kolumny = np.ascontiguousarray(delty.T, dtype='<i4')
+    return _NAGLOWEK.pack(SYGNATURA, len(tablica)) + kolumny.tobytes()
+
+
+def rozpakuj_punkty(dane):
+    """
+    Odwrotność spakuj_punkty - zwraca tablicę (n, 4) typu int64.
+    """
+    sygnatura, n = _NAGLOWEK.unpack_from(dane)
+    if sygnatura != SYGNATURA:
+        raise ValueError('Niepoprawna sygnatura danych')
+
+    delty = np.frombuffer(dane, dtype='<i4', count=n * len(KOLUMNY), offset=_NAGLOWEK.size)
+    return np.cumsum(delty.reshape(len(KOLUMNY), n).astype(np.int64), axis=1).T
+
+
+def akceptuje_spakowane(request):
+    """
+    Czy klient poprosił (nagłówkiem Accept) o spakowany format punktów
+    """
+    return TYP_SPAKOWANY in request.headers.get('Accept', '')
@@ -0,0 +1,101 @@
+"""
+Spakowane przechowywanie punktów trasy - jeden skompresowany blob zamiast wierszy PunktTrasy.
+
+Punkty spakowanej trasy są w GeometriaTrasy.dane: format binarny z kodowanie.py (kolumny
+id, x, y, kolejnosc jako delty int32) skompresowany zlib. Delty sąsiednich punktów są małe,
+więc punkt zajmuje zwykle kilka bajtów zamiast kilkudziesięciu bajtów wiersza z indeksami.
+Wiersze PunktTrasy spakowanej trasy są usuwane.
+
+Odczyt całej trasy (services.tablica_punktow - edytor, format spakowany, uproszczenia,
+trafienia - oraz eksport, szczegóły trasy, filtr obszaru i punkty na obrazie tła) dekoduje
+blob przez NumPy, a listy punktów są stronicowane z blobu (stronicowanie.WierszePunktow).
+Zmiany pojedynczych punktów (API punktów, edytor, dopisywanie) najpierw rozpakowują trasę
+z powrotem do wierszy - z tymi samymi id punktów, więc klienci i dziennik zmian niczego
+nie zauważą. Spakowanie nie zmienia punktów, więc nie zmienia też rewizji trasy.
+"""
+import zlib
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .kodowanie import rozpakuj_punkty, spakuj_punkty
+from .models import GeometriaTrasy, PunktTrasy, Trasa
+from .siatka import komorka
+
+POZIOM_KOMPRESJI = 6
+ROZMIAR_PACZKI = 2000
+
+
+def spakuj_geometrie(tablica):
+    """
+    Blob z tablicy (n, 4) z kolumnami id, x, y, kolejnosc
+    """
+    return zlib.compress(spakuj_punkty(tablica), POZIOM_KOMPRESJI)
+
+
+def rozpakuj_geometrie(dane):
+    """
+    Tablica (n, 4) typu int64 z blobu - odwrotność spakuj_geometrie
+    """
+    return rozpakuj_punkty(zlib.decompress(bytes(dane)))
+
+
+def geometria_trasy(trasa_id):
+    """
+    Tablica punktów spakowanej trasy albo None, jeśli trasa nie jest spakowana
+    """
+    dane = GeometriaTrasy.objects.filter(trasa_id=trasa_id).values_list('dane', flat=True).first()
+    return None if dane is None else rozpakuj_geometrie(dane)
+
+
+def geometrie_tras(trasy):
+    """
+    Pary (trasa_id, tablica) dla spakowanych tras z querysetu - po jednym blobie naraz
+    """
+    geometrie = GeometriaTrasy.objects.filter(trasa__in=trasy.order_by().values('id')).values_list('trasa_id', 'dane')
+    for trasa_id, dane in geometrie.iterator(chunk_size=100):
+        yield trasa_id, rozpakuj_geometrie(dane)
+
+
+def spakuj_trase(trasa_id):
+    """
+    Zamienia wiersze punktów trasy na blob. Zwraca False, jeśli trasa już była spakowana.
+    """
+    from .services import tablica_punktow
+
+    with transaction.atomic():
+        if Trasa.objects.select_for_update().filter(id=trasa_id, geometria__isnull=True).first() is None:
+            return False
+        tablica = tablica_punktow(trasa_id)
+        GeometriaTrasy.objects.create(trasa_id=trasa_id, dane=spakuj_geometrie(tablica))
+        if len(tablica):
+            # Bez wierszy licznik kolejności (services.zarezerwuj_kolejnosc) musi sam znać największy klucz
+            Trasa.objects.filter(id=trasa_id).update(
+                ostatnia_kolejnosc=Greatest(F('ostatnia_kolejnosc'), int(tablica[:, 3].max()))
+            )
+        # Punkty nie mają odbiorników sygnałów ani zależnych tabel - jedno zapytanie DELETE
+        PunktTrasy.objects.filter(trasa_id=trasa_id).delete()
+    return True
+
+
+def rozpakuj_trase(trasa_id):
+    """
+    Przywraca wiersze punktów spakowanej trasy (z tymi samymi id).
+    Zwraca False, jeśli trasa nie była spakowana.
+    """
+    # Bez blokady dla zwykłych tras - to sprawdzenie poprzedza każdą zmianę punktów
+    if not GeometriaTrasy.objects.filter(trasa_id=trasa_id).exists():
+        return False
+    with transaction.atomic():
+        Trasa.objects.select_for_update().filter(id=trasa_id).first()
+        geometria = GeometriaTrasy.objects.filter(trasa_id=trasa_id).first()
+        if geometria is None:
+            # Ktoś inny rozpakował trasę w międzyczasie
+            return False
+        PunktTrasy.objects.bulk_create([
+            PunktTrasy(id=id_punktu, trasa_id=trasa_id, x=x, y=y, kolejnosc=kolejnosc, komorka=komorka(x, y))
+            for id_punktu, x, y, kolejnosc in rozpakuj_geometrie(geometria.dane).tolist()
+        ], batch_size=ROZMIAR_PACZKI)
+        geometria.delete()
+    return True
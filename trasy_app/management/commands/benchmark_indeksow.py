@@ -0,0 +1,110 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from trasy_app.models import ObrazTla, Trasa, PunktTrasy
+from trasy_app.siatka import komorka
+
+
+class Command(BaseCommand):
+    help = (
+        'Wypełnia bazę tymczasowymi punktami i porównuje plany oraz czasy gorących zapytań '
+        'z indeksami (trasa, kolejnosc) i (uzytkownik, data_modyfikacji) oraz bez nich. '
+        'Stan "bez indeksów" to kopie tabel z samymi indeksami kluczy obcych, jak przed ich dodaniem. '
+        'Wszystkie zmiany są wycofywane na końcu.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--punkty', type=int, default=1_000_000,
+                            help='Łączna liczba punktów (np. 10000000 dla pełnego testu)')
+        parser.add_argument('--trasy', type=int, default=1000, help='Liczba tras')
+        parser.add_argument('--powtorzenia', type=int, default=200, help='Powtórzenia każdego zapytania')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            trasa, uzytkownik = self._wypelnij(options['punkty'], options['trasy'])
+            zapytania = self._zapytania(trasa, uzytkownik)
+
+            self.stdout.write(self.style.MIGRATE_HEADING('Z indeksami'))
+            self._zmierz(zapytania, options['powtorzenia'], {})
+
+            tabele = self._kopie_bez_indeksow()
+            self.stdout.write(self.style.MIGRATE_HEADING('Bez indeksów'))
+            self._zmierz(zapytania, options['powtorzenia'], tabele)
+
+            # Kopie tabel i dane testowe znikają razem z transakcją
+            transaction.set_rollback(True)
+
+    def _wypelnij(self, liczba_punktow, liczba_tras):
+        self.stdout.write(f'Wypełnianie: {liczba_punktow} punktów w {liczba_tras} trasach...')
+        start = time.perf_counter()
+        uzytkownik = User.objects.create(username='benchmark_indeksow')
+        tlo = ObrazTla.objects.create(nazwa='benchmark', szerokosc=20000, wysokosc=15000)
+        trasy = Trasa.objects.bulk_create(
+            Trasa(nazwa=f'Trasa {i}', uzytkownik=uzytkownik, obraz_tla=tlo) for i in range(liczba_tras)
+        )
+
+        na_trase = max(liczba_punktow // liczba_tras, 1)
+        paczka = []
+        # Punkty tras przeplatają się w tabeli, tak jak przy równoległej pracy wielu użytkowników
+        for kolejnosc in range(1, na_trase + 1):
+            for t in trasy:
+                x, y = kolejnosc % 20000, kolejnosc % 15000
+                paczka.append(PunktTrasy(trasa=t, x=x, y=y, kolejnosc=kolejnosc, komorka=komorka(x, y)))
+            if len(paczka) >= 50_000:
+                PunktTrasy.objects.bulk_create(paczka, batch_size=5000)
+                paczka = []
+        PunktTrasy.objects.bulk_create(paczka, batch_size=5000)
+
+        self.stdout.write(f'  gotowe w {time.perf_counter() - start:.1f} s')
+        return trasy[len(trasy) // 2], uzytkownik
+
+    def _zapytania(self, trasa, uzytkownik):
+        punkty = PunktTrasy.objects.filter(trasa_id=trasa.id)
+        srodek = punkty.count() // 2
+        return {
+            'ostatni punkt (dopisywanie)': lambda: punkty.order_by('-kolejnosc')[:1],
+            'sąsiad punktu (przesuwanie)': lambda: punkty.filter(kolejnosc__lt=srodek).order_by('-kolejnosc')[:2],
+            'punkt o danej kolejności': lambda: punkty.filter(kolejnosc=srodek),
+            'trasy użytkownika': lambda: Trasa.objects.filter(uzytkownik=uzytkownik).order_by('-data_modyfikacji')[:10],
+        }
+
+    def _zmierz(self, zapytania, powtorzenia, tabele):
+        """
+        Mierzy zapytania, podmieniając w ich SQL tabele według słownika tabele
+        """
+        with connection.cursor() as cursor:
+            for nazwa, zapytanie in zapytania.items():
+                sql, params = zapytanie().query.sql_with_params()
+                for tabela, kopia in tabele.items():
+                    sql = sql.replace(connection.ops.quote_name(tabela), connection.ops.quote_name(kopia))
+
+                cursor.execute(connection.ops.explain_query_prefix() + ' ' + sql, params)
+                plan = [' '.join(str(kolumna) for kolumna in wiersz) for wiersz in cursor.fetchall()]
+
+                start = time.perf_counter()
+                for _ in range(powtorzenia):
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                czas = (time.perf_counter() - start) / powtorzenia * 1000
+
+                self.stdout.write(f'{nazwa}: {czas:.3f} ms')
+                for linia in plan:
+                    self.stdout.write(f'    {linia}')
+
+    def _kopie_bez_indeksow(self):
+        """
+        Kopie tabel punktów i tras z indeksami tylko na kluczach obcych
+        """
+        tabele = {}
+        with connection.cursor() as cursor:
+            for model, klucz in ((PunktTrasy, 'trasa_id'), (Trasa, 'uzytkownik_id')):
+                tabela = model._meta.db_table
+                kopia = f'{tabela}_bez_indeksow'
+                q = connection.ops.quote_name
+                cursor.execute(f'CREATE TABLE {q(kopia)} AS SELECT * FROM {q(tabela)}')
+                cursor.execute(f'CREATE INDEX {q(kopia + "_fk")} ON {q(kopia)} ({q(klucz)})')
+                tabele[tabela] = kopia
+        return tabele
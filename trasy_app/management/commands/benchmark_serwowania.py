@@ -0,0 +1,133 @@
+import asyncio
+import io
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.urls import reverse
+
+from trasy_app.models import ObrazTla, Trasa
+from trasy_app.services import dodaj_punkty
+
+
+class Command(BaseCommand):
+    help = (
+        'Porównuje pobieranie długiej trasy przez wielu powolnych klientów naraz: widok '
+        'synchroniczny pod WSGI z pulą wątków roboczych i widok asynchroniczny pod ASGI '
+        '(trasy_app/async_views.py). Wolne łącze klienta jest symulowane przerwą po każdym '
+        'fragmencie odpowiedzi, proporcjonalną do jego rozmiaru. Dane testowe są usuwane na końcu.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--punkty', type=int, default=20_000, help='Liczba punktów trasy')
+        parser.add_argument('--klienci', type=int, default=50, help='Liczba równoczesnych klientów')
+        parser.add_argument('--watki', type=int, default=8, help='Liczba wątków roboczych serwera WSGI')
+        parser.add_argument('--przepustowosc', type=int, default=500_000,
+                            help='Przepustowość łącza jednego klienta w bajtach na sekundę')
+
+    def handle(self, *args, **options):
+        uzytkownik = User.objects.create(username='benchmark_serwowania')
+        tlo = ObrazTla.objects.create(nazwa='benchmark', szerokosc=20000, wysokosc=15000)
+        try:
+            trasa = Trasa.objects.create(nazwa='benchmark', uzytkownik=uzytkownik, obraz_tla=tlo)
+            dodaj_punkty(trasa, [(i % 20000, i % 15000) for i in range(options['punkty'])])
+            klient = Client()
+            klient.force_login(uzytkownik)
+            ciasteczko = f'{settings.SESSION_COOKIE_NAME}={klient.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+            self.stdout.write(f'{options["punkty"]} punktów, {options["klienci"]} klientów, '
+                              f'łącze {options["przepustowosc"]} B/s na klienta')
+            self._wynik(f'WSGI, {options["watki"]} wątków', *self._wsgi(
+                reverse('get_punkty', args=[trasa.id]), ciasteczko, options))
+            self._wynik('ASGI, jedna pętla zdarzeń', *asyncio.run(self._asgi(
+                reverse('get_punkty_async', args=[trasa.id]), ciasteczko, options)))
+        finally:
+            uzytkownik.delete()
+            tlo.delete()
+
+    def _wsgi(self, sciezka, ciasteczko, options):
+        aplikacja = get_wsgi_application()
+
+        def zapytanie(start):
+            srodowisko = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': sciezka, 'QUERY_STRING': '',
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+                'HTTP_COOKIE': ciasteczko, 'HTTP_ACCEPT': 'application/json',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+            }
+            statusy = []
+            odpowiedz = aplikacja(srodowisko, lambda status, naglowki: statusy.append(status))
+            rozmiar = 0
+            try:
+                for fragment in odpowiedz:
+                    rozmiar += len(fragment)
+                    # Wątek roboczy czeka, aż wolny klient odbierze fragment
+                    time.sleep(len(fragment) / options['przepustowosc'])
+            finally:
+                odpowiedz.close()
+            return time.perf_counter() - start, statusy[0].startswith('200'), rozmiar
+
+        # Wszyscy klienci łączą się naraz - czas zapytania obejmuje czekanie na wolny wątek
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['watki']) as pula:
+            wyniki = list(pula.map(lambda _: zapytanie(start), range(options['klienci'])))
+        return time.perf_counter() - start, wyniki
+
+    async def _asgi(self, sciezka, ciasteczko, options):
+        aplikacja = get_asgi_application()
+
+        async def zapytanie():
+            start = time.perf_counter()
+            zakres = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': sciezka, 'raw_path': sciezka.encode(), 'query_string': b'',
+                'root_path': '', 'server': ('localhost', 80), 'client': ('127.0.0.1', 50000),
+                'headers': [(b'host', b'localhost'), (b'cookie', ciasteczko.encode()),
+                            (b'accept', b'application/json')],
+            }
+            wynik = {'status': None, 'rozmiar': 0}
+            koniec = asyncio.Event()
+            pierwsze = True
+
+            async def odbierz():
+                nonlocal pierwsze
+                if pierwsze:
+                    pierwsze = False
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # Klient nie rozłącza się przed końcem odpowiedzi
+                await koniec.wait()
+                return {'type': 'http.disconnect'}
+
+            async def wyslij(wiadomosc):
+                if wiadomosc['type'] == 'http.response.start':
+                    wynik['status'] = wiadomosc['status']
+                elif wiadomosc['type'] == 'http.response.body':
+                    wynik['rozmiar'] += len(wiadomosc.get('body', b''))
+                    # Pętla zdarzeń w tym czasie obsługuje pozostałych klientów
+                    await asyncio.sleep(len(wiadomosc.get('body', b'')) / options['przepustowosc'])
+
+            await aplikacja(zakres, odbierz, wyslij)
+            koniec.set()
+            return time.perf_counter() - start, wynik['status'] == 200, wynik['rozmiar']
+
+        start = time.perf_counter()
+        wyniki = await asyncio.gather(*(zapytanie() for _ in range(options['klienci'])))
+        return time.perf_counter() - start, wyniki
+
+    def _wynik(self, nazwa, czas, wyniki):
+        czasy = sorted(czas_zapytania for czas_zapytania, _, _ in wyniki)
+        bledy = sum(1 for _, poprawne, _ in wyniki if not poprawne)
+        self.stdout.write(self.style.MIGRATE_HEADING(nazwa))
+        self.stdout.write(f'  łącznie {czas:.2f} s, {len(wyniki) / czas:.1f} zapytań/s, '
+                          f'{sum(rozmiar for _, _, rozmiar in wyniki) / czas / 1e6:.1f} MB/s')
+        self.stdout.write(f'  czas zapytania: mediana {statistics.median(czasy):.2f} s, '
+                          f'p95 {czasy[int(len(czasy) * 0.95) - 1]:.2f} s')
+        if bledy:
+            self.stdout.write(self.style.ERROR(f'  błędne odpowiedzi: {bledy}'))
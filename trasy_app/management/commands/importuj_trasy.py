@@ -0,0 +1,46 @@
+import csv
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from trasy_app.importowanie import PARSERY, format_pliku, importuj_trasy
+from trasy_app.models import ObrazTla
+
+
+class Command(BaseCommand):
+    help = (
+        'Importuje trasy z pliku GPX, GeoJSON lub CSV na obraz tła użytkownika. '
+        'Plik jest czytany przyrostowo, a cały import to jedna transakcja.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('plik', help='Ścieżka do pliku z trasami')
+        parser.add_argument('--uzytkownik', required=True, help='Nazwa użytkownika - właściciela tras')
+        parser.add_argument('--obraz-tla', type=int, required=True, help='Identyfikator obrazu tła')
+        parser.add_argument('--format', choices=sorted(PARSERY), help='Format pliku (domyślnie z rozszerzenia)')
+        parser.add_argument('--coords', choices=['pixel', 'world'],
+                            help='Układ współrzędnych w pliku (domyślnie world dla GPX, pixel dla pozostałych)')
+
+    def handle(self, *args, **options):
+        uzytkownik = User.objects.filter(username=options['uzytkownik']).first()
+        if uzytkownik is None:
+            raise CommandError(f'Nie ma użytkownika {options["uzytkownik"]}.')
+        obraz_tla = ObrazTla.objects.filter(id=options['obraz_tla']).first()
+        if obraz_tla is None:
+            raise CommandError(f'Nie ma obrazu tła {options["obraz_tla"]}.')
+        format = options['format'] or format_pliku(options['plik'])
+        if format is None:
+            raise CommandError('Nie rozpoznano formatu pliku - podaj --format.')
+        swiat = None if options['coords'] is None else options['coords'] == 'world'
+
+        def postep(liczba_tras, liczba_punktow):
+            self.stdout.write(f'Trasy: {liczba_tras}, punkty: {liczba_punktow}')
+
+        nazwa = os.path.splitext(os.path.basename(options['plik']))[0]
+        try:
+            with open(options['plik'], 'rb') as plik:
+                trasy = importuj_trasy(plik, format, uzytkownik, obraz_tla, swiat=swiat, nazwa=nazwa, postep=postep)
+        except (OSError, ValueError, csv.Error) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Zaimportowano tras: {len(trasy)}'))
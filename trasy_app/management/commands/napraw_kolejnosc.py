@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from trasy_app.models import PunktTrasy
+from trasy_app.services import KROK_KOLEJNOSCI, ROZMIAR_PACZKI
+
+
+class Command(BaseCommand):
+    help = (
+        'Przenumerowuje punkty tras, w których kilka punktów ma tę samą kolejność (skutek '
+        'dawnego wyścigu przy dopisywaniu), zachowując ich porządek. Trzeba go uruchomić przed '
+        'migracją dodającą unikalność (trasa, kolejnosc) - czyta i zapisuje tylko kolumny '
+        'obecne także w starym schemacie bazy.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sprawdz', action='store_true', help='Tylko wypisz trasy ze zdublowaną kolejnością')
+
+    def handle(self, *args, **options):
+        trasy = sorted(set(
+            PunktTrasy.objects.order_by().values('trasa_id', 'kolejnosc').annotate(liczba=Count('id'))
+            .filter(liczba__gt=1).values_list('trasa_id', flat=True)
+        ))
+        if options['sprawdz']:
+            self.stdout.write(f'Trasy ze zdublowaną kolejnością: {", ".join(map(str, trasy)) or "brak"}')
+            return
+
+        for trasa_id in trasy:
+            # Dotychczasowy porządek - punkty o równej kolejności w kolejności dodania
+            ids = PunktTrasy.objects.filter(trasa_id=trasa_id).order_by('kolejnosc', 'id').values_list('id', flat=True)
+            with transaction.atomic():
+                PunktTrasy.objects.bulk_update(
+                    [PunktTrasy(id=id_punktu, kolejnosc=i * KROK_KOLEJNOSCI) for i, id_punktu in enumerate(ids, start=1)],
+                    ['kolejnosc'], batch_size=ROZMIAR_PACZKI
+                )
+        self.stdout.write(self.style.SUCCESS(f'Przenumerowano tras: {len(trasy)}'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from trasy_app.metryki import przelicz_metryki
+from trasy_app.models import Trasa
+from trasy_app.siatka import uzupelnij_komorki
+
+
+class Command(BaseCommand):
+    help = (
+        'Liczy od nowa metryki tras (liczba punktów, długość, prostokąt otaczający) '
+        'i komórki siatki indeksu przestrzennego punktów. Potrzebne po dodaniu tych pól '
+        'do istniejącej bazy - później są one aktualizowane na bieżąco.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('trasy', nargs='*', type=int, help='Identyfikatory tras (domyślnie wszystkie)')
+        parser.add_argument('--paczka', type=int, default=500, help='Liczba tras przeliczanych w jednej transakcji')
+
+    def handle(self, *args, **options):
+        trasy = options['trasy'] or list(Trasa.objects.order_by('id').values_list('id', flat=True))
+        paczka = options['paczka']
+        for poczatek in range(0, len(trasy), paczka):
+            with transaction.atomic():
+                przelicz_metryki(trasy[poczatek:poczatek + paczka])
+                uzupelnij_komorki(trasy[poczatek:poczatek + paczka])
+            self.stdout.write(f'Przeliczono {min(poczatek + paczka, len(trasy))} z {len(trasy)} tras')
+        self.stdout.write(self.style.SUCCESS('Gotowe'))
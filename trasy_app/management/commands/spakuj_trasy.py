@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from trasy_app.magazyn import rozpakuj_trase, spakuj_trase
+from trasy_app.models import GeometriaTrasy, Trasa
+
+
+class Command(BaseCommand):
+    help = (
+        'Zamienia punkty tras zapisane w wierszach PunktTrasy na jeden skompresowany blob '
+        'na trasę (GeometriaTrasy) albo - z opcją --rozpakuj - z powrotem na wiersze.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('trasy', nargs='*', type=int, help='Identyfikatory tras')
+        parser.add_argument('--wszystkie', action='store_true', help='Wszystkie trasy')
+        parser.add_argument('--rozpakuj', action='store_true', help='Przywróć wiersze punktów')
+        parser.add_argument('--min-punktow', type=int, default=0,
+                            help='Pakuj tylko trasy mające co najmniej tyle punktów')
+
+    def handle(self, *args, **options):
+        if not options['trasy'] and not options['wszystkie']:
+            raise CommandError('Podaj identyfikatory tras albo --wszystkie.')
+        if options['rozpakuj']:
+            trasy = GeometriaTrasy.objects.values_list('trasa_id', flat=True)
+            if options['trasy']:
+                trasy = trasy.filter(trasa_id__in=options['trasy'])
+            funkcja, opis = rozpakuj_trase, 'Rozpakowano'
+        else:
+            trasy = Trasa.objects.filter(geometria__isnull=True, liczba_punktow__gte=options['min_punktow'])
+            if options['trasy']:
+                trasy = trasy.filter(id__in=options['trasy'])
+            trasy = trasy.values_list('id', flat=True)
+            funkcja, opis = spakuj_trase, 'Spakowano'
+
+        trasy = list(trasy.order_by())
+        zmienione = 0
+        for i, trasa_id in enumerate(trasy, start=1):
+            # Każda trasa w osobnej transakcji - przerwanie nie cofa już przetworzonych
+            zmienione += funkcja(trasa_id)
+            if i % 100 == 0:
+                self.stdout.write(f'{i} z {len(trasy)} tras')
+        self.stdout.write(self.style.SUCCESS(f'{opis} tras: {zmienione}'))
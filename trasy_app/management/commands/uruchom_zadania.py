@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trasy_app.zadania import KolejkaBazodanowa
+
+
+class Command(BaseCommand):
+    help = (
+        'Wykonuje zadania w tle zapisane w bazie (TRASY_KOLEJKA_ZADAN = KolejkaBazodanowa). '
+        'Można uruchomić kilka procesów jednocześnie.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--raz', action='store_true', help='Wykonaj oczekujące zadania i zakończ')
+        parser.add_argument('--przerwa', type=float, default=2.0,
+                            help='Czas oczekiwania na nowe zadania w sekundach')
+
+    def handle(self, *args, **options):
+        kolejka = KolejkaBazodanowa()
+        while True:
+            wykonane = kolejka.wykonaj_oczekujace()
+            if wykonane:
+                self.stdout.write(f'Wykonano zadań: {wykonane}')
+            if options['raz']:
+                break
+            time.sleep(options['przerwa'])
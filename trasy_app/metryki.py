@@ -0,0 +1,208 @@
+"""
+Metryki tras przechowywane w modelu Trasa: liczba punktów, długość łamanej i prostokąt otaczający.
+
+Metryki są aktualizowane przyrostowo przy każdej zmianie punktu - długość zmienia się
+tylko o odcinki sąsiadujące ze zmienionym punktem, więc nie trzeba czytać całej trasy.
+Pełne przeliczenie (przelicz_metryki) jest potrzebne tylko po operacjach masowych
+i przy uzupełnianiu metryk istniejących tras (komenda przelicz_metryki).
+"""
+import math
+
+import numpy as np
+from django.db import connection
+from django.db.models import Count, F, FloatField, Max, Min, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, Least, Sqrt
+
+POLA_BBOX = ('min_x', 'min_y', 'max_x', 'max_y')
+
+
+def _xy(punkt):
+    # Widoki potrafią przypisać współrzędne wprost z formularza jako tekst
+    return int(punkt.x), int(punkt.y)
+
+
+def _odcinek(a, b):
+    if a is None or b is None:
+        return 0.0
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def wklad_punktu(trasa_id, xy, kolejnosc, bez_id=None):
+    """
+    O ile punkt xy o danym kluczu kolejności wydłuża trasę względem łamanej bez niego
+    """
+    from .models import PunktTrasy
+
+    punkty = PunktTrasy.objects.filter(trasa_id=trasa_id).exclude(id=bez_id).values_list('x', 'y')
+    poprzedni = punkty.filter(kolejnosc__lt=kolejnosc).order_by('-kolejnosc').first()
+    nastepny = punkty.filter(kolejnosc__gt=kolejnosc).order_by('kolejnosc').first()
+    return _odcinek(poprzedni, xy) + _odcinek(xy, nastepny) - _odcinek(poprzedni, nastepny)
+
+
+def _rozszerz_bbox(min_x, min_y, max_x, max_y):
+    """
+    Wyrażenia UPDATE poszerzające prostokąt otaczający trasy o podany zakres
+    """
+    return {
+        'min_x': Least(Coalesce(F('min_x'), Value(min_x)), Value(min_x)),
+        'min_y': Least(Coalesce(F('min_y'), Value(min_y)), Value(min_y)),
+        'max_x': Greatest(Coalesce(F('max_x'), Value(max_x)), Value(max_x)),
+        'max_y': Greatest(Coalesce(F('max_y'), Value(max_y)), Value(max_y)),
+    }
+
+
+def _bbox_z_punktow(trasa_id):
+    from .models import PunktTrasy
+
+    return PunktTrasy.objects.filter(trasa_id=trasa_id).aggregate(
+        min_x=Min('x'), min_y=Min('y'), max_x=Max('x'), max_y=Max('y')
+    )
+
+
+def _na_brzegu(trasa_id, xy):
+    """
+    Czy punkt leży na krawędzi prostokąta otaczającego - wtedy jego usunięcie może go zmniejszyć
+    """
+    from .models import Trasa
+
+    bbox = Trasa.objects.filter(id=trasa_id).values_list(*POLA_BBOX).first()
+    if bbox is None or bbox[0] is None:
+        return False
+    min_x, min_y, max_x, max_y = bbox
+    return xy[0] in (min_x, max_x) or xy[1] in (min_y, max_y)
+
+
+def punkt_dodany(punkt):
+    from .models import Trasa
+
+    xy = _xy(punkt)
+    Trasa.objects.filter(id=punkt.trasa_id).update(
+        liczba_punktow=F('liczba_punktow') + 1,
+        dlugosc=F('dlugosc') + wklad_punktu(punkt.trasa_id, xy, punkt.kolejnosc, bez_id=punkt.id),
+        **_rozszerz_bbox(*xy, *xy),
+    )
+
+
+def punkt_zmieniony(punkt, stary):
+    """
+    Aktualizuje metryki po zmianie punktu; stary to krotka (x, y, kolejnosc) sprzed zapisu
+    """
+    from .models import Trasa
+
+    xy, stare_xy = _xy(punkt), (stary[0], stary[1])
+    if xy == stare_xy and int(punkt.kolejnosc) == stary[2]:
+        return
+
+    # Zmiana punktu to usunięcie go ze starego miejsca i wstawienie w nowe
+    zmiany = {'dlugosc': F('dlugosc')
+              + wklad_punktu(punkt.trasa_id, xy, punkt.kolejnosc, bez_id=punkt.id)
+              - wklad_punktu(punkt.trasa_id, stare_xy, stary[2], bez_id=punkt.id)}
+    if xy != stare_xy:
+        if _na_brzegu(punkt.trasa_id, stare_xy):
+            zmiany.update(_bbox_z_punktow(punkt.trasa_id))
+        else:
+            zmiany.update(_rozszerz_bbox(*xy, *xy))
+    Trasa.objects.filter(id=punkt.trasa_id).update(**zmiany)
+
+
+def punkt_usuniety(punkt):
+    """
+    Aktualizuje metryki po usunięciu punktu (wywoływane, gdy punktu nie ma już w bazie)
+    """
+    from .models import Trasa
+
+    xy = _xy(punkt)
+    zmiany = {
+        'liczba_punktow': F('liczba_punktow') - 1,
+        # Przyrostowe odejmowanie może zostawić błąd zaokrąglenia poniżej zera
+        'dlugosc': Greatest(F('dlugosc') - wklad_punktu(punkt.trasa_id, xy, punkt.kolejnosc), Value(0.0)),
+    }
+    if _na_brzegu(punkt.trasa_id, xy):
+        zmiany.update(_bbox_z_punktow(punkt.trasa_id))
+    Trasa.objects.filter(id=punkt.trasa_id).update(**zmiany)
+
+
+def metryki_dopisania(ostatni, xy):
+    """
+    Wyrażenia UPDATE trasy po dopisaniu punktu xy na koniec - ostatni to queryset punktów
+    trasy (OuterRef('pk')) od ostatniego. Odcinek od ostatniego punktu liczy to samo zapytanie.
+    """
+    dx = Cast(Subquery(ostatni.values('x')[:1]), FloatField()) - float(xy[0])
+    dy = Cast(Subquery(ostatni.values('y')[:1]), FloatField()) - float(xy[1])
+    return {
+        'liczba_punktow': F('liczba_punktow') + 1,
+        'dlugosc': F('dlugosc') + Coalesce(Sqrt(dx * dx + dy * dy), Value(0.0)),
+        **_rozszerz_bbox(*xy, *xy),
+    }
+
+
+def punkty_dopisane(trasa_id, wspolrzedne, poprzedni=None):
+    """
+    Aktualizuje metryki po dopisaniu listy punktów (x, y) na koniec trasy
+    za punktem poprzedni (para x, y albo None dla pustej trasy)
+    """
+    from .models import Trasa
+
+    if not wspolrzedne:
+        return
+    tablica = np.asarray(wspolrzedne if poprzedni is None else [poprzedni, *wspolrzedne], dtype=np.float64)
+    dlugosc = float(np.hypot(*np.diff(tablica, axis=0).T).sum())
+    najmniejsze, najwieksze = tablica.min(axis=0), tablica.max(axis=0)
+
+    Trasa.objects.filter(id=trasa_id).update(
+        liczba_punktow=F('liczba_punktow') + len(wspolrzedne),
+        dlugosc=F('dlugosc') + dlugosc,
+        **_rozszerz_bbox(int(najmniejsze[0]), int(najmniejsze[1]), int(najwieksze[0]), int(najwieksze[1])),
+    )
+
+
+def dlugosci_tras(trasy_ids):
+    """
+    Długości łamanych tras liczone w bazie funkcją okna LAG - bez pobierania punktów.
+    Zwraca słownik {trasa_id: dlugosc}; trasy z mniej niż dwoma punktami mają długość 0.
+    """
+    from .models import PunktTrasy
+
+    trasy_ids = list(trasy_ids)
+    if not trasy_ids:
+        return {}
+
+    tabela = connection.ops.quote_name(PunktTrasy._meta.db_table)
+    znaczniki = ', '.join(['%s'] * len(trasy_ids))
+    sql = f"""
+        SELECT trasa_id, SUM(SQRT(1.0 * (x - px) * (x - px) + 1.0 * (y - py) * (y - py)))
+        FROM (
+            SELECT trasa_id, x, y,
+                   LAG(x) OVER (PARTITION BY trasa_id ORDER BY kolejnosc) AS px,
+                   LAG(y) OVER (PARTITION BY trasa_id ORDER BY kolejnosc) AS py
+            FROM {tabela}
+            WHERE trasa_id IN ({znaczniki})
+        ) odcinki
+        WHERE px IS NOT NULL
+        GROUP BY trasa_id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, trasy_ids)
+        dlugosci = {trasa_id: float(dlugosc) for trasa_id, dlugosc in cursor.fetchall()}
+    return {trasa_id: dlugosci.get(trasa_id, 0.0) for trasa_id in trasy_ids}
+
+
+def przelicz_metryki(trasy_ids):
+    """
+    Liczy metryki podanych tras od nowa na podstawie ich punktów
+    """
+    from .models import GeometriaTrasy, PunktTrasy, Trasa
+
+    # Trasy spakowane (magazyn.py) nie mają wierszy punktów, a ich metryki się nie zmieniają
+    spakowane = set(GeometriaTrasy.objects.filter(trasa_id__in=list(trasy_ids)).values_list('trasa_id', flat=True))
+    trasy_ids = [trasa_id for trasa_id in trasy_ids if trasa_id not in spakowane]
+    dlugosci = dlugosci_tras(trasy_ids)
+    zakresy = {
+        wiersz.pop('trasa_id'): wiersz
+        for wiersz in PunktTrasy.objects.filter(trasa_id__in=trasy_ids).order_by().values('trasa_id').annotate(
+            liczba_punktow=Count('id'), min_x=Min('x'), min_y=Min('y'), max_x=Max('x'), max_y=Max('y')
+        )
+    }
+    pusta = dict(liczba_punktow=0, min_x=None, min_y=None, max_x=None, max_y=None)
+    for trasa_id in trasy_ids:
+        Trasa.objects.filter(id=trasa_id).update(dlugosc=dlugosci[trasa_id], **zakresy.get(trasa_id, pusta))
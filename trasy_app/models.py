@@ -1,17 +1,71 @@
+from django.core.exceptions import ValidationError
+from django.core.files.images import get_image_dimensions
 from django.db import models
 from django.contrib.auth.models import User
 
 class ObrazTla(models.Model):
+    # Etapy przetwarzania wgranego pliku (patrz obrazy.przetworz_obraz_tla)
+    OCZEKUJE = 'oczekuje'
+    PRZETWARZANIE = 'przetwarzanie'
+    GOTOWY = 'gotowy'
+    BLAD = 'blad'
+    STATUSY = [
+        (OCZEKUJE, 'Oczekuje na przetworzenie'),
+        (PRZETWARZANIE, 'Przetwarzanie'),
+        (GOTOWY, 'Gotowy'),
+        (BLAD, 'Błąd przetwarzania'),
+    ]
+    
     nazwa = models.CharField(max_length=100)
     opis = models.TextField(blank=True)
     obraz = models.ImageField(upload_to='tla/')
-    szerokosc = models.IntegerField()
-    wysokosc = models.IntegerField()
+    # Wymiary odczytywane z nagłówka pliku przy wgraniu
+    szerokosc = models.IntegerField(default=0, editable=False)
+    wysokosc = models.IntegerField(default=0, editable=False)
     data_dodania = models.DateTimeField(auto_now_add=True)
+    # Podglądy generowane w tle po wgraniu obrazu - patrz obrazy.py
+    miniatura = models.ImageField(upload_to='tla/', blank=True, editable=False)
+    status = models.CharField(max_length=15, choices=STATUSY, default=OCZEKUJE, editable=False)
+    # Przekształcenie afiniczne pikseli na współrzędne geograficzne [a, b, c, d, e, f]:
+    # dł. geogr. = a*x + b*y + c, szer. geogr. = d*x + e*y + f (patrz eksport.py)
+    transformacja = models.JSONField(null=True, blank=True)
     
     def __str__(self):
         return self.nazwa
     
+    def clean(self):
+        wspolczynniki = self.transformacja
+        if wspolczynniki is not None and not (
+            isinstance(wspolczynniki, list) and len(wspolczynniki) == 6
+            and all(isinstance(w, (int, float)) and not isinstance(w, bool) for w in wspolczynniki)
+        ):
+            raise ValidationError({'transformacja': 'Podaj listę sześciu liczb [a, b, c, d, e, f].'})
+    
+    @property
+    def kafelki_gotowe(self):
+        return self.status == self.GOTOWY
+    
+    def save(self, *args, **kwargs):
+        from .obrazy import przetworz_obraz_tla
+        from .zadania import zlec
+        poprzedni = None
+        if not self._state.adding:
+            poprzedni = ObrazTla.objects.filter(id=self.id).values_list('obraz', flat=True).first()
+        
+        # Przetwarzanie tylko dla nowego pliku - sama zmiana opisu go nie dotyczy
+        nowy_plik = bool(self.obraz) and self.obraz.name != poprzedni
+        if nowy_plik:
+            # Sam nagłówek pliku - bez dekodowania całego skanu w wątku żądania
+            szerokosc, wysokosc = get_image_dimensions(self.obraz)
+            if szerokosc and wysokosc:
+                self.szerokosc, self.wysokosc = szerokosc, wysokosc
+            self.miniatura = ''
+            self.status = self.OCZEKUJE
+        super().save(*args, **kwargs)
+        
+        if nowy_plik:
+            zlec(przetworz_obraz_tla, self.id, poprzedni)
+    
     class Meta:
         verbose_name = "Obraz tła"
         verbose_name_plural = "Obrazy tła"
@@ -23,6 +77,17 @@ class Trasa(models.Model):
     obraz_tla = models.ForeignKey(ObrazTla, on_delete=models.CASCADE, related_name='trasy')
     data_utworzenia = models.DateTimeField(auto_now_add=True)
     data_modyfikacji = models.DateTimeField(auto_now=True)
+    # Licznik zmian punktów trasy - patrz rewizje.py
+    rewizja = models.PositiveIntegerField(default=0, editable=False)
+    # Ostatni klucz kolejności nadany przy dopisywaniu punktów - patrz services.zarezerwuj_kolejnosc
+    ostatnia_kolejnosc = models.IntegerField(default=0, editable=False)
+    # Metryki aktualizowane przyrostowo przy zmianach punktów - patrz metryki.py
+    liczba_punktow = models.PositiveIntegerField(default=0, editable=False)
+    dlugosc = models.FloatField(default=0.0, editable=False)
+    min_x = models.IntegerField(null=True, editable=False)
+    min_y = models.IntegerField(null=True, editable=False)
+    max_x = models.IntegerField(null=True, editable=False)
+    max_y = models.IntegerField(null=True, editable=False)
     
     def __str__(self):
         return f"{self.nazwa} ({self.uzytkownik.username})"
@@ -30,17 +95,181 @@ class Trasa(models.Model):
     class Meta:
         verbose_name = "Trasa"
         verbose_name_plural = "Trasy"
+        indexes = [
+            # Lista "Moje trasy" i API - trasy użytkownika od ostatnio zmienianych
+            models.Index(fields=['uzytkownik', 'data_modyfikacji'], name='trasa_uzytkownik_modyf_idx'),
+        ]
 
 class PunktTrasy(models.Model):
     trasa = models.ForeignKey(Trasa, on_delete=models.CASCADE, related_name='punkty')
     x = models.IntegerField()
     y = models.IntegerField()
     kolejnosc = models.IntegerField()
+    # Komórka siatki indeksu przestrzennego, wyliczana z x i y przy zapisie - patrz siatka.py
+    komorka = models.BigIntegerField(null=True, editable=False)
     
     def __str__(self):
         return f"Punkt {self.kolejnosc} trasy {self.trasa.nazwa} ({self.x}, {self.y})"
     
+    def save(self, *args, **kwargs):
+        from .rewizje import grupuj_zmiany, zglos_zmiany, zmiana_punktu
+        from .metryki import punkt_dodany, punkt_zmieniony
+        from .siatka import komorka
+        self.komorka = komorka(self.x, self.y)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'x', 'y'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'komorka'}
+        with grupuj_zmiany():
+            stary = None
+            if not self._state.adding:
+                stary = PunktTrasy.objects.filter(id=self.id).values_list('x', 'y', 'kolejnosc').first()
+            super().save(*args, **kwargs)
+            if stary is None:
+                punkt_dodany(self)
+                zglos_zmiany(self.trasa_id, [zmiana_punktu(ZmianaTrasy.DODANIE, self)])
+            else:
+                punkt_zmieniony(self, stary)
+                zglos_zmiany(self.trasa_id, [zmiana_punktu(ZmianaTrasy.ZMIANA, self)])
+    
+    def delete(self, *args, **kwargs):
+        from .rewizje import grupuj_zmiany, zglos_zmiany, zmiana_punktu
+        from .metryki import punkt_usuniety
+        zmiana = zmiana_punktu(ZmianaTrasy.USUNIECIE, self)
+        with grupuj_zmiany():
+            wynik = super().delete(*args, **kwargs)
+            punkt_usuniety(self)
+            zglos_zmiany(self.trasa_id, [zmiana])
+        return wynik
+    
     class Meta:
         verbose_name = "Punkt trasy"
         verbose_name_plural = "Punkty trasy"
-        ordering = ['kolejnosc']
\ No newline at end of file
+        ordering = ['kolejnosc']
+        constraints = [
+            # Indeks (trasa, kolejnosc) obsługuje wszystkie gorące zapytania: punkty trasy
+            # w kolejności, ostatni punkt przy dopisywaniu i sąsiadów przy przesuwaniu
+            models.UniqueConstraint(fields=['trasa', 'kolejnosc'], name='punkt_trasa_kolejnosc_uniq'),
+        ]
+        indexes = [
+            # Zapytania o punkty i trasy w obszarze mapy - zakresy numerów komórek siatki
+            models.Index(fields=['komorka', 'trasa'], name='punkt_komorka_trasa_idx'),
+        ]
+
+class GeometriaTrasy(models.Model):
+    """
+    Punkty spakowanej trasy jako jeden skompresowany blob zamiast wierszy PunktTrasy (patrz magazyn.py)
+    """
+    trasa = models.OneToOneField(Trasa, on_delete=models.CASCADE, primary_key=True, related_name='geometria')
+    # Format kodowanie.spakuj_punkty (kolumny id, x, y, kolejnosc jako delty int32) skompresowany zlib
+    dane = models.BinaryField()
+    
+    def __str__(self):
+        return f"Geometria trasy {self.trasa_id}"
+    
+    class Meta:
+        verbose_name = "Geometria trasy"
+        verbose_name_plural = "Geometrie tras"
+
+class ZmianaTrasy(models.Model):
+    """
+    Wpis dziennika zmian punktów trasy (patrz rewizje.py)
+    """
+    DODANIE = 'dodanie'
+    ZMIANA = 'zmiana'
+    USUNIECIE = 'usuniecie'
+    PRZEBUDOWA = 'przebudowa'
+    OPERACJE = [
+        (DODANIE, 'Dodanie punktu'),
+        (ZMIANA, 'Zmiana punktu'),
+        (USUNIECIE, 'Usunięcie punktu'),
+        (PRZEBUDOWA, 'Przebudowa trasy'),
+    ]
+    
+    trasa = models.ForeignKey(Trasa, on_delete=models.CASCADE, related_name='zmiany')
+    rewizja = models.PositiveIntegerField()
+    operacja = models.CharField(max_length=10, choices=OPERACJE)
+    # Zwykła liczba zamiast klucza obcego - punkt mógł już zostać usunięty
+    id_punktu = models.BigIntegerField(null=True)
+    x = models.IntegerField(null=True)
+    y = models.IntegerField(null=True)
+    kolejnosc = models.IntegerField(null=True)
+    
+    def __str__(self):
+        return f"{self.get_operacja_display()} (rewizja {self.rewizja} trasy {self.trasa_id})"
+    
+    class Meta:
+        verbose_name = "Zmiana trasy"
+        verbose_name_plural = "Zmiany tras"
+        indexes = [models.Index(fields=['trasa', 'rewizja'])]
+
+class Zadanie(models.Model):
+    """
+    Zadanie w tle zapisane w bazie (patrz zadania.KolejkaBazodanowa)
+    """
+    OCZEKUJE = 'oczekuje'
+    W_TOKU = 'w_toku'
+    ZAKONCZONE = 'zakonczone'
+    BLAD = 'blad'
+    STATUSY = [
+        (OCZEKUJE, 'Oczekuje'),
+        (W_TOKU, 'W toku'),
+        (ZAKONCZONE, 'Zakończone'),
+        (BLAD, 'Błąd'),
+    ]
+    
+    funkcja = models.CharField(max_length=200)
+    argumenty = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUSY, default=OCZEKUJE)
+    proby = models.PositiveSmallIntegerField(default=0)
+    blad = models.TextField(blank=True)
+    data_utworzenia = models.DateTimeField(auto_now_add=True)
+    data_modyfikacji = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.funkcja} ({self.get_status_display()})"
+    
+    class Meta:
+        verbose_name = "Zadanie"
+        verbose_name_plural = "Zadania"
+        # Robotnik szuka najstarszego oczekującego zadania
+        indexes = [models.Index(fields=['status', 'id'])]
+
+class ImportTras(models.Model):
+    """
+    Import tras z pliku GPX, GeoJSON lub CSV wykonywany w tle (patrz importowanie.wykonaj_import)
+    """
+    OCZEKUJE = 'oczekuje'
+    W_TOKU = 'w_toku'
+    ZAKONCZONY = 'zakonczony'
+    BLAD = 'blad'
+    STATUSY = [
+        (OCZEKUJE, 'Oczekuje'),
+        (W_TOKU, 'W toku'),
+        (ZAKONCZONY, 'Zakończony'),
+        (BLAD, 'Błąd'),
+    ]
+    FORMATY = [
+        ('gpx', 'GPX'),
+        ('geojson', 'GeoJSON'),
+        ('csv', 'CSV'),
+    ]
+    
+    uzytkownik = models.ForeignKey(User, on_delete=models.CASCADE, related_name='importy')
+    obraz_tla = models.ForeignKey(ObrazTla, on_delete=models.CASCADE, related_name='importy')
+    # Plik jest usuwany po udanym imporcie
+    plik = models.FileField(upload_to='importy/', blank=True)
+    format = models.CharField(max_length=10, choices=FORMATY)
+    # Współrzędne geograficzne zamiast pikseli - domyślnie (None) tylko dla GPX
+    wspolrzedne_geograficzne = models.BooleanField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSY, default=OCZEKUJE, editable=False)
+    liczba_tras = models.PositiveIntegerField(default=0, editable=False)
+    liczba_punktow = models.PositiveIntegerField(default=0, editable=False)
+    blad = models.TextField(blank=True, editable=False)
+    data_utworzenia = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Import {self.id} ({self.get_status_display()})"
+    
+    class Meta:
+        verbose_name = "Import tras"
+        verbose_name_plural = "Importy tras"
@@ -0,0 +1,183 @@
+"""
+Podglądy tras - łamana trasy narysowana na obrazie tła, zapisana jako PNG lub WebP.
+
+Gotowy podgląd trafia do magazynu mediów pod nazwą zawierającą rewizję trasy i parametry
+obrazu, więc kolejne żądania tego samego podglądu tylko odczytują plik. Tło jest składane
+z piramidy kafelków (patrz obrazy.py) na najmniejszym wystarczającym poziomie, dzięki czemu
+podgląd fragmentu ogromnej mapy nie wymaga dekodowania całego skanu.
+"""
+import io
+import math
+import zlib
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageDraw
+
+from .geometria import punkty_uproszczone
+from .obrazy import ROZMIAR_KAFELKA, najwyzszy_poziom, otworz_obraz, sciezka_kafelka
+
+KATALOG_PODGLADOW = 'podglady'
+FORMATY = {'png': 'PNG', 'webp': 'WEBP'}
+DOMYSLNA_SZEROKOSC = 800
+MAKS_ROZMIAR = 4096
+# Margines wokół prostokąta otaczającego przy przycinaniu - ułamek jego rozmiaru, ale nie mniej niż piksele
+MARGINES = 0.05
+MARGINES_MIN = 16
+# Powyżej tej liczby punktów rysujemy samą linię, bez znaczników punktów
+MAKS_ZNACZNIKOW = 200
+
+
+def parametry_podgladu(parametry):
+    """
+    Odczytuje (szerokosc, wysokosc, przyciecie) z parametrów ?width=, ?height= i ?crop=bbox.
+    Podglądu nie powiększamy ponad podane wymiary; niepoprawne wartości zgłaszają ValueError.
+    """
+    wymiary = []
+    for nazwa in ('width', 'height'):
+        wartosc = parametry.get(nazwa)
+        if wartosc is not None and (not wartosc.isdigit() or not 1 <= int(wartosc) <= MAKS_ROZMIAR):
+            raise ValueError(f'Parametr {nazwa} musi być liczbą całkowitą od 1 do {MAKS_ROZMIAR}.')
+        wymiary.append(int(wartosc) if wartosc is not None else None)
+    szerokosc, wysokosc = wymiary
+    if szerokosc is None and wysokosc is None:
+        szerokosc = DOMYSLNA_SZEROKOSC
+
+    przyciecie = parametry.get('crop', '')
+    if przyciecie not in ('', 'bbox'):
+        raise ValueError('Parametr crop przyjmuje tylko wartość bbox.')
+    return szerokosc, wysokosc, przyciecie == 'bbox'
+
+
+def _obszar(trasa, przyciecie):
+    """
+    Fragment tła (x0, y0, x1, y1) widoczny na podglądzie
+    """
+    tlo = trasa.obraz_tla
+    if not przyciecie or trasa.min_x is None:
+        return 0, 0, tlo.szerokosc, tlo.wysokosc
+    margines = max(MARGINES_MIN, MARGINES * max(trasa.max_x - trasa.min_x, trasa.max_y - trasa.min_y))
+    return (trasa.min_x - margines, trasa.min_y - margines,
+            trasa.max_x + margines, trasa.max_y + margines)
+
+
+def _zrodlo_z_kafelkow(tlo, obszar, skala):
+    """
+    Składa z kafelków fragment piramidy pokrywający obszar - na najmniejszym poziomie,
+    który jest co najmniej tak dokładny jak podgląd. Zwraca (obraz, x, y, skala_poziomu),
+    gdzie x, y to położenie obrazu w układzie tego poziomu.
+    """
+    najwyzszy = najwyzszy_poziom(tlo.szerokosc, tlo.wysokosc)
+    zmniejszenie = min(najwyzszy, max(0, math.floor(math.log2(1 / skala)))) if skala < 1 else 0
+    skala_poziomu = 2 ** -zmniejszenie
+    szerokosc = math.ceil(tlo.szerokosc * skala_poziomu)
+    wysokosc = math.ceil(tlo.wysokosc * skala_poziomu)
+
+    x0, y0 = max(0, math.floor(obszar[0] * skala_poziomu)), max(0, math.floor(obszar[1] * skala_poziomu))
+    x1, y1 = min(szerokosc, math.ceil(obszar[2] * skala_poziomu)), min(wysokosc, math.ceil(obszar[3] * skala_poziomu))
+    if x1 <= x0 or y1 <= y0:
+        return None
+
+    kolumny = range(x0 // ROZMIAR_KAFELKA, (x1 - 1) // ROZMIAR_KAFELKA + 1)
+    wiersze = range(y0 // ROZMIAR_KAFELKA, (y1 - 1) // ROZMIAR_KAFELKA + 1)
+    mozaika = Image.new('RGB', (len(kolumny) * ROZMIAR_KAFELKA, len(wiersze) * ROZMIAR_KAFELKA), 'white')
+    storage = tlo.obraz.storage
+    for i, kolumna in enumerate(kolumny):
+        for j, wiersz in enumerate(wiersze):
+            nazwa = sciezka_kafelka(tlo, najwyzszy - zmniejszenie, kolumna, wiersz)
+            if not storage.exists(nazwa):
+                continue
+            with storage.open(nazwa) as plik, Image.open(plik) as kafelek:
+                mozaika.paste(kafelek, (i * ROZMIAR_KAFELKA, j * ROZMIAR_KAFELKA))
+    return mozaika, kolumny[0] * ROZMIAR_KAFELKA, wiersze[0] * ROZMIAR_KAFELKA, skala_poziomu
+
+
+def _zrodlo_z_oryginalu(tlo, skala):
+    """
+    Oryginał obrazu tła, dla JPEG dekodowany od razu w zmniejszonej rozdzielczości
+    """
+    try:
+        with tlo.obraz.open('rb') as plik, otworz_obraz(plik) as oryginal:
+            oryginal.draft('RGB', (math.ceil(oryginal.width * skala), math.ceil(oryginal.height * skala)))
+            obraz = oryginal.convert('RGB')
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    skala_obrazu = obraz.width / max(tlo.szerokosc, 1)
+    # Dalsze zmniejszenie o całkowitą krotność - resztę zrobi przekształcenie z interpolacją
+    krotnosc = math.floor(skala_obrazu / skala) if skala < skala_obrazu else 1
+    if krotnosc > 1:
+        obraz = obraz.reduce(krotnosc)
+        skala_obrazu = obraz.width / max(tlo.szerokosc, 1)
+    return obraz, 0, 0, skala_obrazu
+
+
+def renderuj_podglad(trasa, szerokosc=None, wysokosc=None, przyciecie=False):
+    """
+    Rysuje trasę na jej tle i zwraca obraz Pillow
+    """
+    obszar = _obszar(trasa, przyciecie)
+    szerokosc_obszaru = max(obszar[2] - obszar[0], 1)
+    wysokosc_obszaru = max(obszar[3] - obszar[1], 1)
+    skala = min(s for s in (
+        szerokosc / szerokosc_obszaru if szerokosc else None,
+        wysokosc / wysokosc_obszaru if wysokosc else None,
+    ) if s is not None)
+    # Wymiar wyliczony z proporcji obszaru (np. wysokość przy samym ?width=) też ma limit -
+    # dłuższy bok podglądu nie przekracza MAKS_ROZMIAR, proporcje zostają zachowane
+    skala = min(skala, MAKS_ROZMIAR / szerokosc_obszaru, MAKS_ROZMIAR / wysokosc_obszaru)
+    rozmiar = (max(1, round(szerokosc_obszaru * skala)), max(1, round(wysokosc_obszaru * skala)))
+
+    tlo = trasa.obraz_tla
+    zrodlo = None
+    if tlo.kafelki_gotowe:
+        zrodlo = _zrodlo_z_kafelkow(tlo, obszar, skala)
+    elif tlo.obraz:
+        zrodlo = _zrodlo_z_oryginalu(tlo, skala)
+
+    if zrodlo is None:
+        obraz = Image.new('RGB', rozmiar, 'white')
+    else:
+        # Wycięcie i przeskalowanie w jednym kroku; obszar poza tłem wypełnia się bielą
+        zrodlo_obraz, x, y, s = zrodlo
+        obraz = zrodlo_obraz.transform(
+            rozmiar, Image.Transform.EXTENT,
+            (obszar[0] * s - x, obszar[1] * s - y, obszar[2] * s - x, obszar[3] * s - y),
+            Image.Resampling.BILINEAR, fillcolor='white',
+        )
+
+    # Punkty krótsze niż pół piksela podglądu i tak nie byłyby widoczne
+    punkty = punkty_uproszczone(trasa.id, trasa.rewizja, tolerancja=0.5 / skala)
+    skala_x, skala_y = rozmiar[0] / szerokosc_obszaru, rozmiar[1] / wysokosc_obszaru
+    xy = [((x - obszar[0]) * skala_x, (y - obszar[1]) * skala_y) for x, y in punkty[:, 1:3].tolist()]
+
+    rysunek = ImageDraw.Draw(obraz)
+    if len(xy) > 1:
+        rysunek.line(xy, fill='red', width=2, joint='curve')
+    if len(xy) <= MAKS_ZNACZNIKOW:
+        for x, y in xy:
+            rysunek.ellipse((x - 4, y - 4, x + 4, y + 4), fill='blue')
+    return obraz
+
+
+def podglad_trasy(trasa, szerokosc=None, wysokosc=None, przyciecie=False, format='png'):
+    """
+    Zwraca nazwę pliku z podglądem trasy w magazynie mediów, renderując go przy pierwszym żądaniu
+    """
+    tlo = trasa.obraz_tla
+    # Podmiana pliku tła też musi unieważnić podgląd
+    wersja_tla = zlib.crc32(f'{tlo.id}:{tlo.obraz.name}:{tlo.kafelki_gotowe}'.encode())
+    katalog = f'{KATALOG_PODGLADOW}/{trasa.id}'
+    nazwa = (f'{katalog}/{trasa.rewizja}_{wersja_tla:08x}_{szerokosc or 0}x{wysokosc or 0}'
+             f'{"_bbox" if przyciecie else ""}.{format}')
+    if default_storage.exists(nazwa):
+        return nazwa
+
+    bufor = io.BytesIO()
+    renderuj_podglad(trasa, szerokosc, wysokosc, przyciecie).save(bufor, FORMATY[format])
+
+    # Podglądy starszych rewizji nie będą już potrzebne
+    if default_storage.exists(katalog):
+        for plik in default_storage.listdir(katalog)[1]:
+            if not plik.startswith(f'{trasa.rewizja}_'):
+                default_storage.delete(f'{katalog}/{plik}')
+    return default_storage.save(nazwa, ContentFile(bufor.getvalue()))
@@ -0,0 +1,179 @@
+"""
+Przetwarzanie wgranych obrazów tła: miniatury i piramidy kafelków (Deep Zoom).
+
+Podglądy są zapisywane obok oryginału, w katalogu o nazwie pliku z przyrostkiem _pliki:
+    tla/mapa.jpg
+    tla/mapa_pliki/miniatura.jpg
+    tla/mapa_pliki/kafelki/<poziom>/<kolumna>_<wiersz>.jpg
+
+Poziomy piramidy są zgodne z formatem Deep Zoom (DZI): poziom 0 to obraz 1x1 px,
+każdy kolejny jest dwa razy większy, a ostatni ma rozmiar oryginału.
+"""
+import io
+import logging
+import math
+import posixpath
+import threading
+from contextlib import contextmanager
+
+from django.core.files.base import ContentFile
+from PIL import ExifTags, Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+ROZMIAR_MINIATURY = 300
+ROZMIAR_KAFELKA = 256
+JAKOSC_JPEG = 85
+# Formaty wyświetlane przez przeglądarki - pozostałe (np. TIFF, BMP) są zamieniane na JPEG
+FORMATY_PRZEGLADAREK = ('JPEG', 'PNG', 'WEBP', 'GIF')
+
+# Skany map mają setki milionów pikseli - więcej niż domyślny limit Pillow chroniący
+# przed "bombami dekompresji". Obrazy tła dodaje tylko administrator, więc ich limit jest
+# wyższy - ale tylko przy otwieraniu obrazów tła (otworz_obraz), a nie w całym procesie.
+MAKS_PIKSELI = 500_000_000
+_blokada_limitu = threading.Lock()
+
+
+@contextmanager
+def otworz_obraz(plik):
+    """
+    Image.open z limitem pikseli obrazów tła (MAKS_PIKSELI) zamiast domyślnego limitu Pillow.
+    Limit jest sprawdzany przy odczycie nagłówka, więc podmiana trwa tylko na czas Image.open.
+    """
+    with _blokada_limitu:
+        domyslny = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = MAKS_PIKSELI
+        try:
+            obraz = Image.open(plik)
+        finally:
+            Image.MAX_IMAGE_PIXELS = domyslny
+    with obraz:
+        yield obraz
+
+
+def katalog_podgladow(obraz_tla):
+    nazwa, _ = posixpath.splitext(obraz_tla.obraz.name)
+    return f'{nazwa}_pliki'
+
+
+def sciezka_miniatury(obraz_tla):
+    return f'{katalog_podgladow(obraz_tla)}/miniatura.jpg'
+
+
+def sciezka_kafelka(obraz_tla, poziom, kolumna, wiersz):
+    return f'{katalog_podgladow(obraz_tla)}/kafelki/{poziom}/{kolumna}_{wiersz}.jpg'
+
+
+def najwyzszy_poziom(szerokosc, wysokosc):
+    """
+    Numer poziomu piramidy o rozmiarze oryginału
+    """
+    return math.ceil(math.log2(max(szerokosc, wysokosc, 1)))
+
+
+def opis_dzi(obraz_tla):
+    """
+    Deskryptor piramidy w formacie Deep Zoom (XML)
+    """
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{ROZMIAR_KAFELKA}" '
+        f'Overlap="0" Format="jpg"><Size Width="{obraz_tla.szerokosc}" Height="{obraz_tla.wysokosc}"/></Image>'
+    )
+
+
+def _zapisz_jpeg(storage, nazwa, obraz):
+    bufor = io.BytesIO()
+    obraz.save(bufor, 'JPEG', quality=JAKOSC_JPEG)
+    storage.save(nazwa, ContentFile(bufor.getvalue()))
+
+
+def _usun_katalog(storage, katalog):
+    if not storage.exists(katalog):
+        return
+    katalogi, pliki = storage.listdir(katalog)
+    for plik in pliki:
+        storage.delete(f'{katalog}/{plik}')
+    for podkatalog in katalogi:
+        _usun_katalog(storage, f'{katalog}/{podkatalog}')
+
+
+def generuj_podglady(obraz_tla, obraz):
+    """
+    Tworzy miniaturę i piramidę kafelków z obrazu Pillow (RGB) i zapisuje je obok oryginału
+    """
+    storage = obraz_tla.obraz.storage
+    _usun_katalog(storage, katalog_podgladow(obraz_tla))
+
+    miniatura = None
+    for poziom in range(najwyzszy_poziom(*obraz.size), -1, -1):
+        szerokosc, wysokosc = obraz.size
+        for kolumna in range(math.ceil(szerokosc / ROZMIAR_KAFELKA)):
+            for wiersz in range(math.ceil(wysokosc / ROZMIAR_KAFELKA)):
+                x, y = kolumna * ROZMIAR_KAFELKA, wiersz * ROZMIAR_KAFELKA
+                kafelek = obraz.crop((x, y, min(x + ROZMIAR_KAFELKA, szerokosc), min(y + ROZMIAR_KAFELKA, wysokosc)))
+                _zapisz_jpeg(storage, sciezka_kafelka(obraz_tla, poziom, kolumna, wiersz), kafelek)
+
+        # Miniaturę skalujemy z pierwszego poziomu nie większego niż jej dwukrotność, a nie z oryginału
+        if miniatura is None and max(obraz.size) <= 2 * ROZMIAR_MINIATURY:
+            miniatura = obraz.copy()
+            miniatura.thumbnail((ROZMIAR_MINIATURY, ROZMIAR_MINIATURY))
+        # Kolejny poziom jest o połowę mniejszy (z zaokrągleniem w górę, jak w Deep Zoom)
+        obraz = obraz.reduce(2)
+
+    _zapisz_jpeg(storage, sciezka_miniatury(obraz_tla), miniatura)
+    obraz_tla.miniatura.name = sciezka_miniatury(obraz_tla)
+
+
+def _normalizuj(obraz_tla, oryginal):
+    """
+    Obraz RGB w orientacji zapisanej w EXIF. Pliki w formatach nieobsługiwanych przez
+    przeglądarki oraz obrócone zdjęcia są zastępowane plikiem JPEG w poprawnej orientacji.
+    """
+    obrocony = oryginal.getexif().get(ExifTags.Base.Orientation, 1) != 1
+    obraz = ImageOps.exif_transpose(oryginal).convert('RGB')
+    if not obrocony and oryginal.format in FORMATY_PRZEGLADAREK:
+        return obraz
+
+    storage = obraz_tla.obraz.storage
+    stara_nazwa = obraz_tla.obraz.name
+    bufor = io.BytesIO()
+    obraz.save(bufor, 'JPEG', quality=JAKOSC_JPEG)
+    obraz_tla.obraz.name = storage.save(f'{posixpath.splitext(stara_nazwa)[0]}.jpg', ContentFile(bufor.getvalue()))
+    storage.delete(stara_nazwa)
+    return obraz
+
+
+def przetworz_obraz_tla(tlo_id, poprzednia_nazwa=None):
+    """
+    Zadanie w tle po wgraniu pliku obrazu tła: orientacja i format pliku, wymiary,
+    miniatura i kafelki. Postęp jest widoczny w polu ObrazTla.status.
+    """
+    from .models import ObrazTla
+
+    obraz_tla = ObrazTla.objects.filter(id=tlo_id).first()
+    if obraz_tla is None or not obraz_tla.obraz:
+        return
+    if poprzednia_nazwa:
+        # Podglądy poprzedniego pliku nie będą już potrzebne
+        _usun_katalog(obraz_tla.obraz.storage, f'{posixpath.splitext(poprzednia_nazwa)[0]}_pliki')
+
+    ObrazTla.objects.filter(id=tlo_id).update(status=ObrazTla.PRZETWARZANIE)
+    try:
+        with obraz_tla.obraz.open('rb') as plik, otworz_obraz(plik) as oryginal:
+            obraz = _normalizuj(obraz_tla, oryginal)
+        generuj_podglady(obraz_tla, obraz)
+    except (OSError, Image.DecompressionBombError) as e:
+        logger.warning('Nie można przetworzyć obrazu tła %s: %s', obraz_tla.obraz.name, e)
+        ObrazTla.objects.filter(id=tlo_id).update(status=ObrazTla.BLAD)
+        return
+    except Exception:
+        # Kolejka nie ponawia zadań - obraz nie może zostać w stanie PRZETWARZANIE
+        ObrazTla.objects.filter(id=tlo_id).update(status=ObrazTla.BLAD)
+        raise
+
+    szerokosc, wysokosc = obraz.size
+    ObrazTla.objects.filter(id=tlo_id).update(
+        obraz=obraz_tla.obraz.name, szerokosc=szerokosc, wysokosc=wysokosc,
+        miniatura=obraz_tla.miniatura.name, status=ObrazTla.GOTOWY,
+    )
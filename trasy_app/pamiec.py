@@ -0,0 +1,136 @@
+"""
+Pamięć podręczna gotowych odpowiedzi z trasami i punktami (lista punktów, szczegóły trasy,
+trasy uproszczone).
+
+Klucz wpisu zawiera znacznik ETag odpowiedzi (warunkowe.znacznik), a ten - rewizję i datę
+modyfikacji trasy, a dla odpowiedzi ze szczegółami tła także pola obrazu tła. Każda zmiana
+trasy, jej punktów lub pokazanego tła zmienia więc klucz i wpis z pamięci nigdy nie jest
+nieaktualny. Sygnały zmian (zapis i usunięcie trasy, nowa rewizja punktów -
+rewizje.rewizja_trasy, zapis obrazu tła) usuwają od razu wpisy tras, żeby nie zajmowały
+miejsca do wygaśnięcia.
+
+Backend to alias z CACHES wskazany w TRASY_PAMIEC_ODPOWIEDZI - pamięć procesu, pliki
+albo Redis. Liczniki trafień i chybień są w tym samym backendzie, wspólne dla procesów.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+from rest_framework.response import Response
+
+from .models import ObrazTla, Trasa
+from .rewizje import rewizja_trasy
+
+# Czas przechowywania odpowiedzi (sekundy)
+CZAS_PAMIECI_ODPOWIEDZI = 60 * 60
+# Liczba zapamiętanych kluczy odpowiedzi trasy usuwanych przy jej zmianie
+MAKS_WARIANTOW = 32
+KLUCZ_TRAFIEN = 'trasy:odpowiedzi:trafienia'
+KLUCZ_CHYBIEN = 'trasy:odpowiedzi:chybienia'
+
+
+def pamiec_odpowiedzi():
+    return caches[getattr(settings, 'TRASY_PAMIEC_ODPOWIEDZI', 'default')]
+
+
+def _klucz_wariantow(trasa_id):
+    return f'trasy:odpowiedzi:{trasa_id}'
+
+
+def _zlicz(pamiec, klucz):
+    try:
+        pamiec.incr(klucz)
+    except ValueError:
+        # Pierwsze zliczenie - licznik nie wygasa
+        pamiec.add(klucz, 0, None)
+        pamiec.incr(klucz)
+
+
+def _wpis(response):
+    # Odpowiedź DRF jest zapisywana przed renderowaniem - format wybiera znacznik (nagłówek Accept)
+    naglowki = [(nazwa, wartosc) for nazwa, wartosc in response.items()
+                if not isinstance(response, Response) or nazwa != 'Content-Type']
+    if isinstance(response, Response):
+        return 'dane', response.data, response.status_code, naglowki
+    return 'tresc', response.content, response.status_code, naglowki
+
+
+def _odpowiedz(wpis):
+    rodzaj, dane, status, naglowki = wpis
+    response = Response(dane, status=status) if rodzaj == 'dane' else HttpResponse(dane, status=status)
+    for nazwa, wartosc in naglowki:
+        response[nazwa] = wartosc
+    return response
+
+
+def zapamietana_odpowiedz(trasa_id, etag, widok):
+    """
+    Odpowiedź dla znacznika etag z pamięci podręcznej albo wynik widok() zapamiętany na później
+    (tylko odpowiedzi 200)
+    """
+    pamiec = pamiec_odpowiedzi()
+    klucz = '{}:{}'.format(_klucz_wariantow(trasa_id), etag.strip('"'))
+    wpis = pamiec.get(klucz)
+    if wpis is not None:
+        _zlicz(pamiec, KLUCZ_TRAFIEN)
+        return _odpowiedz(wpis)
+
+    _zlicz(pamiec, KLUCZ_CHYBIEN)
+    response = widok()
+    if response.status_code == 200 and not response.streaming:
+        pamiec.set(klucz, _wpis(response), CZAS_PAMIECI_ODPOWIEDZI)
+        warianty = pamiec.get(_klucz_wariantow(trasa_id), [])
+        if klucz not in warianty:
+            warianty = [*warianty, klucz][-MAKS_WARIANTOW:]
+            pamiec.set(_klucz_wariantow(trasa_id), warianty, CZAS_PAMIECI_ODPOWIEDZI)
+    return response
+
+
+def uniewaznij_trase(trasa_id):
+    """
+    Usuwa zapamiętane odpowiedzi trasy
+    """
+    pamiec = pamiec_odpowiedzi()
+    klucz = _klucz_wariantow(trasa_id)
+    pamiec.delete_many([*pamiec.get(klucz, []), klucz])
+
+
+def statystyki():
+    """
+    Liczniki trafień i chybień pamięci odpowiedzi
+    """
+    pamiec = pamiec_odpowiedzi()
+    liczniki = pamiec.get_many([KLUCZ_TRAFIEN, KLUCZ_CHYBIEN])
+    trafienia, chybienia = liczniki.get(KLUCZ_TRAFIEN, 0), liczniki.get(KLUCZ_CHYBIEN, 0)
+    wszystkie = trafienia + chybienia
+    return {
+        'trafienia': trafienia,
+        'chybienia': chybienia,
+        'skutecznosc': trafienia / wszystkie if wszystkie else None,
+    }
+
+
+def wyzeruj_statystyki():
+    pamiec_odpowiedzi().delete_many([KLUCZ_TRAFIEN, KLUCZ_CHYBIEN])
+
+
+# Punkty nie mają własnych odbiorników post_save/post_delete: każda ich zmiana (także
+# zbiorcza) kończy się nową rewizją trasy, a odbiornik post_delete punktów wyłączyłby
+# szybkie kaskadowe usuwanie punktów razem z trasą
+@receiver(rewizja_trasy)
+def _nowa_rewizja(sender, trasa_id, **kwargs):
+    uniewaznij_trase(trasa_id)
+
+
+@receiver([post_save, post_delete], sender=Trasa)
+def _zmiana_trasy(sender, instance, **kwargs):
+    uniewaznij_trase(instance.id)
+
+
+# Status przetwarzania obrazu zmienia się zapytaniem zbiorczym, bez sygnału - te wpisy
+# przestają pasować do znacznika i wygasają same
+@receiver(post_save, sender=ObrazTla)
+def _zmiana_tla(sender, instance, **kwargs):
+    for trasa_id in Trasa.objects.filter(obraz_tla=instance).values_list('id', flat=True):
+        uniewaznij_trase(trasa_id)
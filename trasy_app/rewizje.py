@@ -0,0 +1,144 @@
+"""
+Rewizje tras i dziennik zmian punktów.
+
+Każda zmiana punktów trasy podbija licznik Trasa.rewizja i zapisuje wpisy ZmianaTrasy,
+dzięki czemu klient znający rewizję N może pobrać tylko to, co zmieniło się od tamtej pory.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import F
+from django.dispatch import Signal
+from django.utils import timezone
+
+# Liczba ostatnich rewizji, dla których trzymamy dziennik zmian.
+# Klient ze starszą rewizją dostaje pełną listę punktów.
+HISTORIA_REWIZJI = 500
+
+_stan = threading.local()
+
+# Wysyłany po każdej nowej rewizji trasy (argumenty trasa_id i rewizja) - także dla zmian
+# zbiorczych, które omijają sygnały zapisu modeli (bulk_create, update)
+rewizja_trasy = Signal()
+
+
+@contextmanager
+def grupuj_zmiany():
+    """
+    Zmiany zgłoszone wewnątrz bloku trafiają do jednej transakcji i jednej rewizji na trasę
+    """
+    if getattr(_stan, 'zmiany', None) is not None:
+        # Zagnieżdżone grupowanie - zmiany trafią do zewnętrznego bloku
+        yield
+        return
+
+    _stan.zmiany = defaultdict(list)
+    try:
+        with transaction.atomic():
+            yield
+            zmiany, _stan.zmiany = _stan.zmiany, None
+            for trasa_id, lista in zmiany.items():
+                zapisz_rewizje(trasa_id, lista)
+    finally:
+        _stan.zmiany = None
+
+
+def zglos_zmiany(trasa_id, zmiany):
+    """
+    Zgłasza listę zmian punktów trasy - słowników z kluczami operacja, id_punktu, x, y, kolejnosc
+    """
+    if not zmiany:
+        return
+    oczekujace = getattr(_stan, 'zmiany', None)
+    if oczekujace is not None:
+        oczekujace[trasa_id].extend(zmiany)
+    else:
+        with transaction.atomic():
+            zapisz_rewizje(trasa_id, zmiany)
+
+
+def grupowanie_aktywne():
+    """
+    Czy trwa blok grupuj_zmiany - rewizję podbije wtedy dopiero jego koniec
+    """
+    return getattr(_stan, 'zmiany', None) is not None
+
+
+def podbicie_rewizji():
+    """
+    Pola UPDATE trasy zapisujące nową rewizję - dla zmian, które i tak aktualizują wiersz
+    trasy. Nową rewizję trzeba potem przekazać do zapisz_dziennik.
+    """
+    # Zmiana punktów to też zmiana trasy - data modyfikacji trafia do ETag/Last-Modified (warunkowe.py)
+    return {'rewizja': F('rewizja') + 1, 'data_modyfikacji': timezone.now()}
+
+
+def zmiana_punktu(operacja, punkt):
+    return {
+        'operacja': operacja,
+        'id_punktu': punkt.id,
+        'x': punkt.x,
+        'y': punkt.y,
+        'kolejnosc': punkt.kolejnosc,
+    }
+
+
+def zapisz_rewizje(trasa_id, zmiany):
+    """
+    Podbija rewizję trasy i zapisuje dziennik zmian. Zwraca nową rewizję.
+    """
+    from .models import Trasa
+
+    # UPDATE blokuje wiersz trasy do końca transakcji, więc rewizje nie mogą się zdublować
+    if not Trasa.objects.filter(id=trasa_id).update(**podbicie_rewizji()):
+        return None
+    rewizja = Trasa.objects.filter(id=trasa_id).values_list('rewizja', flat=True).get()
+    zapisz_dziennik(trasa_id, rewizja, zmiany)
+    return rewizja
+
+
+def zapisz_dziennik(trasa_id, rewizja, zmiany):
+    """
+    Zapisuje dziennik zmian nowej rewizji trasy (podbitej już w wierszu trasy) i ją ogłasza
+    """
+    from .models import Trasa, ZmianaTrasy
+
+    ZmianaTrasy.objects.bulk_create([ZmianaTrasy(trasa_id=trasa_id, rewizja=rewizja, **z) for z in zmiany])
+    if rewizja % 100 == 0:
+        ZmianaTrasy.objects.filter(trasa_id=trasa_id, rewizja__lte=rewizja - HISTORIA_REWIZJI).delete()
+    rewizja_trasy.send(sender=Trasa, trasa_id=trasa_id, rewizja=rewizja)
+
+
+def zmiany_od(trasa_id, od_rewizji):
+    """
+    Zwraca (rewizja, zmiany) - zmiany punktów trasy od podanej rewizji, po jednej na punkt.
+    Jeśli dziennik nie pozwala odtworzyć zmian (za stara rewizja, przebudowa trasy),
+    zmiany są równe None i klient powinien pobrać pełną listę punktów.
+    """
+    from .models import Trasa, ZmianaTrasy
+
+    rewizja = Trasa.objects.filter(id=trasa_id).values_list('rewizja', flat=True).get()
+    if od_rewizji > rewizja or od_rewizji < rewizja - HISTORIA_REWIZJI:
+        return rewizja, None
+
+    wpisy = ZmianaTrasy.objects.filter(
+        trasa_id=trasa_id, rewizja__gt=od_rewizji
+    ).order_by('rewizja', 'id').values('operacja', 'id_punktu', 'x', 'y', 'kolejnosc')
+
+    ostatnie = {}
+    for wpis in wpisy:
+        if wpis['operacja'] == ZmianaTrasy.PRZEBUDOWA:
+            return rewizja, None
+        # Słownik zachowuje kolejność wstawiania - przenosimy punkt na koniec
+        ostatnie.pop(wpis['id_punktu'], None)
+        ostatnie[wpis['id_punktu']] = wpis
+
+    zmiany = []
+    for wpis in ostatnie.values():
+        zmiana = {'operacja': wpis['operacja'], 'id': wpis['id_punktu']}
+        if wpis['operacja'] != ZmianaTrasy.USUNIECIE:
+            zmiana.update(x=wpis['x'], y=wpis['y'], kolejnosc=wpis['kolejnosc'])
+        zmiany.append(zmiana)
+    return rewizja, zmiany
@@ -1,7 +1,51 @@
 from rest_framework import serializers
-from .models import ObrazTla, Trasa, PunktTrasy
+from .models import ObrazTla, Trasa, PunktTrasy, ImportTras
+from .eksport import przeksztalcenie_odwrotne
+from .importowanie import format_pliku, postep_importu
+from .kodowanie import KOLUMNY
+from .magazyn import rozpakuj_geometrie
 from django.contrib.auth.models import User
 
+def parametr_listy(request, nazwa):
+    """
+    Zbiór wartości parametru zapytania podanego jako lista rozdzielona przecinkami
+    """
+    wartosc = request.query_params.get(nazwa, '') if request is not None else ''
+    return {pole.strip() for pole in wartosc.split(',') if pole.strip()}
+
+class PolaDynamiczneMixin:
+    """
+    Wybór pól przez parametry zapytania: ?fields=id,nazwa zwraca tylko wymienione pola,
+    a pola z `pola_rozwijane` pojawiają się dopiero po podaniu ich w ?expand=
+    """
+    pola_rozwijane = ()
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        wybrane = parametr_listy(request, 'fields')
+        rozwiniete = parametr_listy(request, 'expand')
+        
+        for nazwa in list(self.fields):
+            if nazwa in rozwiniete:
+                continue
+            if nazwa in self.pola_rozwijane or (wybrane and nazwa not in wybrane):
+                self.fields.pop(nazwa)
+
+class ProstokatOtaczajacyField(serializers.Field):
+    """
+    Prostokąt otaczający trasy jako [min_x, min_y, max_x, max_y] albo None dla trasy bez punktów
+    """
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+    
+    def to_representation(self, trasa):
+        if trasa.min_x is None:
+            return None
+        return [trasa.min_x, trasa.min_y, trasa.max_x, trasa.max_y]
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -10,26 +54,160 @@ class UserSerializer(serializers.ModelSerializer):
 class ObrazTlaSerializer(serializers.ModelSerializer):
     class Meta:
         model = ObrazTla
-        fields = ['id', 'nazwa', 'opis', 'obraz', 'szerokosc', 'wysokosc', 'data_dodania']
-        read_only_fields = ['data_dodania']
+        fields = ['id', 'nazwa', 'opis', 'obraz', 'szerokosc', 'wysokosc', 'data_dodania',
+                  'miniatura', 'status', 'transformacja']
+        read_only_fields = ['szerokosc', 'wysokosc', 'data_dodania', 'miniatura', 'status']
 
 class PunktTrasySerializer(serializers.ModelSerializer):
+    # Opcjonalne miejsce wstawienia nowego punktu (od 1) - domyślnie koniec trasy
+    pozycja = serializers.IntegerField(write_only=True, required=False, min_value=1)
+    
     class Meta:
         model = PunktTrasy
-        fields = ['id', 'x', 'y', 'kolejnosc', 'trasa']
-        read_only_fields = ['trasa']
+        fields = ['id', 'x', 'y', 'kolejnosc', 'trasa', 'pozycja']
+        # Kolejność nadaje serwer - zmienia się ją przez pozycję przy wstawianiu lub move_to
+        read_only_fields = ['trasa', 'kolejnosc']
+
+class PozycjaPunktuSerializer(serializers.Serializer):
+    pozycja = serializers.IntegerField(min_value=1)
+
+class PunktTrasyBulkSerializer(serializers.Serializer):
+    """
+    Masowe dodawanie punktów - lista par [x, y] lub obiektów {"x": ..., "y": ...}
+    """
+    punkty = serializers.ListField(allow_empty=False)
+
+    def validate_punkty(self, value):
+        # Walidacja ręczna zamiast zagnieżdżonych pól DRF - przy dziesiątkach tysięcy punktów
+        # narzut serializerów na każdy element byłby większy niż sam zapis do bazy
+        wspolrzedne = []
+        for i, punkt in enumerate(value):
+            try:
+                if isinstance(punkt, dict):
+                    x, y = punkt['x'], punkt['y']
+                else:
+                    x, y = punkt
+                if isinstance(x, (bool, float)) or isinstance(y, (bool, float)):
+                    raise TypeError
+                wspolrzedne.append((int(x), int(y)))
+            except (KeyError, TypeError, ValueError):
+                raise serializers.ValidationError(f'Niepoprawny punkt na pozycji {i}: oczekiwano pary liczb całkowitych x, y.')
+        return wspolrzedne
+
+class OperacjaPunktuSerializer(serializers.Serializer):
+    """
+    Jedna operacja edycji trasy (patrz services.wykonaj_operacje)
+    """
+    # Pola wymagane przez poszczególne operacje
+    WYMAGANE = {
+        'add': ('x', 'y'),
+        'insert': ('x', 'y', 'pozycja'),
+        'delete': ('id',),
+        'move': ('id',),
+        'update': ('id',),
+    }
+    
+    operacja = serializers.ChoiceField(choices=list(WYMAGANE))
+    id = serializers.IntegerField(required=False)
+    x = serializers.IntegerField(required=False)
+    y = serializers.IntegerField(required=False)
+    pozycja = serializers.IntegerField(required=False, min_value=1)
+    kierunek = serializers.ChoiceField(choices=['up', 'down'], required=False)
+    
+    def validate(self, attrs):
+        brakujace = [pole for pole in self.WYMAGANE[attrs['operacja']] if pole not in attrs]
+        if brakujace:
+            raise serializers.ValidationError({pole: ['To pole jest wymagane.'] for pole in brakujace})
+        if attrs['operacja'] == 'move' and ('pozycja' in attrs) == ('kierunek' in attrs):
+            raise serializers.ValidationError('Przesunięcie wymaga pola pozycja albo kierunek.')
+        if attrs['operacja'] == 'update' and 'x' not in attrs and 'y' not in attrs:
+            raise serializers.ValidationError('Zmiana punktu wymaga pola x lub y.')
+        return attrs
+
+class OperacjeTrasySerializer(serializers.Serializer):
+    """
+    Uporządkowana lista operacji wykonywanych razem w jednej transakcji
+    """
+    operacje = OperacjaPunktuSerializer(many=True, allow_empty=False, max_length=1000)
 
-class TrasaSerializer(serializers.ModelSerializer):
-    punkty = PunktTrasySerializer(many=True, read_only=True)
+class PunktyTrasyField(serializers.Field):
+    """
+    Punkty trasy w kolejności - z wierszy PunktTrasy albo ze spakowanej geometrii (magazyn.py)
+    """
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+    
+    def to_representation(self, trasa):
+        geometria = getattr(trasa, 'geometria', None)
+        if geometria is not None:
+            return [dict(zip(KOLUMNY, wiersz), trasa=trasa.id) for wiersz in rozpakuj_geometrie(geometria.dane).tolist()]
+        return PunktTrasySerializer(trasa.punkty.all(), many=True).data
+
+class TrasaSerializer(PolaDynamiczneMixin, serializers.ModelSerializer):
+    punkty = PunktyTrasyField()
     obraz_tla_details = ObrazTlaSerializer(source='obraz_tla', read_only=True)
+    bbox = ProstokatOtaczajacyField()
     
     class Meta:
         model = Trasa
         fields = ['id', 'nazwa', 'opis', 'uzytkownik', 'obraz_tla', 'obraz_tla_details', 
-                  'data_utworzenia', 'data_modyfikacji', 'punkty']
-        read_only_fields = ['uzytkownik', 'data_utworzenia', 'data_modyfikacji']
+                  'data_utworzenia', 'data_modyfikacji', 'rewizja',
+                  'liczba_punktow', 'dlugosc', 'bbox', 'punkty']
+        read_only_fields = ['uzytkownik', 'data_utworzenia', 'data_modyfikacji', 'rewizja',
+                            'liczba_punktow', 'dlugosc']
 
     def create(self, validated_data):
         # Przypisanie zalogowanego użytkownika jako właściciela trasy
         validated_data['uzytkownik'] = self.context['request'].user
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+class TrasaPodsumowanieSerializer(PolaDynamiczneMixin, serializers.ModelSerializer):
+    """
+    Lekka reprezentacja trasy dla list - statystyki zamiast punktów.
+    Punkty i szczegóły tła można dołączyć przez ?expand=punkty,obraz_tla_details
+    """
+    bbox = ProstokatOtaczajacyField()
+    punkty = PunktyTrasyField()
+    obraz_tla_details = ObrazTlaSerializer(source='obraz_tla', read_only=True)
+    
+    pola_rozwijane = ('punkty', 'obraz_tla_details')
+    
+    class Meta:
+        model = Trasa
+        fields = ['id', 'nazwa', 'opis', 'uzytkownik', 'obraz_tla', 'obraz_tla_details',
+                  'data_utworzenia', 'data_modyfikacji', 'rewizja',
+                  'liczba_punktow', 'bbox', 'dlugosc', 'punkty']
+        read_only_fields = fields
+
+class ImportTrasSerializer(serializers.ModelSerializer):
+    # Format jest domyślnie rozpoznawany po rozszerzeniu pliku
+    format = serializers.ChoiceField(choices=ImportTras.FORMATY, required=False)
+    postep = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ImportTras
+        fields = ['id', 'plik', 'obraz_tla', 'format', 'wspolrzedne_geograficzne', 'status',
+                  'liczba_tras', 'liczba_punktow', 'blad', 'postep', 'data_utworzenia']
+        extra_kwargs = {'plik': {'write_only': True, 'required': True, 'allow_empty_file': False}}
+    
+    def get_postep(self, zlecenie):
+        # Postęp trwającego importu - po zakończeniu liczby są w liczba_tras i liczba_punktow
+        if zlecenie.status != ImportTras.W_TOKU:
+            return None
+        return postep_importu(zlecenie.id)
+    
+    def validate(self, data):
+        if not data.get('format'):
+            data['format'] = format_pliku(data['plik'].name)
+            if data['format'] is None:
+                raise serializers.ValidationError({'format': 'Nie rozpoznano formatu pliku - podaj gpx, geojson lub csv.'})
+        swiat = data.get('wspolrzedne_geograficzne')
+        if swiat is None:
+            swiat = data['format'] == 'gpx'
+        if swiat and przeksztalcenie_odwrotne(data['obraz_tla'].transformacja) is None:
+            raise serializers.ValidationError(
+                {'obraz_tla': 'Obraz tła nie ma przekształcenia ze współrzędnych geograficznych na piksele.'}
+            )
+        return data
@@ -0,0 +1,321 @@
+from itertools import chain
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from .models import Trasa, PunktTrasy, ZmianaTrasy
+from .rewizje import grupowanie_aktywne, grupuj_zmiany, podbicie_rewizji, zapisz_dziennik, zglos_zmiany, zmiana_punktu
+from .metryki import metryki_dopisania, punkty_dopisane, wklad_punktu
+from .siatka import komorka
+from .kodowanie import KOLUMNY
+from .magazyn import geometria_trasy, rozpakuj_trase
+
+# Liczba wierszy wysyłanych w jednym INSERT przy masowym dodawaniu punktów
+ROZMIAR_PACZKI = 2000
+
+# Odstęp między kluczami kolejności dopisywanych punktów. Przesunięcie i wstawienie punktu
+# wybiera klucz w połowie drogi między sąsiadami, więc w jedno miejsce zmieści się
+# około log2(KROK_KOLEJNOSCI) kolejnych wstawień, zanim trzeba będzie rozrzedzić okolicę.
+KROK_KOLEJNOSCI = 1024
+# Liczba punktów po każdej stronie kolizji przenumerowywanych w pierwszej kolejności
+# (patrz rozrzedz_kolejnosc) - przy zbyt gęstych kluczach okno rośnie dwukrotnie
+POLOWA_OKNA = 8
+
+
+def zarezerwuj_kolejnosc(trasa_id, liczba=1):
+    """
+    Rezerwuje `liczba` kluczy kolejności na końcu trasy, co KROK_KOLEJNOSCI, i zwraca pierwszy z nich.
+
+    Rezerwacja to jedno zapytanie UPDATE na liczniku Trasa.ostatnia_kolejnosc, które
+    jednocześnie blokuje wiersz trasy, więc równoległe dopisywanie nie nada dwóm
+    punktom tej samej kolejności. Licznik jest porównywany z faktycznym maksimum
+    kolejności punktów (odczyt z indeksu), dlatego pozostaje poprawny także po
+    przesunięciu punktu na koniec trasy czy dodaniu punktu z pominięciem tej funkcji.
+    """
+    Trasa.objects.filter(id=trasa_id).update(ostatnia_kolejnosc=_nowy_licznik(liczba))
+    ostatnia = Trasa.objects.filter(id=trasa_id).values_list('ostatnia_kolejnosc', flat=True).get()
+    return ostatnia - (liczba - 1) * KROK_KOLEJNOSCI
+
+
+def _ostatnie_punkty():
+    # Punkty trasy aktualizowanej przez UPDATE, od ostatniego - odczyt z indeksu (trasa, kolejnosc)
+    return PunktTrasy.objects.filter(trasa_id=OuterRef('pk')).order_by('-kolejnosc')
+
+
+def _nowy_licznik(liczba):
+    najwieksza = _ostatnie_punkty().values('kolejnosc')[:1]
+    return Greatest(F('ostatnia_kolejnosc'), Coalesce(Subquery(najwieksza), 0)) + liczba * KROK_KOLEJNOSCI
+
+
+def dodaj_punkt(punkt):
+    """
+    Zapisuje nowy punkt (z ustawioną trasą) na końcu trasy.
+
+    Licznik kolejności, metryki i rewizja trasy zmieniają się jednym UPDATE wiersza trasy
+    (jak w zarezerwuj_kolejnosc blokuje on trasę przed równoległym dopisywaniem), a punkt
+    jest zapisywany z pominięciem PunktTrasy.save. Wewnątrz grupuj_zmiany rewizję podbija
+    dopiero koniec bloku.
+    """
+    zgrupowane = grupowanie_aktywne()
+    xy = (int(punkt.x), int(punkt.y))
+    with transaction.atomic():
+        # UPDATE jako pierwszy blokuje trasę - odczyt przed nim (np. sprawdzenie blobu)
+        # kończyłby się w SQLite błędem "database is locked" przy równoległym dopisywaniu
+        zmiany = {'ostatnia_kolejnosc': _nowy_licznik(1), **metryki_dopisania(_ostatnie_punkty(), xy)}
+        if not zgrupowane:
+            zmiany.update(podbicie_rewizji())
+        Trasa.objects.filter(id=punkt.trasa_id).update(**zmiany)
+        punkt.kolejnosc, rewizja = (
+            Trasa.objects.filter(id=punkt.trasa_id).values_list('ostatnia_kolejnosc', 'rewizja').get()
+        )
+        if rozpakuj_trase(punkt.trasa_id):
+            # Spakowana trasa nie miała wierszy (magazyn.py), więc UPDATE pominął odcinek od ostatniego punktu
+            Trasa.objects.filter(id=punkt.trasa_id).update(
+                dlugosc=F('dlugosc') + wklad_punktu(punkt.trasa_id, xy, punkt.kolejnosc)
+            )
+        punkt.x, punkt.y = xy
+        punkt.komorka = komorka(*xy)
+        PunktTrasy.objects.bulk_create([punkt])
+
+        zmiana = zmiana_punktu(ZmianaTrasy.DODANIE, punkt)
+        if zgrupowane:
+            zglos_zmiany(punkt.trasa_id, [zmiana])
+        else:
+            zapisz_dziennik(punkt.trasa_id, rewizja, [zmiana])
+    return punkt
+
+
+def dodaj_punkty(trasa, wspolrzedne):
+    """
+    Dopisuje na koniec trasy listę punktów (x, y) w jednej transakcji.
+    Punkty dostają klucze kolejności co KROK_KOLEJNOSCI i są zapisywane paczkami (bulk_create).
+    Zwraca krotkę (pierwsza_kolejnosc, ostatnia_kolejnosc) lub None dla pustej listy.
+    """
+    if not wspolrzedne:
+        return None
+
+    with grupuj_zmiany():
+        pierwsza = zarezerwuj_kolejnosc(trasa.id, len(wspolrzedne))
+        rozpakuj_trase(trasa.id)
+        poprzedni = (
+            PunktTrasy.objects.filter(trasa_id=trasa.id, kolejnosc__lt=pierwsza)
+            .order_by('-kolejnosc').values_list('x', 'y').first()
+        )
+        punkty = [
+            PunktTrasy(trasa=trasa, x=x, y=y, kolejnosc=pierwsza + i * KROK_KOLEJNOSCI, komorka=komorka(x, y))
+            for i, (x, y) in enumerate(wspolrzedne)
+        ]
+        PunktTrasy.objects.bulk_create(punkty, batch_size=ROZMIAR_PACZKI)
+        punkty_dopisane(trasa.id, wspolrzedne, poprzedni)
+        # Pojedyncze wpisy dla tysięcy punktów kosztowałyby tyle co sam import -
+        # klienci po prostu pobiorą trasę od nowa
+        zglos_zmiany(trasa.id, [{'operacja': ZmianaTrasy.PRZEBUDOWA}])
+
+    return pierwsza, pierwsza + (len(punkty) - 1) * KROK_KOLEJNOSCI
+
+
+def usun_punkt(punkt):
+    """
+    Usuwa punkt z trasy. Kolejność pozostałych punktów zostaje bez zmian -
+    liczy się tylko porządek kluczy, a nie ich ciągłość.
+    """
+    punkt.delete()
+
+
+def _klucz_miedzy(poprzedni, nastepny):
+    """
+    Wolny klucz kolejności między dwoma sąsiednimi kluczami (None - brak sąsiada).
+    Zwraca None, jeśli między sąsiadami nie ma już miejsca.
+    """
+    if poprzedni is None and nastepny is None:
+        return KROK_KOLEJNOSCI
+    if poprzedni is None:
+        return nastepny - KROK_KOLEJNOSCI
+    if nastepny is None:
+        return poprzedni + KROK_KOLEJNOSCI
+    if nastepny - poprzedni > 1:
+        return (poprzedni + nastepny) // 2
+    return None
+
+
+def _wolna_kolejnosc(trasa_id, poprzedni, nastepny):
+    """
+    Klucz kolejności dla punktu wstawianego między sąsiadów - pary (id, kolejnosc) lub None.
+    Gdy między sąsiadami zabrakło miejsca, najpierw rozrzedza kolejność w ich okolicy.
+    """
+    klucz = _klucz_miedzy(poprzedni and poprzedni[1], nastepny and nastepny[1])
+    if klucz is None:
+        rozrzedz_kolejnosc(trasa_id, poprzedni[1], nastepny[1])
+        nowe = dict(PunktTrasy.objects.filter(id__in=[poprzedni[0], nastepny[0]]).values_list('id', 'kolejnosc'))
+        klucz = _klucz_miedzy(nowe[poprzedni[0]], nowe[nastepny[0]])
+    return klucz
+
+
+def _sasiedzi_pozycji(trasa_id, pozycja, bez_punktu=None):
+    """
+    Sąsiedzi (poprzedni, nastepny) miejsca o numerze pozycja (od 1) w trasie,
+    jako pary (id, kolejnosc) lub None na końcach trasy
+    """
+    punkty = PunktTrasy.objects.filter(trasa_id=trasa_id).order_by('kolejnosc').values_list('id', 'kolejnosc')
+    if bez_punktu is not None:
+        punkty = punkty.exclude(id=bez_punktu.id)
+    if pozycja <= 1:
+        return None, punkty.first()
+    
+    para = list(punkty[pozycja - 2:pozycja])
+    if not para:
+        # Pozycja za końcem trasy - wstawiamy na koniec
+        return punkty.last(), None
+    return para[0], para[1] if len(para) > 1 else None
+
+
+def _klucze_okna(liczba, dolna, gorna, polowa):
+    """
+    Nowe klucze dla `liczba` punktów okna między kluczami dolna i gorna (None - koniec trasy)
+    albo None, jeśli są tam zbyt gęsto. Im większe okno, tym gęstsze klucze wystarczą.
+    """
+    if dolna is None and gorna is None:
+        return [i * KROK_KOLEJNOSCI for i in range(1, liczba + 1)]
+    if gorna is None:
+        return [dolna + i * KROK_KOLEJNOSCI for i in range(1, liczba + 1)]
+    if dolna is None:
+        return [gorna - i * KROK_KOLEJNOSCI for i in range(liczba, 0, -1)]
+    krok = (gorna - dolna) // (liczba + 1)
+    if krok < max(2, KROK_KOLEJNOSCI // polowa):
+        return None
+    return [dolna + i * krok for i in range(1, liczba + 1)]
+
+
+def rozrzedz_kolejnosc(trasa_id, poprzednia, nastepna):
+    """
+    Rozsuwa klucze kolejności wokół dwóch sąsiednich kluczy bez miejsca między nimi,
+    zachowując porządek punktów. Przenumerowane jest tylko okno punktów wokół kolizji -
+    najmniejsze, w którym po rozsunięciu zostaną odstępy (patrz _klucze_okna).
+    """
+    punkty = PunktTrasy.objects.filter(trasa_id=trasa_id).values_list('id', 'x', 'y', 'kolejnosc')
+    polowa = POLOWA_OKNA
+    while True:
+        # Punkt tuż za oknem z każdej strony wyznacza granicę nowych kluczy
+        przed = list(punkty.filter(kolejnosc__lte=poprzednia).order_by('-kolejnosc')[:polowa + 1])
+        po = list(punkty.filter(kolejnosc__gte=nastepna).order_by('kolejnosc')[:polowa + 1])
+        dolna = przed.pop()[3] if len(przed) > polowa else None
+        gorna = po.pop()[3] if len(po) > polowa else None
+        okno = przed[::-1] + po
+        klucze = _klucze_okna(len(okno), dolna, gorna, polowa)
+        if klucze is not None:
+            break
+        polowa *= 2
+
+    with grupuj_zmiany():
+        # Najpierw przesuwamy okno ponad wszystkie stare i nowe klucze trasy, żeby po drodze
+        # żadne dwa punkty nie miały tej samej kolejności
+        najwieksza = punkty.aggregate(najwieksza=Max('kolejnosc'))['najwieksza']
+        przesuniecie = najwieksza + (len(okno) + 1) * KROK_KOLEJNOSCI - okno[0][3]
+        PunktTrasy.objects.filter(id__in=[p[0] for p in okno]).update(kolejnosc=F('kolejnosc') + przesuniecie)
+        nowe = [PunktTrasy(id=id_punktu, x=x, y=y, kolejnosc=klucz) for (id_punktu, x, y, _), klucz in zip(okno, klucze)]
+        PunktTrasy.objects.bulk_update(nowe, ['kolejnosc'], batch_size=ROZMIAR_PACZKI)
+        # Klienci dostają zwykłe zmiany punktów okna zamiast przebudowy całej trasy
+        zglos_zmiany(trasa_id, [zmiana_punktu(ZmianaTrasy.ZMIANA, punkt) for punkt in nowe])
+
+
+def wstaw_punkt(trasa, x, y, pozycja):
+    """
+    Wstawia nowy punkt na podaną pozycję trasy (od 1), zapisując tylko jeden wiersz
+    """
+    with grupuj_zmiany():
+        Trasa.objects.select_for_update().filter(id=trasa.id).first()
+        rozpakuj_trase(trasa.id)
+        poprzedni, nastepny = _sasiedzi_pozycji(trasa.id, pozycja)
+        kolejnosc = _wolna_kolejnosc(trasa.id, poprzedni, nastepny)
+        return PunktTrasy.objects.create(trasa=trasa, x=x, y=y, kolejnosc=kolejnosc)
+
+
+def przesun_na_pozycje(punkt, pozycja):
+    """
+    Przenosi punkt na podaną pozycję trasy (od 1), zmieniając tylko jego klucz kolejności
+    """
+    with grupuj_zmiany():
+        Trasa.objects.select_for_update().filter(id=punkt.trasa_id).first()
+        poprzedni, nastepny = _sasiedzi_pozycji(punkt.trasa_id, pozycja, bez_punktu=punkt)
+        _przenies(punkt, poprzedni, nastepny)
+
+
+def zamien_z_sasiadem(punkt, kierunek):
+    """
+    Przesuwa punkt o jedno miejsce ('up' - w stronę początku, 'down' - w stronę końca trasy).
+    Zwraca False, jeśli punkt nie ma sąsiada w danym kierunku.
+    """
+    with grupuj_zmiany():
+        Trasa.objects.select_for_update().filter(id=punkt.trasa_id).first()
+        punkty = PunktTrasy.objects.filter(trasa_id=punkt.trasa_id).values_list('id', 'kolejnosc')
+        if kierunek == 'up':
+            # Nowe miejsce jest między dwoma punktami poprzedzającymi
+            sasiedzi = list(punkty.filter(kolejnosc__lt=punkt.kolejnosc).order_by('-kolejnosc')[:2])
+            if not sasiedzi:
+                return False
+            poprzedni, nastepny = sasiedzi[1] if len(sasiedzi) > 1 else None, sasiedzi[0]
+        else:
+            sasiedzi = list(punkty.filter(kolejnosc__gt=punkt.kolejnosc).order_by('kolejnosc')[:2])
+            if not sasiedzi:
+                return False
+            poprzedni, nastepny = sasiedzi[0], sasiedzi[1] if len(sasiedzi) > 1 else None
+        _przenies(punkt, poprzedni, nastepny)
+    return True
+
+
+def _przenies(punkt, poprzedni, nastepny):
+    # Zapisujemy zawsze - po rozrzedzeniu trasy klucz w pamięci mógł być już nieaktualny
+    punkt.kolejnosc = _wolna_kolejnosc(punkt.trasa_id, poprzedni, nastepny)
+    punkt.save(update_fields=['kolejnosc'])
+
+
+def wykonaj_operacje(trasa, operacje):
+    """
+    Wykonuje po kolei operacje edycji trasy - słowniki z kluczem operacja (add, insert,
+    delete, move, update) i jej polami - w jednej transakcji i jednej rewizji.
+    Zwraca identyfikatory punktów, których dotyczyły kolejne operacje. Operacja na punkcie
+    spoza trasy zgłasza ValueError i wycofuje wszystkie zmiany.
+    """
+    punkty = []
+    with grupuj_zmiany():
+        Trasa.objects.select_for_update().filter(id=trasa.id).first()
+        rozpakuj_trase(trasa.id)
+        for i, operacja in enumerate(operacje):
+            rodzaj = operacja['operacja']
+            if rodzaj == 'add':
+                punkt = dodaj_punkt(PunktTrasy(trasa=trasa, x=operacja['x'], y=operacja['y']))
+            elif rodzaj == 'insert':
+                punkt = wstaw_punkt(trasa, operacja['x'], operacja['y'], operacja['pozycja'])
+            else:
+                punkt = PunktTrasy.objects.filter(id=operacja['id'], trasa_id=trasa.id).first()
+                if punkt is None:
+                    raise ValueError(f'Operacja {i}: trasa nie ma punktu {operacja["id"]}.')
+                if rodzaj == 'delete':
+                    usun_punkt(punkt)
+                elif rodzaj == 'move' and 'pozycja' in operacja:
+                    przesun_na_pozycje(punkt, operacja['pozycja'])
+                elif rodzaj == 'move':
+                    zamien_z_sasiadem(punkt, operacja['kierunek'])
+                else:
+                    punkt.x = operacja.get('x', punkt.x)
+                    punkt.y = operacja.get('y', punkt.y)
+                    punkt.save(update_fields=['x', 'y'])
+            punkty.append(punkt.id if rodzaj != 'delete' else operacja['id'])
+    return punkty
+
+
+def tablica_punktow(trasa_id, kolumny=('id', 'x', 'y', 'kolejnosc')):
+    """
+    Zwraca punkty trasy jako tablicę NumPy (n, len(kolumny)) w kolejności trasy,
+    bez tworzenia instancji modelu PunktTrasy.
+    """
+    wiersze = PunktTrasy.objects.filter(trasa_id=trasa_id).order_by('kolejnosc').values_list(*kolumny)
+    tablica = np.fromiter(chain.from_iterable(wiersze), dtype=np.int64).reshape(-1, len(kolumny))
+    if len(tablica) == 0:
+        # Trasa bez wierszy może być spakowana (magazyn.py)
+        spakowana = geometria_trasy(trasa_id)
+        if spakowana is not None:
+            return spakowana[:, [KOLUMNY.index(kolumna) for kolumna in kolumny]]
+    return tablica
+
@@ -0,0 +1,181 @@
+"""
+Indeks przestrzenny punktów tras - siatka kwadratowych komórek.
+
+Każdy punkt ma w kolumnie PunktTrasy.komorka numer komórki siatki, w której leży.
+Numer komórki to kolumna siatki pomnożona przez WIERSZE plus wiersz, więc komórki
+jednej kolumny siatki tworzą ciągły zakres numerów. Zapytanie o prostokąt to kilka
+zakresów na indeksie (komorka, trasa) - po jednym na kolumnę siatki - zamiast
+przeglądania wszystkich punktów. Współrzędne są porównywane dopiero w wierszach
+z tych komórek.
+"""
+import numpy as np
+from django.db.models import BigIntegerField, ExpressionWrapper, F, Q
+from django.db.models.functions import Cast
+
+# Bok komórki w pikselach obrazu tła - tyle co kafelek piramidy (patrz obrazy.py)
+ROZMIAR_KOMORKI = 256
+# Przesunięcie numerów kolumn i wierszy, żeby ujemne współrzędne też dawały dodatnie numery
+PRZESUNIECIE = 2 ** 23
+WIERSZE = 2 ** 24
+# Powyżej tej liczby kolumn siatki zapytanie używa jednego zakresu zamiast osobnego na kolumnę
+MAKS_ZAKRESOW = 64
+DOMYSLNY_PROMIEN = 20
+MAKS_PROMIEN = 10_000
+
+
+def _indeks(wspolrzedna):
+    # Dzielenie z zaokrągleniem w dół - także dla współrzędnych ujemnych
+    return int(wspolrzedna) // ROZMIAR_KOMORKI + PRZESUNIECIE
+
+
+def komorka(x, y):
+    """
+    Numer komórki siatki zawierającej punkt (x, y)
+    """
+    return _indeks(x) * WIERSZE + _indeks(y)
+
+
+def warunek_prostokata(x0, y0, x1, y1):
+    """
+    Warunek (Q) na punkty leżące w prostokącie [x0, x1] x [y0, y1], korzystający z indeksu komórek
+    """
+    kolumna0, kolumna1 = _indeks(x0), _indeks(x1)
+    wiersz0, wiersz1 = _indeks(y0), _indeks(y1)
+    if kolumna1 - kolumna0 >= MAKS_ZAKRESOW:
+        # Bardzo szeroki prostokąt - jeden zakres od pierwszej do ostatniej kolumny
+        komorki = Q(komorka__range=(kolumna0 * WIERSZE + wiersz0, kolumna1 * WIERSZE + wiersz1))
+    else:
+        komorki = Q()
+        for kolumna in range(kolumna0, kolumna1 + 1):
+            komorki |= Q(komorka__range=(kolumna * WIERSZE + wiersz0, kolumna * WIERSZE + wiersz1))
+    return komorki & Q(x__range=(x0, x1), y__range=(y0, y1))
+
+
+def w_prostokacie(punkty, prostokat):
+    """
+    Punkty z querysetu leżące w prostokącie (x0, y0, x1, y1)
+    """
+    return punkty.filter(warunek_prostokata(*prostokat))
+
+
+def _prostokat_pobliza(x, y, promien):
+    return x - promien, y - promien, x + promien, y + promien
+
+
+def w_poblizu(punkty, x, y, promien):
+    """
+    Punkty z querysetu odległe od (x, y) najwyżej o promien, od najbliższego.
+    Kwadrat odległości jest dostępny w polu odleglosc2.
+    """
+    # Kwadraty różnic współrzędnych nie mieszczą się w 32 bitach
+    dx = Cast(F('x') - x, BigIntegerField())
+    dy = Cast(F('y') - y, BigIntegerField())
+    odleglosc2 = ExpressionWrapper(dx * dx + dy * dy, output_field=BigIntegerField())
+    return (
+        w_prostokacie(punkty, _prostokat_pobliza(x, y, promien))
+        .annotate(odleglosc2=odleglosc2)
+        .filter(odleglosc2__lte=promien * promien)
+        .order_by('odleglosc2', 'id')
+    )
+
+
+def _liczby(tekst, ile, nazwa, opis):
+    czesci = tekst.split(',')
+    if len(czesci) != ile:
+        raise ValueError(f'Parametr {nazwa} ma postać {opis}.')
+    try:
+        return [int(czesc) for czesc in czesci]
+    except ValueError:
+        raise ValueError(f'Parametr {nazwa} ma postać {opis} (liczby całkowite).')
+
+
+def parametry_obszaru(parametry):
+    """
+    Odczytuje (prostokat, poblize) z parametrów ?bbox=x0,y0,x1,y1 oraz ?near=x,y&radius=r.
+    prostokat to krotka (x0, y0, x1, y1), poblize to (x, y, promien); brakujące to None.
+    Niepoprawne wartości zgłaszają ValueError.
+    """
+    prostokat = poblize = None
+    if parametry.get('bbox') is not None:
+        x0, y0, x1, y1 = _liczby(parametry['bbox'], 4, 'bbox', 'x0,y0,x1,y1')
+        prostokat = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+    promien = parametry.get('radius')
+    if parametry.get('near') is not None:
+        x, y = _liczby(parametry['near'], 2, 'near', 'x,y')
+        if promien is None:
+            promien = DOMYSLNY_PROMIEN
+        elif not promien.isdigit() or int(promien) > MAKS_PROMIEN:
+            raise ValueError(f'Parametr radius musi być liczbą całkowitą od 0 do {MAKS_PROMIEN}.')
+        poblize = (x, y, int(promien))
+    elif promien is not None:
+        raise ValueError('Parametr radius wymaga parametru near.')
+    return prostokat, poblize
+
+
+def uzupelnij_komorki(trasy_ids, rozmiar_paczki=2000):
+    """
+    Liczy od nowa komórki siatki punktów podanych tras
+    """
+    from .models import PunktTrasy
+
+    punkty = PunktTrasy.objects.filter(trasa_id__in=list(trasy_ids)).values_list('id', 'x', 'y')
+    PunktTrasy.objects.bulk_update(
+        [PunktTrasy(id=id_punktu, komorka=komorka(x, y)) for id_punktu, x, y in punkty.iterator()],
+        ['komorka'], batch_size=rozmiar_paczki,
+    )
+
+
+def trasy_przez_obszar(trasy, prostokat=None, poblize=None):
+    """
+    Trasy z querysetu mające punkt w prostokącie (x0, y0, x1, y1) i/lub w pobliżu (x, y, promien)
+    """
+    from .magazyn import geometrie_tras
+    from .models import PunktTrasy
+
+    warunki = []
+    if prostokat is not None:
+        warunki.append((prostokat, w_prostokacie(PunktTrasy.objects.all(), prostokat), _test_prostokata(*prostokat)))
+    if poblize is not None:
+        warunki.append((_prostokat_pobliza(*poblize), w_poblizu(PunktTrasy.objects.all(), *poblize),
+                        _test_pobliza(*poblize)))
+
+    for (x0, y0, x1, y1), punkty, test in warunki:
+        # Prostokąt otaczający trasy (metryki.py) odrzuca od razu trasy leżące gdzie indziej
+        trasy = trasy.filter(min_x__lte=x1, max_x__gte=x0, min_y__lte=y1, max_y__gte=y0)
+        # Trasy spakowane (magazyn.py) nie mają wierszy w indeksie - ich punkty sprawdza NumPy
+        spakowane = [trasa_id for trasa_id, tablica in geometrie_tras(trasy) if test(tablica[:, 1], tablica[:, 2]).any()]
+        trasy = trasy.filter(Q(id__in=punkty.order_by().values('trasa_id')) | Q(id__in=spakowane))
+    return trasy
+
+
+def punkty_spakowane_przez_obszar(trasy, prostokat=None, poblize=None):
+    """
+    Punkty spakowanych tras z querysetu (magazyn.py) leżące w prostokącie i/lub w pobliżu -
+    tablica z kolumnami id, x, y, kolejnosc, trasa_id. Takie punkty nie mają wierszy w indeksie.
+    """
+    from .magazyn import geometrie_tras
+
+    warunki = []
+    if prostokat is not None:
+        warunki.append((prostokat, _test_prostokata(*prostokat)))
+    if poblize is not None:
+        warunki.append((_prostokat_pobliza(*poblize), _test_pobliza(*poblize)))
+    for x0, y0, x1, y1 in (obszar for obszar, _ in warunki):
+        trasy = trasy.filter(min_x__lte=x1, max_x__gte=x0, min_y__lte=y1, max_y__gte=y0)
+
+    czesci = [np.empty((0, 5), dtype=np.int64)]
+    for trasa_id, tablica in geometrie_tras(trasy):
+        maska = np.ones(len(tablica), dtype=bool)
+        for _, test in warunki:
+            maska &= test(tablica[:, 1], tablica[:, 2])
+        czesci.append(np.column_stack([tablica[maska], np.full(maska.sum(), trasa_id, dtype=np.int64)]))
+    return np.concatenate(czesci)
+
+
+def _test_prostokata(x0, y0, x1, y1):
+    return lambda x, y: (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+
+
+def _test_pobliza(x, y, promien):
+    return lambda xs, ys: (xs - x) ** 2 + (ys - y) ** 2 <= promien * promien
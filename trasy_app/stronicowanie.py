@@ -0,0 +1,59 @@
+"""
+Stronicowanie kursorem (keyset) dla list punktów i tras.
+
+Kolejna strona zaczyna się od wartości klucza sortowania ostatniego wiersza poprzedniej
+strony (WHERE kolejnosc > ...), a nie od przesunięcia OFFSET - koszt strony nie zależy od
+jej numeru, a odpowiedź nie wymaga COUNT(*). Kursor jest nieprzezroczysty - klient
+przechodzi po stronach przez adresy next i previous.
+"""
+from rest_framework.pagination import CursorPagination
+
+from .kodowanie import KOLUMNY
+
+
+class WierszePunktow:
+    """
+    Punkty spakowanej trasy (tablica kolumn KOLUMNY w kolejności trasy) z tą częścią
+    interfejsu QuerySet, której używa KursorPunktow - strony czytane z blobu, bez
+    przywracania wierszy PunktTrasy (magazyn.py). Elementy stron to słowniki pól punktu.
+    """
+
+    def __init__(self, tablica, **pola):
+        self.tablica = tablica
+        self.pola = pola
+
+    def order_by(self, *kolejnosc):
+        # Klucz kolejnosc jest unikalny w trasie - id nie rozstrzyga remisów
+        return WierszePunktow(self.tablica[::-1] if kolejnosc[0].startswith('-') else self.tablica, **self.pola)
+
+    def filter(self, **warunek):
+        (pole, wartosc), = warunek.items()
+        kolumna = self.tablica[:, KOLUMNY.index('kolejnosc')]
+        maska = kolumna < int(wartosc) if pole.endswith('__lt') else kolumna > int(wartosc)
+        return WierszePunktow(self.tablica[maska], **self.pola)
+
+    def __getitem__(self, wycinek):
+        return [dict(zip(KOLUMNY, wiersz), **self.pola) for wiersz in self.tablica[wycinek].tolist()]
+
+
+class KursorPunktow(CursorPagination):
+    """
+    Punkty trasy w kolejności trasy - pozycją kursora jest kolejnosc, unikalna w obrębie trasy
+    """
+    ordering = ('kolejnosc', 'id')
+    # Punkt to kilka liczb - strony są dużo większe niż dla tras
+    page_size = 1000
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+
+
+class KursorTras(CursorPagination):
+    """
+    Trasy od ostatnio zmienionej. Kursor DRF zapamiętuje tylko data_modyfikacji ostatniej
+    trasy strony; trasy z tą samą datą na granicy strony pomija przesunięciem zapisanym
+    w kursorze. Pole id ustala jedynie stałą kolejność takich tras.
+    """
+    ordering = ('-data_modyfikacji', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 200
@@ -4,6 +4,7 @@ from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from .models import ObrazTla, Trasa, PunktTrasy
+from .services import KROK_KOLEJNOSCI
 
 class ModelTests(TestCase):
     """
@@ -265,7 +266,7 @@ class RouteManagementTests(TestCase):
         # Sprawdzenie czy punkt został dodany
         punkt = PunktTrasy.objects.filter(trasa=self.trasa, x=300, y=300).first()
         self.assertIsNotNone(punkt)
-        self.assertEqual(punkt.kolejnosc, 2)  # Powinien mieć kolejność 2 (bo już jest punkt z kolejnością 1)
+        self.assertEqual(punkt.kolejnosc, 1 + KROK_KOLEJNOSCI)  # Następny klucz po istniejącym punkcie z kolejnością 1
     
     def test_add_punkt_click(self):
         """Test dodawania punktu przez kliknięcie (AJAX)"""
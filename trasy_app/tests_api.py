@@ -65,7 +65,7 @@ class TrasaAPITests(APITestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         # print(response.content)
-        self.assertEqual(len(response.data), 4)
+        self.assertEqual(len(response.data), 3)
     
     def test_add_punkt_to_trasa(self):
         """
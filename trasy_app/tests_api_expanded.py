@@ -1,9 +1,17 @@
+import io
+import json
+
+from django.core.management import call_command
 from django.urls import reverse
 from django.contrib.auth.models import User
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from rest_framework.authtoken.models import Token
-from .models import ObrazTla, Trasa, PunktTrasy
+from .models import ObrazTla, Trasa, PunktTrasy, GeometriaTrasy
+from .kodowanie import TYP_SPAKOWANY, rozpakuj_punkty
+from .pamiec import pamiec_odpowiedzi
+from .rewizje import zmiany_od
+from .services import KROK_KOLEJNOSCI, POLOWA_OKNA, dodaj_punkty, wstaw_punkt
 
 class APIAuthenticationTests(APITestCase):
     """
@@ -226,11 +234,174 @@ class PunktTrasyAPITests(APITestCase):
         url = reverse('punkty-list', kwargs={'trasa_id': self.trasa.id})
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 4)
+        self.assertEqual(len(response.data), 3)
         # breakpoint()
         self.assertEqual(response.data['results'][0]['x'], 100)
         self.assertEqual(response.data['results'][1]['x'], 200)
-    
+
+    def test_route_points_cursor_pages(self):
+        """Test przechodzenia po stronach punktów kursorem (?page_size=)"""
+        dodaj_punkty(self.trasa, [(300 + i, 300) for i in range(3)])
+        for url in (reverse('punkty-list', kwargs={'trasa_id': self.trasa.id}),
+                    reverse('trasa-punkty', args=[self.trasa.id])):
+            kolejnosci = []
+            response = self.client.get(url, {'page_size': 2})
+            while True:
+                self.assertLessEqual(len(response.data['results']), 2)
+                kolejnosci += [p['kolejnosc'] for p in response.data['results']]
+                if response.data['next'] is None:
+                    break
+                response = self.client.get(response.data['next'])
+            self.assertEqual(kolejnosci, [1, 2, 2 + KROK_KOLEJNOSCI, 2 + 2 * KROK_KOLEJNOSCI, 2 + 3 * KROK_KOLEJNOSCI])
+
+    def test_conditional_requests(self):
+        """Test ETag i Last-Modified - 304 bez zmian, nowa wersja po zmianie punktu"""
+        url = reverse('punkty-list', kwargs={'trasa_id': self.trasa.id})
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        # Inny wariant odpowiedzi ma inny znacznik
+        self.assertNotEqual(self.client.get(url, {'page_size': 1})['ETag'], etag)
+
+        lista = self.client.get(reverse('trasa-list'))
+        data_modyfikacji = Trasa.objects.get(id=self.trasa.id).data_modyfikacji
+        self.client.patch(reverse('punkt-detail', kwargs={'trasa_id': self.trasa.id, 'pk': self.punkt1.id}),
+                          {'x': 150}, format='json')
+        self.assertGreater(Trasa.objects.get(id=self.trasa.id).data_modyfikacji, data_modyfikacji)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['x'], 150)
+        response = self.client.get(reverse('trasa-list'), HTTP_IF_NONE_MATCH=lista['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('trasa-list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_conditional_requests_follow_background(self):
+        """Test ETag szczegółów trasy i listy z ?expand=obraz_tla_details po zmianie obrazu tła"""
+        szczegoly = reverse('trasa-detail', args=[self.trasa.id])
+        lista = reverse('trasa-list')
+        etag = self.client.get(szczegoly)['ETag']
+        etag_listy = self.client.get(lista, {'expand': 'obraz_tla_details'})['ETag']
+        self.assertEqual(self.client.get(szczegoly, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Przetwarzanie obrazu zmienia status zapytaniem zbiorczym, bez sygnałów modelu
+        self.obraz_tla.nazwa = 'Nowe tło'
+        self.obraz_tla.save()
+        ObrazTla.objects.filter(id=self.obraz_tla.id).update(status=ObrazTla.GOTOWY)
+
+        response = self.client.get(szczegoly, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['obraz_tla_details']['nazwa'], 'Nowe tło')
+        self.assertEqual(response.data['obraz_tla_details']['status'], ObrazTla.GOTOWY)
+        response = self.client.get(lista, {'expand': 'obraz_tla_details'}, HTTP_IF_NONE_MATCH=etag_listy)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['obraz_tla_details']['status'], ObrazTla.GOTOWY)
+
+    def test_response_cache(self):
+        """Test pamięci odpowiedzi - trafienie bez czytania punktów, zmiany zawsze widoczne"""
+        admin = User.objects.create_superuser(username='admin', password='adminpass123')
+        statystyki = APIClient()
+        statystyki.force_authenticate(user=admin)
+        statystyki.delete(reverse('pamiec-statystyki'))
+        url = reverse('trasa-punkty', args=[self.trasa.id])
+
+        pierwsza = self.client.get(url)
+        with self.assertNumQueries(2):  # token i stan trasy
+            druga = self.client.get(url)
+        self.assertEqual(druga.data, pierwsza.data)
+        self.assertEqual(statystyki.get(reverse('pamiec-statystyki')).data['trafienia'], 1)
+
+        # Zmiany zbiorcze omijają sygnały modeli - trasa ma jednak nową rewizję
+        dodaj_punkty(self.trasa, [(300, 300)])
+        self.assertEqual(len(self.client.get(url).data['results']), 3)
+        self.client.patch(reverse('trasa-detail', args=[self.trasa.id]), {'nazwa': 'Nowa'}, format='json')
+        self.assertEqual(self.client.get(reverse('trasa-detail', args=[self.trasa.id])).data['nazwa'], 'Nowa')
+        self.assertEqual(statystyki.get(reverse('pamiec-statystyki')).data['chybienia'], 3)
+        self.assertEqual(self.client.get(reverse('pamiec-statystyki')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_response_cache_follows_background(self):
+        """Test pamięci odpowiedzi - zmiana obrazu tła usuwa wpisy jego tras"""
+        url = reverse('trasa-detail', args=[self.trasa.id])
+        etag = self.client.get(url)['ETag']
+        self.assertTrue(pamiec_odpowiedzi().get(f'trasy:odpowiedzi:{self.trasa.id}'))
+
+        self.obraz_tla.nazwa = 'Nowe tło'
+        self.obraz_tla.save()
+        self.assertIsNone(pamiec_odpowiedzi().get(f'trasy:odpowiedzi:{self.trasa.id}'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['obraz_tla_details']['nazwa'], 'Nowe tło')
+
+        # Status z przetwarzania obrazu - bez sygnału, ale z nowym znacznikiem
+        ObrazTla.objects.filter(id=self.obraz_tla.id).update(status=ObrazTla.GOTOWY)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['obraz_tla_details']['status'], ObrazTla.GOTOWY)
+
+    def test_packed_route_storage(self):
+        """Test trasy spakowanej do blobu - odczyty bez wierszy, zmiana punktu je przywraca"""
+        dodaj_punkty(self.trasa, [(300 + i, 300 - i) for i in range(1000)])
+        przed = self.client.get(reverse('trasa-punkty', args=[self.trasa.id]), HTTP_ACCEPT=TYP_SPAKOWANY).content
+        rewizja = Trasa.objects.get(id=self.trasa.id).rewizja
+
+        call_command('spakuj_trasy', self.trasa.id, stdout=io.StringIO())
+        self.assertFalse(PunktTrasy.objects.filter(trasa=self.trasa).exists())
+        self.assertLess(len(GeometriaTrasy.objects.get(trasa=self.trasa).dane), 1002 * 2)
+        self.assertEqual(Trasa.objects.get(id=self.trasa.id).rewizja, rewizja)
+
+        url = reverse('trasa-punkty', args=[self.trasa.id])
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT=TYP_SPAKOWANY).content, przed)
+        szczegoly = self.client.get(reverse('trasa-detail', args=[self.trasa.id])).data
+        self.assertEqual(szczegoly['punkty'][1], {'id': self.punkt2.id, 'x': 200, 'y': 200, 'kolejnosc': 2,
+                                                  'trasa': self.trasa.id})
+        response = self.client.get(reverse('trasa-list'), {'bbox': '300,290,310,300'})
+        self.assertEqual([t['id'] for t in response.data['results']], [self.trasa.id])
+        response = self.client.get(reverse('trasa-eksport'), {'format': 'csv'})
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 1003)
+
+        # Zmiana pojedynczego punktu przywraca wiersze z tymi samymi id
+        response = self.client.patch(reverse('punkt-detail', kwargs={'trasa_id': self.trasa.id, 'pk': self.punkt2.id}),
+                                     {'x': 250}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(GeometriaTrasy.objects.filter(trasa=self.trasa).exists())
+        self.assertEqual(PunktTrasy.objects.filter(trasa=self.trasa).count(), 1002)
+        self.assertEqual(PunktTrasy.objects.get(id=self.punkt2.id).x, 250)
+
+    def test_packed_format_error(self):
+        """Test błędu w formacie spakowanym - treść błędu jako JSON, a nie jako dane binarne"""
+        response = self.client.get(reverse('trasa-punkty', args=[self.trasa.id + 1000]), HTTP_ACCEPT=TYP_SPAKOWANY)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', json.loads(response.content))
+
+    def test_packed_route_reads_keep_blob(self):
+        """Test odczytów spakowanej trasy - listy i szczegóły punktów czytają blob bez przywracania wierszy"""
+        dodaj_punkty(self.trasa, [(300 + i, 300 - i) for i in range(10)])
+        oczekiwane = self.client.get(reverse('punkty-list', kwargs={'trasa_id': self.trasa.id}),
+                                     {'page_size': 5}).data
+        call_command('spakuj_trasy', self.trasa.id, stdout=io.StringIO())
+
+        # Strony kursora w obie strony jak dla wierszy
+        response = self.client.get(reverse('punkty-list', kwargs={'trasa_id': self.trasa.id}), {'page_size': 5})
+        self.assertEqual(response.data['results'], oczekiwane['results'])
+        nastepna = self.client.get(response.data['next'])
+        self.assertEqual([p['x'] for p in nastepna.data['results']], [303, 304, 305, 306, 307])
+        poprzednia = self.client.get(nastepna.data['previous'])
+        self.assertEqual(poprzednia.data['results'], oczekiwane['results'])
+        response = self.client.get(reverse('trasa-punkty', args=[self.trasa.id]), {'page_size': 5})
+        self.assertEqual(response.data['results'], oczekiwane['results'])
+        response = self.client.get(reverse('punkt-detail', kwargs={'trasa_id': self.trasa.id, 'pk': self.punkt2.id}))
+        self.assertEqual(response.data, oczekiwane['results'][1])
+        response = self.client.get(reverse('punkt-detail', kwargs={'trasa_id': self.trasa.id, 'pk': 0}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(GeometriaTrasy.objects.filter(trasa=self.trasa).exists())
+        self.assertFalse(PunktTrasy.objects.filter(trasa=self.trasa).exists())
+
     def test_add_new_point(self):
         """Test dodawania nowego punktu do trasy przez API"""
         url = reverse('punkty-list', kwargs={'trasa_id': self.trasa.id})
@@ -251,9 +422,9 @@ class PunktTrasyAPITests(APITestCase):
             ).exists()
         )
         
-        # Sprawdź, czy punkt ma prawidłową kolejność (3 - po istniejących punktach)
+        # Sprawdź, czy punkt ma prawidłową kolejność (klucz co KROK_KOLEJNOSCI po istniejących punktach)
         punkt = PunktTrasy.objects.get(trasa=self.trasa, x=300, y=300)
-        self.assertEqual(punkt.kolejnosc, 3)
+        self.assertEqual(punkt.kolejnosc, 2 + KROK_KOLEJNOSCI)
     
     def test_retrieve_point_details(self):
         """Test pobierania szczegółów punktu przez API"""
@@ -297,4 +468,321 @@ class PunktTrasyAPITests(APITestCase):
         }
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertTrue('x' in response.data)  # Powinien być błąd dla pola x
\ No newline at end of file
+        self.assertTrue('x' in response.data)  # Powinien być błąd dla pola x
+    
+    def test_bulk_add_points(self):
+        """Test masowego dodawania punktów do trasy"""
+        url = reverse('punkty-bulk', kwargs={'trasa_id': self.trasa.id})
+        data = [[300, 300], {'x': 400, 'y': 350}, [500, 410]]
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['liczba'], 3)
+        
+        # Nowe punkty dostają klucze co KROK_KOLEJNOSCI po istniejących
+        kolejnosci = list(PunktTrasy.objects.filter(trasa=self.trasa).values_list('kolejnosc', 'x'))
+        self.assertEqual(kolejnosci, [(1, 100), (2, 200), (2 + KROK_KOLEJNOSCI, 300),
+                                      (2 + 2 * KROK_KOLEJNOSCI, 400), (2 + 3 * KROK_KOLEJNOSCI, 500)])
+    
+    def test_bulk_add_points_validation(self):
+        """Test walidacji masowego dodawania - błędny punkt odrzuca całą paczkę"""
+        url = reverse('punkty-bulk', kwargs={'trasa_id': self.trasa.id})
+        data = {'punkty': [[300, 300], [400, 'abc']]}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(PunktTrasy.objects.filter(trasa=self.trasa).count(), 2)
+    
+    def test_route_points_packed(self):
+        """Test pobierania punktów trasy w spakowanym formacie przez API"""
+        url = reverse('trasa-punkty', args=[self.trasa.id])
+        response = self.client.get(url, HTTP_ACCEPT=TYP_SPAKOWANY)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], TYP_SPAKOWANY)
+        self.assertEqual(
+            rozpakuj_punkty(response.content).tolist(),
+            [[self.punkt1.id, 100, 100, 1], [self.punkt2.id, 200, 200, 2]]
+        )
+    
+    def test_route_changes_since_revision(self):
+        """Test pobierania zmian trasy od podanej rewizji przez API"""
+        rewizja = Trasa.objects.get(id=self.trasa.id).rewizja
+        url = reverse('punkt-detail', kwargs={'trasa_id': self.trasa.id, 'pk': self.punkt2.id})
+        self.client.patch(url, {'x': 250}, format='json')
+        
+        response = self.client.get(reverse('trasa-zmiany', args=[self.trasa.id]), {'rewizja': rewizja})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rewizja'], rewizja + 1)
+        self.assertEqual(response.data['zmiany'], [
+            {'operacja': 'zmiana', 'id': self.punkt2.id, 'x': 250, 'y': 200, 'kolejnosc': 2}
+        ])
+    
+    def test_move_point_to_position(self):
+        """Test przenoszenia punktu na dowolną pozycję - zmienia się tylko przenoszony punkt"""
+        punkt3 = PunktTrasy.objects.create(trasa=self.trasa, x=300, y=300, kolejnosc=3)
+        url = reverse('punkt-move-to', kwargs={'trasa_id': self.trasa.id, 'pk': punkt3.id})
+        response = self.client.post(url, {'pozycja': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        kolejnosci = dict(PunktTrasy.objects.filter(trasa=self.trasa).values_list('id', 'kolejnosc'))
+        self.assertEqual(kolejnosci[self.punkt1.id], 1)
+        self.assertEqual(kolejnosci[self.punkt2.id], 2)
+        ids = list(PunktTrasy.objects.filter(trasa=self.trasa).values_list('id', flat=True))
+        self.assertEqual(ids, [punkt3.id, self.punkt1.id, self.punkt2.id])
+    
+    def test_batch_operations(self):
+        """Test wykonania listy operacji na punktach w jednej transakcji i jednej rewizji"""
+        url = reverse('trasa-operacje', args=[self.trasa.id])
+        rewizja = Trasa.objects.get(id=self.trasa.id).rewizja
+        response = self.client.post(url, {'operacje': [
+            {'operacja': 'add', 'x': 300, 'y': 300},
+            {'operacja': 'insert', 'x': 150, 'y': 150, 'pozycja': 2},
+            {'operacja': 'update', 'id': self.punkt1.id, 'y': 50},
+            {'operacja': 'move', 'id': self.punkt2.id, 'kierunek': 'down'},
+            {'operacja': 'delete', 'id': self.punkt1.id},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rewizja'], rewizja + 1)
+        self.assertEqual(len(response.data['punkty']), 5)
+        xs = list(PunktTrasy.objects.filter(trasa=self.trasa).values_list('x', flat=True))
+        self.assertEqual(xs, [150, 300, 200])
+        
+        # Błąd w dowolnej operacji wycofuje całą listę
+        response = self.client.post(url, {'operacje': [
+            {'operacja': 'delete', 'id': self.punkt2.id},
+            {'operacja': 'delete', 'id': self.punkt1.id},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(PunktTrasy.objects.filter(id=self.punkt2.id).exists())
+        self.assertEqual(Trasa.objects.get(id=self.trasa.id).rewizja, rewizja + 1)
+        
+        response = self.client.post(url, {'operacje': [{'operacja': 'move', 'id': self.punkt2.id}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    async def test_async_read_endpoints(self):
+        """Test asynchronicznych widoków odczytu - te same dane co widoki synchroniczne, strumieniowo"""
+        naglowki = {'Authorization': 'Token ' + self.token.key}
+        
+        async def pobierz(url, **kwargs):
+            response = await self.async_client.get(url, headers=naglowki, **kwargs)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response, b''.join([fragment async for fragment in response.streaming_content])
+        
+        url = reverse('get_punkty_async', args=[self.trasa.id])
+        response, tresc = await pobierz(url)
+        dane = json.loads(tresc)
+        self.assertTrue(dane['success'])
+        self.assertEqual([(p['x'], p['y']) for p in dane['punkty']], [(100, 100), (200, 200)])
+        response = await self.async_client.get(url, headers={**naglowki, 'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        _, tresc = await pobierz(reverse('trasa_async', args=[self.trasa.id]))
+        dane = json.loads(tresc)
+        self.assertEqual(dane['nazwa'], self.trasa.nazwa)
+        self.assertEqual([p['trasa'] for p in dane['punkty']], [self.trasa.id] * 2)
+        
+        _, tresc = await pobierz(reverse('trasy_async'))
+        self.assertEqual([trasa['id'] for trasa in json.loads(tresc)], [self.trasa.id])
+        
+        _, tresc = await pobierz(reverse('eksport_async'), data={'format': 'csv'})
+        self.assertEqual(len(tresc.decode().splitlines()), 3)
+        
+        response = await self.async_client.get(reverse('trasy_async'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_insert_points_between_neighbours(self):
+        """Test wstawiania punktów między sąsiadów bez wolnych kluczy (rozrzedzenie trasy)"""
+        url = reverse('punkty-list', kwargs={'trasa_id': self.trasa.id})
+        for x in range(110, 200, 10):
+            response = self.client.post(url, {'x': x, 'y': 0, 'pozycja': 2}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        xs = list(PunktTrasy.objects.filter(trasa=self.trasa).values_list('x', flat=True))
+        self.assertEqual(xs, [100] + list(range(190, 100, -10)) + [200])
+
+    def test_moves_rewrite_few_rows(self):
+        """Test przesuwania w środku dopisanej trasy - jeden wiersz, a przy kolizji tylko okno wokół niej"""
+        dodaj_punkty(self.trasa, [(i, i) for i in range(1000)])
+        rewizja = Trasa.objects.get(id=self.trasa.id).rewizja
+        przed = dict(PunktTrasy.objects.filter(trasa=self.trasa).values_list('id', 'kolejnosc'))
+        srodkowy = PunktTrasy.objects.get(trasa=self.trasa, x=500, y=500)
+        url = reverse('punkt-move-to', kwargs={'trasa_id': self.trasa.id, 'pk': srodkowy.id})
+        self.assertEqual(self.client.post(url, {'pozycja': 300}, format='json').status_code, status.HTTP_200_OK)
+        po = dict(PunktTrasy.objects.filter(trasa=self.trasa).values_list('id', 'kolejnosc'))
+        self.assertEqual([id_punktu for id_punktu in po if po[id_punktu] != przed[id_punktu]], [srodkowy.id])
+
+        # Kolejne wstawienia w to samo miejsce wyczerpują odstęp między sąsiadami
+        for _ in range(12):
+            wstaw_punkt(self.trasa, 0, 0, 300)
+        koncowe = dict(PunktTrasy.objects.filter(trasa=self.trasa).values_list('id', 'kolejnosc'))
+        przenumerowane = [id_punktu for id_punktu in po if koncowe[id_punktu] != po[id_punktu]]
+        self.assertTrue(0 < len(przenumerowane) <= 2 * POLOWA_OKNA)
+        self.assertEqual(len(set(koncowe.values())), len(koncowe))
+        # Klienci dostają zmiany punktów, a nie przebudowę całej trasy
+        _, zmiany = zmiany_od(self.trasa.id, rewizja)
+        self.assertIsNotNone(zmiany)
+        self.assertEqual(len(zmiany), 13 + len(przenumerowane))
+    
+    def test_route_list_summary(self):
+        """Test listy tras - statystyki zamiast punktów"""
+        response = self.client.get(reverse('trasa-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        trasa = response.data['results'][0]
+        self.assertNotIn('punkty', trasa)
+        self.assertEqual(trasa['liczba_punktow'], 2)
+        self.assertEqual(trasa['bbox'], [100, 100, 200, 200])
+        self.assertAlmostEqual(trasa['dlugosc'], 100 * 2 ** 0.5)
+    
+    def test_route_list_fields_and_expand(self):
+        """Test wyboru pól (?fields=) i rozwijania punktów (?expand=)"""
+        response = self.client.get(reverse('trasa-list'), {'fields': 'id,nazwa', 'expand': 'punkty'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        trasa = response.data['results'][0]
+        self.assertEqual(set(trasa), {'id', 'nazwa', 'punkty'})
+        self.assertEqual([punkt['id'] for punkt in trasa['punkty']], [self.punkt1.id, self.punkt2.id])
+    
+    def test_route_list_sort_and_filter_by_metrics(self):
+        """Test sortowania i filtrowania listy tras po metrykach"""
+        krotka = Trasa.objects.create(nazwa="Krótka", uzytkownik=self.user, obraz_tla=self.obraz_tla)
+        PunktTrasy.objects.create(trasa=krotka, x=0, y=0, kolejnosc=1)
+        PunktTrasy.objects.create(trasa=krotka, x=3, y=4, kolejnosc=2)
+        
+        response = self.client.get(reverse('trasa-list'), {'ordering': 'dlugosc', 'fields': 'id,dlugosc'})
+        self.assertEqual([t['id'] for t in response.data['results']], [krotka.id, self.trasa.id])
+        self.assertEqual(response.data['results'][0]['dlugosc'], 5.0)
+        
+        response = self.client.get(reverse('trasa-list'), {'dlugosc_min': 10})
+        self.assertEqual([t['id'] for t in response.data['results']], [self.trasa.id])
+        
+        response = self.client.get(reverse('trasa-list'), {'dlugosc_min': 'dużo'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_route_points_simplified(self):
+        """Test uproszczonej trasy (?tolerance=, ?max_points=)"""
+        # Punkt (150, 160) jest odległy o ok. 7 od odcinka łączącego końce trasy,
+        # a punkt (200, 200) o ok. 4.9 od odcinka (150, 160)-(300, 300)
+        PunktTrasy.objects.filter(id=self.punkt2.id).update(kolejnosc=3)
+        srodek = PunktTrasy.objects.create(trasa=self.trasa, x=150, y=160, kolejnosc=2)
+        koniec = PunktTrasy.objects.create(trasa=self.trasa, x=300, y=300, kolejnosc=4)
+        url = reverse('trasa-punkty', args=[self.trasa.id])
+        
+        response = self.client.get(url, {'tolerance': 5})
+        self.assertEqual([p['id'] for p in response.data], [self.punkt1.id, srodek.id, koniec.id])
+        
+        response = self.client.get(url, {'tolerance': 10})
+        self.assertEqual([p['id'] for p in response.data], [self.punkt1.id, koniec.id])
+        
+        response = self.client.get(url, {'max_points': 2}, HTTP_ACCEPT=TYP_SPAKOWANY)
+        self.assertEqual(rozpakuj_punkty(response.content)[:, 0].tolist(), [self.punkt1.id, koniec.id])
+        
+        response = self.client.get(url, {'max_points': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_route_list_filtered_by_region(self):
+        """Test filtrowania listy tras po obszarze mapy (?bbox=, ?near=)"""
+        inna = Trasa.objects.create(nazwa="Daleka", uzytkownik=self.user, obraz_tla=self.obraz_tla)
+        dodaj_punkty(inna, [(-1000, 5000), (-900, 5100)])
+        url = reverse('trasa-list')
+        
+        response = self.client.get(url, {'bbox': '150,150,250,250', 'fields': 'id'})
+        self.assertEqual([t['id'] for t in response.data['results']], [self.trasa.id])
+        
+        # Punkty między (100, 100) a (200, 200) nie leżą w prostokącie, choć trasa przez niego przechodzi
+        response = self.client.get(url, {'bbox': '140,120,160,130', 'fields': 'id'})
+        self.assertEqual(response.data['results'], [])
+        
+        response = self.client.get(url, {'near': '-995,5010', 'radius': 15, 'obraz_tla': self.obraz_tla.id})
+        self.assertEqual([t['id'] for t in response.data['results']], [inna.id])
+        
+        response = self.client.get(url, {'bbox': '1,2,3'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_background_points_near(self):
+        """Test najbliższych punktów tras na obrazie tła - także po przesunięciu punktu"""
+        url = reverse('obraztla-punkty', args=[self.obraz_tla.id])
+        self.client.patch(
+            reverse('punkt-detail', kwargs={'trasa_id': self.trasa.id, 'pk': self.punkt2.id}),
+            {'x': 700, 'y': 520}, format='json'
+        )
+        
+        response = self.client.get(url, {'near': '690,515', 'radius': 50})
+        self.assertEqual([p['id'] for p in response.data['results']], [self.punkt2.id])
+        self.assertEqual(self.client.get(url, {'near': '200,200'}).data['results'], [])
+        
+        response = self.client.get(url, {'bbox': '0,0,800,600'})
+        self.assertEqual([p['id'] for p in response.data['results']], [self.punkt1.id, self.punkt2.id])
+        
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_background_points_of_packed_route(self):
+        """Test punktów na obrazie tła - punkty spakowanej trasy razem z wierszami innych tras"""
+        url = reverse('obraztla-punkty', args=[self.obraz_tla.id])
+        spakowana = Trasa.objects.create(nazwa="Spakowana", uzytkownik=self.user, obraz_tla=self.obraz_tla)
+        dodaj_punkty(spakowana, [(110, 110), (500, 500), (190, 190)])
+        ids = list(PunktTrasy.objects.filter(trasa=spakowana).values_list('id', flat=True))
+        call_command('spakuj_trasy', spakowana.id, stdout=io.StringIO())
+        
+        response = self.client.get(url, {'bbox': '0,0,300,300'})
+        self.assertEqual([p['id'] for p in response.data['results']],
+                         [self.punkt1.id, self.punkt2.id, ids[0], ids[2]])
+        self.assertEqual(response.data['results'][2],
+                         {'id': ids[0], 'x': 110, 'y': 110, 'kolejnosc': KROK_KOLEJNOSCI, 'trasa': spakowana.id})
+        
+        response = self.client.get(url, {'near': '105,105', 'radius': 20})
+        self.assertEqual([p['id'] for p in response.data['results']], [self.punkt1.id, ids[0]])
+        self.assertFalse(PunktTrasy.objects.filter(trasa=spakowana).exists())
+    
+    def test_route_hit_test(self):
+        """Test trafiania w punkt i odcinek trasy - wstawienie punktu na trafionym odcinku"""
+        url = reverse('trasa-trafienie', args=[self.trasa.id])
+        
+        response = self.client.get(url, {'x': 203, 'y': 196})
+        self.assertEqual(response.data['punkt']['id'], self.punkt2.id)
+        self.assertEqual(response.data['punkt']['pozycja'], 2)
+        
+        response = self.client.get(url, {'x': 160, 'y': 150, 'radius': 8})
+        self.assertIsNone(response.data['punkt'])
+        odcinek = response.data['odcinek']
+        self.assertEqual((odcinek['od'], odcinek['do'], odcinek['pozycja']), (self.punkt1.id, self.punkt2.id, 2))
+        self.assertEqual((odcinek['x'], odcinek['y']), (155, 155))
+        
+        self.client.post(reverse('punkty-list', kwargs={'trasa_id': self.trasa.id}),
+                         {'x': odcinek['x'], 'y': odcinek['y'], 'pozycja': odcinek['pozycja']}, format='json')
+        xs = list(PunktTrasy.objects.filter(trasa=self.trasa).values_list('x', flat=True))
+        self.assertEqual(xs, [100, 155, 200])
+        
+        # Nowa rewizja trasy - indeks budowany od nowa
+        response = self.client.get(url, {'x': 156, 'y': 150})
+        self.assertEqual(response.data['punkt']['pozycja'], 2)
+        
+        self.assertIsNone(self.client.get(url, {'x': 500, 'y': 500}).data['odcinek'])
+        self.assertEqual(self.client.get(url, {'x': 'a', 'y': 1}).status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_route_export(self):
+        """Test strumieniowego eksportu tras do GeoJSON, CSV i GPX"""
+        url = reverse('trasa-eksport')
+        
+        response = self.client.get(url, {'format': 'geojson'})
+        self.assertEqual(response['Content-Type'], 'application/geo+json; charset=utf-8')
+        dane = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(dane['features'][0]['properties']['id'], self.trasa.id)
+        self.assertEqual(dane['features'][0]['geometry']['coordinates'], [[100, 100], [200, 200]])
+        
+        response = self.client.get(url, {'format': 'csv'})
+        wiersze = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(wiersze, ['trasa_id,trasa,pozycja,x,y',
+                                   f'{self.trasa.id},Punkt API Test Trasa,1,100,100',
+                                   f'{self.trasa.id},Punkt API Test Trasa,2,200,200'])
+        
+        # Bez przekształcenia tła nie ma współrzędnych geograficznych
+        self.assertEqual(self.client.get(url, {'format': 'gpx'}).status_code, status.HTTP_400_BAD_REQUEST)
+        ObrazTla.objects.filter(id=self.obraz_tla.id).update(transformacja=[0.001, 0, 19.0, 0, -0.001, 50.0])
+        
+        response = self.client.get(url, {'format': 'gpx'})
+        gpx = b''.join(response.streaming_content).decode()
+        self.assertIn('<trkpt lat="49.9000000" lon="19.1000000"/>', gpx)
+        self.assertIn('<trkpt lat="49.8000000" lon="19.2000000"/>', gpx)
+        
+        response = self.client.get(url, {'format': 'geojson', 'coords': 'world', 'obraz_tla': self.obraz_tla.id})
+        dane = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(dane['features'][0]['geometry']['coordinates'][0], [19.1, 49.9])
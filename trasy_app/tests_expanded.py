@@ -1,9 +1,20 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 
-from .models import ObrazTla, Trasa, PunktTrasy
+from .models import ObrazTla, Trasa, PunktTrasy, GeometriaTrasy, ZmianaTrasy
+from .kodowanie import TYP_SPAKOWANY, rozpakuj_punkty
+from .metryki import przelicz_metryki
+from .services import dodaj_punkty, przesun_na_pozycje, wstaw_punkt
 
 class ModelRelationTests(TestCase):
     """
@@ -74,6 +85,34 @@ class ModelRelationTests(TestCase):
         """Test kolejności punktów trasy"""
         punkty = self.trasa.punkty.all()
         self.assertEqual(list(punkty), [self.punkt1, self.punkt2])
+    
+    def test_punkty_unique_kolejnosc(self):
+        """Test unikalności kolejności punktów w obrębie trasy"""
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PunktTrasy.objects.create(trasa=self.trasa, x=300, y=300, kolejnosc=2)
+    
+    def test_route_metrics_incremental(self):
+        """Test przyrostowej aktualizacji metryk trasy - zgodnych z przeliczeniem od zera"""
+        def metryki():
+            self.trasa.refresh_from_db()
+            return (self.trasa.liczba_punktow, round(self.trasa.dlugosc, 6),
+                    self.trasa.min_x, self.trasa.min_y, self.trasa.max_x, self.trasa.max_y)
+        
+        self.assertEqual(metryki(), (2, round(100 * 2 ** 0.5, 6), 100, 100, 200, 200))
+        
+        # Wstawienie między punkty, przesunięcie, zmiana współrzędnych, dopisanie i usunięcie
+        wstaw_punkt(self.trasa, 500, 0, pozycja=2)
+        przesun_na_pozycje(self.punkt2, 1)
+        self.punkt1.x = 50
+        self.punkt1.save()
+        dodaj_punkty(self.trasa, [(0, 0), (30, 40)])
+        self.punkt2.delete()
+        
+        przyrostowe = metryki()
+        przelicz_metryki([self.trasa.id])
+        self.assertEqual(przyrostowe, metryki())
+        self.assertEqual(przyrostowe[0], 4)
+        self.assertEqual(przyrostowe[2:], (0, 0, 500, 100))
 
 
 class AuthorizationTests(TestCase):
@@ -130,6 +169,38 @@ class AuthorizationTests(TestCase):
         response = self.client.get(reverse('trasa_edit', args=[self.trasa_user1.id]))
         self.assertEqual(response.status_code, 200)
     
+    def test_edit_packed_route(self):
+        """Test edytora spakowanej trasy - wyświetlenie czyta blob, dodanie punktu przywraca wiersze"""
+        call_command('spakuj_trasy', self.trasa_user1.id, stdout=io.StringIO())
+        self.client.login(username='user1', password='password1')
+        response = self.client.get(reverse('trasa_edit', args=[self.trasa_user1.id]))
+        self.assertEqual(response.context['punkty'], [{'id': self.punkt_user1.id, 'x': 100, 'y': 100, 'kolejnosc': 1}])
+        self.assertTrue(GeometriaTrasy.objects.filter(trasa=self.trasa_user1).exists())
+        self.assertFalse(PunktTrasy.objects.filter(trasa=self.trasa_user1).exists())
+        
+        self.client.post(reverse('trasa_edit', args=[self.trasa_user1.id]), {'x': 200, 'y': 200})
+        self.assertFalse(GeometriaTrasy.objects.filter(trasa=self.trasa_user1).exists())
+        self.assertEqual(list(PunktTrasy.objects.filter(trasa=self.trasa_user1).values_list('x', flat=True)), [100, 200])
+    
+    def test_move_and_delete_packed_route_point(self):
+        """Test przesuwania i usuwania punktu spakowanej trasy przez stare adresy edytora"""
+        drugi = PunktTrasy.objects.create(trasa=self.trasa_user1, x=200, y=200, kolejnosc=2)
+        call_command('spakuj_trasy', self.trasa_user1.id, stdout=io.StringIO())
+        self.client.login(username='user2', password='password2')
+        self.assertEqual(self.client.get(reverse('punkt_move', args=[drugi.id, 'up'])).status_code, 404)
+        self.assertTrue(GeometriaTrasy.objects.filter(trasa=self.trasa_user1).exists())
+        
+        self.client.login(username='user1', password='password1')
+        response = self.client.get(reverse('punkt_move', args=[drugi.id, 'up']))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(self.trasa_user1.punkty.order_by('kolejnosc').values_list('id', flat=True)),
+                         [drugi.id, self.punkt_user1.id])
+        
+        call_command('spakuj_trasy', self.trasa_user1.id, stdout=io.StringIO())
+        response = self.client.get(reverse('punkt_delete', args=[self.punkt_user1.id]))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(self.trasa_user1.punkty.values_list('id', flat=True)), [drugi.id])
+    
     def test_access_other_user_route(self):
         """Test próby dostępu do trasy innego użytkownika"""
         self.client.login(username='user2', password='password2')
@@ -239,4 +310,164 @@ class RouteFunctionalityTests(TestCase):
                 x=150,
                 y=250
             ).exists()
-        )
\ No newline at end of file
+        )
+    
+    def test_get_punkty_packed(self):
+        """Test spakowanego formatu punktów - zawiera te same dane co JSON"""
+        trasa = Trasa.objects.create(
+            nazwa='Packed Test Route',
+            uzytkownik=self.user,
+            obraz_tla=self.obraz_tla
+        )
+        for i, (x, y) in enumerate([(500, 20), (10, 590), (400, 300)], start=1):
+            PunktTrasy.objects.create(trasa=trasa, x=x, y=y, kolejnosc=i)
+        
+        url = reverse('get_punkty', args=[trasa.id])
+        json_response = self.client.get(url)
+        packed_response = self.client.get(url, HTTP_ACCEPT=TYP_SPAKOWANY)
+        
+        self.assertEqual(packed_response['Content-Type'], TYP_SPAKOWANY)
+        tablica = rozpakuj_punkty(packed_response.content)
+        self.assertEqual(
+            [dict(zip(('id', 'x', 'y', 'kolejnosc'), wiersz)) for wiersz in tablica.tolist()],
+            json_response.json()['punkty']
+        )
+
+        # Bez zmian trasy edytor dostaje 304 - osobno dla każdego formatu
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=json_response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(packed_response['ETag'], json_response['ETag'])
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=json_response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_edit_returns_only_changes(self):
+        """Test odpowiedzi z samymi zmianami po edycji trasy z podaną rewizją"""
+        trasa = Trasa.objects.create(
+            nazwa='Revision Test Route',
+            uzytkownik=self.user,
+            obraz_tla=self.obraz_tla
+        )
+        punkty = [PunktTrasy.objects.create(trasa=trasa, x=i * 10, y=i * 10, kolejnosc=i) for i in range(1, 6)]
+        trasa.refresh_from_db()
+        self.assertEqual(trasa.rewizja, 5)
+        
+        response = self.client.get(
+            reverse('punkt_move', args=[punkty[1].id, 'up']),
+            {'rewizja': trasa.rewizja},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        data = response.json()
+        # Przesunięcie zmienia tylko klucz kolejności przesuwanego punktu
+        self.assertEqual(data['rewizja'], 6)
+        self.assertEqual(len(data['zmiany']), 1)
+        self.assertEqual(data['zmiany'][0]['id'], punkty[1].id)
+        self.assertLess(data['zmiany'][0]['kolejnosc'], punkty[0].kolejnosc)
+        
+        # Zmiany od rewizji 5 obejmują też późniejsze usunięcie punktu
+        self.client.get(reverse('punkt_delete', args=[punkty[4].id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = self.client.get(reverse('trasa_zmiany', args=[trasa.id]), {'rewizja': 5}).json()
+        self.assertEqual(data['rewizja'], 7)
+        self.assertIn({'operacja': 'usuniecie', 'id': punkty[4].id}, data['zmiany'])
+        self.assertEqual(len(data['zmiany']), 2)
+    
+    def test_changes_after_rebuild_return_full_list(self):
+        """Test pełnej listy punktów, gdy dziennik zmian nie wystarcza"""
+        trasa = Trasa.objects.create(
+            nazwa='Rebuild Test Route',
+            uzytkownik=self.user,
+            obraz_tla=self.obraz_tla
+        )
+        PunktTrasy.objects.create(trasa=trasa, x=10, y=10, kolejnosc=1)
+        ZmianaTrasy.objects.create(trasa=trasa, rewizja=2, operacja=ZmianaTrasy.PRZEBUDOWA)
+        Trasa.objects.filter(id=trasa.id).update(rewizja=2)
+        
+        data = self.client.get(reverse('trasa_zmiany', args=[trasa.id]), {'rewizja': 0}).json()
+        self.assertNotIn('zmiany', data)
+        self.assertEqual(data['rewizja'], 2)
+        self.assertEqual(len(data['punkty']), 1)
+    
+    async def test_change_stream(self):
+        """Test strumienia zmian trasy dla edytorów w innych przeglądarkach (tylko pod ASGI)"""
+        trasa = await Trasa.objects.acreate(
+            nazwa='Stream Test Route',
+            uzytkownik=self.user,
+            obraz_tla=self.obraz_tla
+        )
+        await PunktTrasy.objects.acreate(trasa=trasa, x=10, y=10, kolejnosc=1)
+        await PunktTrasy.objects.acreate(trasa=trasa, x=20, y=20, kolejnosc=2)
+        await self.async_client.aforce_login(self.user)
+        url = reverse('trasa_strumien', args=[trasa.id])
+        
+        response = await self.async_client.get(url, {'rewizja': 0})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        zdarzenia = aiter(response.streaming_content)
+        self.assertTrue((await anext(zdarzenia)).startswith(b'retry:'))
+        
+        # Klient ze starszą rewizją od razu dostaje zaległe zmiany
+        zdarzenie = (await anext(zdarzenia)).decode()
+        self.assertTrue(zdarzenie.startswith('id: 2\nevent: zmiany\n'))
+        self.assertEqual(len(json.loads(zdarzenie.split('data: ')[1])['zmiany']), 2)
+        
+        # Zmiana zapisana przez inną przeglądarkę trafia do czekającego strumienia po zatwierdzeniu
+        def dodaj_punkt_w_innej_przegladarce():
+            self.client.force_login(self.user)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('add_point_click', args=[trasa.id]), {'x': 30, 'y': 30},
+                                 HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        
+        nastepne = asyncio.ensure_future(anext(zdarzenia))
+        await sync_to_async(dodaj_punkt_w_innej_przegladarce)()
+        dane = json.loads((await asyncio.wait_for(nastepne, 5)).decode().split('data: ')[1])
+        self.assertEqual(dane['rewizja'], 3)
+        self.assertEqual([(z['x'], z['y']) for z in dane['zmiany']], [(30, 30)])
+        await zdarzenia.aclose()
+        
+        # Strumień cudzej trasy jest niedostępny
+        inny = await User.objects.acreate_user(username='streamother', password='streampass')
+        await self.async_client.aforce_login(inny)
+        self.assertEqual((await self.async_client.get(url)).status_code, 404)
+    
+    def test_change_stream_requires_asgi(self):
+        """Test strumienia zmian pod WSGI - odmowa zamiast zajmowania wątku roboczego"""
+        trasa = Trasa.objects.create(nazwa='WSGI Stream Route', uzytkownik=self.user, obraz_tla=self.obraz_tla)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('trasa_strumien', args=[trasa.id]))
+        self.assertEqual(response.status_code, 501)
+        # Edytor pod WSGI nie otwiera strumienia
+        self.assertFalse(self.client.get(reverse('trasa_edit', args=[trasa.id])).context['strumien_zmian'])
+
+class DuplicateOrderRepairTests(TransactionTestCase):
+    """
+    Testy naprawy zdublowanej kolejności punktów przed dodaniem unikalności (trasa, kolejnosc)
+    """
+    
+    def test_repair_allows_unique_constraint(self):
+        """Test przenumerowania tras z dawnego wyścigu - po nim ograniczenie daje się dodać"""
+        user = User.objects.create_user(username='repairuser', password='repairpass')
+        obraz_tla = ObrazTla.objects.create(nazwa='Repair Tło', szerokosc=800, wysokosc=600)
+        trasa = Trasa.objects.create(nazwa='Repair Route', uzytkownik=user, obraz_tla=obraz_tla)
+        poprawna = Trasa.objects.create(nazwa='Valid Route', uzytkownik=user, obraz_tla=obraz_tla)
+        ograniczenie = next(c for c in PunktTrasy._meta.constraints if c.name == 'punkt_trasa_kolejnosc_uniq')
+        
+        # Baza sprzed ograniczenia - dwa punkty dopisane równolegle dostały tę samą kolejność.
+        # SQLite odtwarza tabelę z ograniczeń modelu, więc model też chwilowo go nie ma.
+        pozostale = [c for c in PunktTrasy._meta.constraints if c is not ograniczenie]
+        with mock.patch.object(PunktTrasy._meta, 'constraints', pozostale), connection.schema_editor() as editor:
+            editor.remove_constraint(PunktTrasy, ograniczenie)
+        try:
+            punkty = [PunktTrasy.objects.create(trasa=trasa, x=x, y=0, kolejnosc=k)
+                      for x, k in [(10, 1), (20, 2), (30, 2), (40, 3)]]
+            PunktTrasy.objects.create(trasa=poprawna, x=0, y=0, kolejnosc=5)
+            
+            wynik = io.StringIO()
+            call_command('napraw_kolejnosc', '--sprawdz', stdout=wynik)
+            self.assertIn(str(trasa.id), wynik.getvalue())
+            call_command('napraw_kolejnosc', stdout=io.StringIO())
+        finally:
+            # Dodanie ograniczenia jak w migracji - z duplikatami zgłosiłoby IntegrityError
+            with connection.schema_editor() as editor:
+                editor.add_constraint(PunktTrasy, ograniczenie)
+        
+        self.assertEqual(list(PunktTrasy.objects.filter(trasa=trasa).values_list('id', flat=True)),
+                         [punkt.id for punkt in punkty])
+        self.assertEqual(PunktTrasy.objects.get(trasa=poprawna).kolejnosc, 5)
@@ -0,0 +1,160 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from .eksport import eksport_geojson
+from .importowanie import importuj_trasy, klucz_postepu, pamiec_postepu, sprawdz_pamiec_postepu, zdarzenia_json
+from .models import ImportTras, ObrazTla, Trasa, ZmianaTrasy
+
+MEDIA_TESTOWE = tempfile.mkdtemp()
+SYNCHRONICZNIE = 'trasy_app.zadania.KolejkaSynchroniczna'
+
+GPX = b'''<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+<trk><name>Rano</name><desc>Spacer</desc><trkseg>
+<trkpt lat="50.0" lon="19.0"/><trkpt lat="50.001" lon="19.002"/><trkpt lat="50.002" lon="19.003"/>
+</trkseg></trk>
+<trk><name>Pusta</name><trkseg></trkseg></trk>
+<rte><rtept lat="50.0" lon="19.01"/><rtept lat="50.0" lon="19.02"/></rte>
+</gpx>
+'''
+
+
+def punkty(trasa):
+    return list(trasa.punkty.order_by('kolejnosc').values_list('x', 'y'))
+
+
+class AnalizatorJsonTests(TestCase):
+    """
+    Testy przyrostowego analizatora JSON
+    """
+
+    def test_zdarzenia_niezalezne_od_fragmentow(self):
+        """Test zdarzeń dla napisów i liczb przeciętych granicą fragmentu"""
+        tekst = json.dumps({'a': [1, -2.5e3, 'zażółć "gęślą"\n', True, None], 'b': {}}, ensure_ascii=False)
+        oczekiwane = [('{', None), ('klucz', 'a'), ('[', None), ('wartosc', 1), ('wartosc', -2500.0),
+                      ('wartosc', 'zażółć "gęślą"\n'), ('wartosc', True), ('wartosc', None), (']', None),
+                      ('klucz', 'b'), ('{', None), ('}', None), ('}', None)]
+        for rozmiar in (1, 3, 1 << 16):
+            self.assertEqual(list(zdarzenia_json(io.StringIO(tekst), rozmiar)), oczekiwane)
+        with self.assertRaises(ValueError):
+            list(zdarzenia_json(io.StringIO('{"a": [1, 2}')))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_TESTOWE, TRASY_KOLEJKA_ZADAN=SYNCHRONICZNIE)
+class ImportTrasTests(APITestCase):
+    """
+    Testy importu tras z plików GPX, GeoJSON i CSV
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_TESTOWE, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='import', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        # 1000 pikseli na stopień, początek układu w (19, 50)
+        self.tlo = ObrazTla.objects.create(nazwa='Mapa', szerokosc=800, wysokosc=600,
+                                           transformacja=[0.001, 0, 19, 0, 0.001, 50])
+
+    def test_import_gpx_przez_api(self):
+        """Test importu GPX w tle - współrzędne geograficzne są przeliczane na piksele"""
+        response = self.client.post(reverse('import-list'), {
+            'plik': SimpleUploadedFile('wycieczka.gpx', GPX), 'obraz_tla': self.tlo.id,
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['format'], 'gpx')
+
+        response = self.client.get(reverse('import-detail', args=[response.data['id']]))
+        self.assertEqual(response.data['status'], ImportTras.ZAKONCZONY)
+        self.assertEqual((response.data['liczba_tras'], response.data['liczba_punktow']), (2, 5))
+        self.assertFalse(ImportTras.objects.get().plik)
+
+        rano, druga = Trasa.objects.filter(uzytkownik=self.user).order_by('id')
+        self.assertEqual((rano.nazwa, rano.opis), ('Rano', 'Spacer'))
+        self.assertEqual(punkty(rano), [(0, 0), (2, 1), (3, 2)])
+        self.assertTrue(druga.nazwa.startswith('wycieczka'))
+        self.assertEqual(punkty(druga), [(10, 0), (20, 0)])
+        # Jedna rewizja na trasę mimo wielu paczek punktów
+        self.assertEqual(ZmianaTrasy.objects.filter(trasa=rano).count(), 1)
+
+    def test_import_bez_przeksztalcenia(self):
+        """Test odrzucenia współrzędnych geograficznych na tle bez przekształcenia"""
+        tlo = ObrazTla.objects.create(nazwa='Bez', szerokosc=800, wysokosc=600)
+        response = self.client.post(reverse('import-list'), {
+            'plik': SimpleUploadedFile('wycieczka.gpx', GPX), 'obraz_tla': tlo.id,
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(reverse('import-list'), {
+            'plik': SimpleUploadedFile('trasy.txt', b'x,y\n1,2\n'), 'obraz_tla': tlo.id,
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('format', response.data)
+
+    def test_niepoprawny_plik_nie_zostawia_tras(self):
+        """Test błędu w środku pliku - import kończy się błędem bez zmian w trasach"""
+        dane = b'trasa_id,x,y\n1,10,10\n1,20,20\n2,30,30\n2,nie,40\n'
+        response = self.client.post(reverse('import-list'), {
+            'plik': SimpleUploadedFile('trasy.csv', dane), 'obraz_tla': self.tlo.id,
+        }, format='multipart')
+        zlecenie = ImportTras.objects.get(id=response.data['id'])
+        self.assertEqual(zlecenie.status, ImportTras.BLAD)
+        self.assertIn('wiersz 5', zlecenie.blad)
+        self.assertFalse(Trasa.objects.exists())
+
+    def test_import_geojson_z_eksportu(self):
+        """Test importu pliku GeoJSON z eksportu - trasy wracają z tymi samymi punktami"""
+        trasa = Trasa.objects.create(nazwa='Źródło', opis='Opis', uzytkownik=self.user, obraz_tla=self.tlo)
+        for i in range(5):
+            trasa.punkty.create(x=i * 7, y=100 - i, kolejnosc=i + 1)
+        plik = io.BytesIO(''.join(eksport_geojson(Trasa.objects.filter(id=trasa.id))).encode())
+
+        postepy = []
+        nowe = importuj_trasy(plik, 'geojson', self.user, self.tlo, postep=lambda *p: postepy.append(p))
+        self.assertEqual(len(nowe), 1)
+        self.assertEqual((nowe[0].nazwa, nowe[0].opis), ('Źródło', 'Opis'))
+        self.assertEqual(punkty(nowe[0]), punkty(trasa))
+        self.assertEqual(postepy, [(1, 5)])
+
+    def test_postep_we_wspolnej_pamieci(self):
+        """Test postępu importu w pamięci z TRASY_PAMIEC_POSTEPU i ostrzeżenia o pamięci jednego procesu"""
+        zlecenie = ImportTras.objects.create(uzytkownik=self.user, obraz_tla=self.tlo, format='gpx')
+        ImportTras.objects.filter(id=zlecenie.id).update(status=ImportTras.W_TOKU)
+        pamiec_postepu().set(klucz_postepu(zlecenie.id), (2, 500))
+        response = self.client.get(reverse('import-detail', args=[zlecenie.id]))
+        self.assertEqual(response.data['postep'], {'trasy': 2, 'punkty': 500})
+        
+        self.assertEqual(sprawdz_pamiec_postepu(None), [])
+        with override_settings(TRASY_KOLEJKA_ZADAN='trasy_app.zadania.KolejkaBazodanowa'):
+            self.assertEqual([b.id for b in sprawdz_pamiec_postepu(None)], ['trasy_app.W001'])
+            pliki = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': MEDIA_TESTOWE}
+            with override_settings(CACHES={'default': pliki}, TRASY_PAMIEC_POSTEPU='default'):
+                self.assertEqual(sprawdz_pamiec_postepu(None), [])
+
+    def test_polecenie_importu_csv(self):
+        """Test polecenia importuj_trasy dla pliku CSV"""
+        sciezka = os.path.join(MEDIA_TESTOWE, 'polecenie.csv')
+        with open(sciezka, 'w') as plik:
+            plik.write('trasa_id,trasa,pozycja,x,y\n7,Pierwsza,1,1,2\n7,Pierwsza,2,3,4\n8,Druga,1,5,6\n')
+        wyjscie = io.StringIO()
+        call_command('importuj_trasy', sciezka, uzytkownik='import', obraz_tla=self.tlo.id, stdout=wyjscie)
+        self.assertIn('Zaimportowano tras: 2', wyjscie.getvalue())
+        pierwsza, druga = Trasa.objects.order_by('id')
+        self.assertEqual((pierwsza.nazwa, punkty(pierwsza)), ('Pierwsza', [(1, 2), (3, 4)]))
+        self.assertEqual((druga.nazwa, punkty(druga)), ('Druga', [(5, 6)]))
+
+        with self.assertRaises(CommandError):
+            call_command('importuj_trasy', sciezka, uzytkownik='nikt', obraz_tla=self.tlo.id, stdout=wyjscie)
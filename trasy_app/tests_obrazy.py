@@ -0,0 +1,186 @@
+import io
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import ExifTags, Image
+from rest_framework.test import APITestCase
+
+from .models import ObrazTla, Trasa, Zadanie
+from .nakladki import MAKS_ROZMIAR
+from .obrazy import MAKS_PIKSELI, ROZMIAR_KAFELKA, ROZMIAR_MINIATURY
+from .services import dodaj_punkty
+from .zadania import KolejkaBazodanowa
+
+MEDIA_TESTOWE = tempfile.mkdtemp()
+SYNCHRONICZNIE = 'trasy_app.zadania.KolejkaSynchroniczna'
+
+
+def plik_obrazu(szerokosc, wysokosc, nazwa='mapa.png', format='PNG', **opcje):
+    bufor = io.BytesIO()
+    Image.new('RGB', (szerokosc, wysokosc), 'white').save(bufor, format, **opcje)
+    return SimpleUploadedFile(nazwa, bufor.getvalue())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_TESTOWE, TRASY_KOLEJKA_ZADAN=SYNCHRONICZNIE)
+class PodgladyObrazowTlaTests(TestCase):
+    """
+    Testy miniatur i piramidy kafelków obrazów tła
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_TESTOWE, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='kafelki', password='testpassword123')
+        self.client.login(username='kafelki', password='testpassword123')
+        self.tlo = ObrazTla.objects.create(nazwa='Mapa', obraz=plik_obrazu(700, 300))
+
+    def test_generowanie_podgladow(self):
+        """Test miniatury i kafelków tworzonych po wgraniu obrazu"""
+        self.tlo.refresh_from_db()
+        self.assertEqual(self.tlo.status, ObrazTla.GOTOWY)
+        self.assertEqual((self.tlo.szerokosc, self.tlo.wysokosc), (700, 300))
+        with self.tlo.miniatura.open('rb') as plik, Image.open(plik) as miniatura:
+            self.assertEqual(miniatura.size, (ROZMIAR_MINIATURY, 129))
+
+        # Najwyższy poziom (10, bo 2^10 >= 700) ma 3x2 kafelki, ostatni w rzędzie jest przycięty
+        response = self.client.get(reverse('tlo_kafelek', args=[self.tlo.id, 10, 2, 1]))
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as kafelek:
+            self.assertEqual(kafelek.size, (700 - 2 * ROZMIAR_KAFELKA, 300 - ROZMIAR_KAFELKA))
+        self.assertEqual(self.client.get(reverse('tlo_kafelek', args=[self.tlo.id, 10, 3, 0])).status_code, 404)
+
+        response = self.client.get(reverse('tlo_kafelek', args=[self.tlo.id, 0, 0, 0]))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(reverse('tlo_dzi', args=[self.tlo.id]))
+        self.assertContains(response, '<Size Width="700" Height="300"/>')
+
+    def test_lista_tel_uzywa_miniatur(self):
+        """Test listy obrazów tła - zamiast oryginałów pobierane są miniatury"""
+        response = self.client.get(reverse('tlo_list'))
+        self.assertContains(response, reverse('tlo_miniatura', args=[self.tlo.id]))
+        self.assertNotContains(response, self.tlo.obraz.url)
+
+        response = self.client.get(reverse('tlo_miniatura', args=[self.tlo.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_niepoprawny_plik(self):
+        """Test pliku, który nie jest obrazem - bez podglądów, bez błędu zapisu"""
+        tlo = ObrazTla.objects.create(
+            nazwa='Zepsute', obraz=SimpleUploadedFile('zepsute.jpg', b'file_content', content_type='image/jpeg')
+        )
+        tlo.refresh_from_db()
+        self.assertEqual(tlo.status, ObrazTla.BLAD)
+        self.assertEqual(self.client.get(reverse('tlo_dzi', args=[tlo.id])).status_code, 404)
+    
+    def test_orientacja_i_format(self):
+        """Test obrotu według EXIF i zamiany formatu nieobsługiwanego przez przeglądarki"""
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        obrocone = ObrazTla.objects.create(nazwa='Zdjęcie', obraz=plik_obrazu(400, 200, 'foto.jpg', 'JPEG', exif=exif))
+        tiff = ObrazTla.objects.create(nazwa='Skan', obraz=plik_obrazu(300, 100, 'skan.tif', 'TIFF'))
+        
+        obrocone.refresh_from_db()
+        self.assertEqual((obrocone.szerokosc, obrocone.wysokosc), (200, 400))
+        tiff.refresh_from_db()
+        self.assertTrue(tiff.obraz.name.endswith('.jpg'))
+        with tiff.obraz.open('rb') as plik, Image.open(plik) as obraz:
+            self.assertEqual((obraz.format, obraz.size), ('JPEG', (300, 100)))
+    
+    @override_settings(TRASY_KOLEJKA_ZADAN='trasy_app.zadania.KolejkaBazodanowa')
+    def test_kolejka_bazodanowa(self):
+        """Test przetwarzania w tle przez kolejkę w bazie - wymiary znane od razu z nagłówka"""
+        tlo = ObrazTla.objects.create(nazwa='W tle', obraz=plik_obrazu(640, 480))
+        self.assertEqual((tlo.szerokosc, tlo.wysokosc, tlo.status), (640, 480, ObrazTla.OCZEKUJE))
+        self.assertEqual(Zadanie.objects.get().status, Zadanie.OCZEKUJE)
+        
+        self.assertEqual(KolejkaBazodanowa().wykonaj_oczekujace(), 1)
+        tlo.refresh_from_db()
+        self.assertEqual(tlo.status, ObrazTla.GOTOWY)
+        self.assertEqual(Zadanie.objects.get().status, Zadanie.ZAKONCZONE)
+    
+    @override_settings(TRASY_KOLEJKA_ZADAN='trasy_app.zadania.KolejkaBazodanowa')
+    def test_nieoczekiwany_blad(self):
+        """Test błędu innego niż błąd pliku - obraz nie zostaje w stanie przetwarzania"""
+        tlo = ObrazTla.objects.create(nazwa='W tle', obraz=plik_obrazu(640, 480))
+        with mock.patch('trasy_app.obrazy.generuj_podglady', side_effect=MemoryError):
+            self.assertEqual(KolejkaBazodanowa().wykonaj_oczekujace(), 1)
+        tlo.refresh_from_db()
+        self.assertEqual(tlo.status, ObrazTla.BLAD)
+        self.assertEqual(Zadanie.objects.get().status, Zadanie.BLAD)
+    
+    def test_limit_pikseli(self):
+        """Test limitu pikseli obrazów tła - dotyczy ich otwierania, a nie całego procesu"""
+        domyslny = Image.MAX_IMAGE_PIXELS
+        with mock.patch('trasy_app.obrazy.MAKS_PIKSELI', 1000):
+            tlo = ObrazTla.objects.create(nazwa='Za duże', obraz=plik_obrazu(700, 300))
+        tlo.refresh_from_db()
+        self.assertEqual(tlo.status, ObrazTla.BLAD)
+        self.assertEqual(Image.MAX_IMAGE_PIXELS, domyslny)
+        self.assertLess(domyslny, MAKS_PIKSELI)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_TESTOWE, TRASY_KOLEJKA_ZADAN=SYNCHRONICZNIE)
+class PodgladTrasyTests(APITestCase):
+    """
+    Testy podglądu trasy rysowanej na tle
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='podglad', password='testpassword123')
+        self.client.force_authenticate(self.user)
+        self.tlo = ObrazTla.objects.create(nazwa='Mapa', obraz=plik_obrazu(700, 300))
+        self.trasa = Trasa.objects.create(nazwa='Podgląd', uzytkownik=self.user, obraz_tla=self.tlo)
+        dodaj_punkty(self.trasa, [(100, 150), (300, 150)])
+        self.url = reverse('trasa-podglad', args=[self.trasa.id])
+
+    def obraz(self, response):
+        return Image.open(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_podglad_calego_tla(self):
+        """Test podglądu w zadanym rozmiarze - trasa narysowana na czerwono"""
+        response = self.client.get(self.url, {'width': 350})
+        self.assertEqual(response['Content-Type'], 'image/png')
+        with self.obraz(response) as obraz:
+            self.assertEqual(obraz.size, (350, 150))
+            self.assertEqual(obraz.convert('RGB').getpixel((100, 75)), (255, 0, 0))
+
+    def test_podglad_przyciety_i_zapisany(self):
+        """Test podglądu przyciętego do trasy - kolejne żądanie czyta plik, zmiana trasy go wymienia"""
+        response = self.client.get(self.url, {'width': 100, 'crop': 'bbox', 'format': 'webp'})
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        with self.obraz(response) as obraz:
+            # Trasa 200x0 z marginesem 16 px z każdej strony to obszar 232x32
+            self.assertEqual(obraz.size, (100, 14))
+
+        katalog = f'podglady/{self.trasa.id}'
+        pliki = default_storage.listdir(katalog)[1]
+        self.client.get(self.url, {'width': 100, 'crop': 'bbox', 'format': 'webp'})
+        self.assertEqual(default_storage.listdir(katalog)[1], pliki)
+
+        dodaj_punkty(self.trasa, [(300, 250)])
+        self.client.get(self.url, {'width': 100, 'crop': 'bbox', 'format': 'webp'})
+        nowe = default_storage.listdir(katalog)[1]
+        self.assertEqual(len(nowe), 1)
+        self.assertNotEqual(nowe, pliki)
+
+    def test_podglad_wysokiego_tla(self):
+        """Test limitu rozmiaru podglądu także dla wymiaru wyliczonego z proporcji tła"""
+        tlo = ObrazTla.objects.create(nazwa='Wąskie', szerokosc=100, wysokosc=2000)
+        trasa = Trasa.objects.create(nazwa='Wąska', uzytkownik=self.user, obraz_tla=tlo)
+        response = self.client.get(reverse('trasa-podglad', args=[trasa.id]), {'width': MAKS_ROZMIAR})
+        with self.obraz(response) as obraz:
+            self.assertEqual(obraz.size, (205, MAKS_ROZMIAR))
+
+    def test_podglad_niepoprawny_rozmiar(self):
+        response = self.client.get(self.url, {'width': 0})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+
+from .kanaly import KanalBazodanowy
+from .models import ObrazTla, Trasa, PunktTrasy
+from .services import KROK_KOLEJNOSCI, dodaj_punkt, dodaj_punkty
+
+
+class AppendConcurrencyTests(TransactionTestCase):
+    """
+    Testy równoległego dopisywania punktów do jednej trasy z wielu wątków
+    """
+    
+    WATKI = 8
+    PUNKTY_NA_WATEK = 50
+    
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Baza SQLite w pamięci nie obsługuje równoległych połączeń')
+        self.user = User.objects.create_user(username='stressuser', password='stresspass')
+        self.obraz_tla = ObrazTla.objects.create(nazwa='Stress Test Tło', szerokosc=800, wysokosc=600)
+        self.trasa = Trasa.objects.create(nazwa='Stress Test Trasa', uzytkownik=self.user, obraz_tla=self.obraz_tla)
+    
+    def _uruchom_watki(self, praca):
+        bledy = []
+        start = threading.Barrier(self.WATKI)
+        
+        def watek(numer):
+            try:
+                start.wait()
+                praca(numer)
+            except Exception as e:
+                bledy.append(e)
+            finally:
+                connection.close()
+        
+        watki = [threading.Thread(target=watek, args=(i,)) for i in range(self.WATKI)]
+        for w in watki:
+            w.start()
+        for w in watki:
+            w.join()
+        self.assertEqual(bledy, [])
+    
+    def test_concurrent_appends_have_unique_order(self):
+        """Test braku zdublowanej kolejności przy równoległym dopisywaniu pojedynczych punktów"""
+        def praca(numer):
+            for i in range(self.PUNKTY_NA_WATEK):
+                dodaj_punkt(PunktTrasy(trasa_id=self.trasa.id, x=numer, y=i))
+        
+        self._uruchom_watki(praca)
+        
+        kolejnosci = list(PunktTrasy.objects.filter(trasa=self.trasa).values_list('kolejnosc', flat=True))
+        self.assertEqual(len(kolejnosci), self.WATKI * self.PUNKTY_NA_WATEK)
+        self.assertEqual(kolejnosci, list(range(KROK_KOLEJNOSCI, (len(kolejnosci) + 1) * KROK_KOLEJNOSCI, KROK_KOLEJNOSCI)))
+    
+    def test_concurrent_bulk_appends_stay_contiguous(self):
+        """Test, że paczki punktów dopisywane równolegle nie przeplatają się"""
+        def praca(numer):
+            for _ in range(5):
+                dodaj_punkty(self.trasa, [(numer, i) for i in range(20)])
+        
+        self._uruchom_watki(praca)
+        
+        xs = list(PunktTrasy.objects.filter(trasa=self.trasa).values_list('x', flat=True))
+        self.assertEqual(len(xs), self.WATKI * 5 * 20)
+        # Każda paczka zajmuje ciągły fragment trasy
+        for i in range(0, len(xs), 20):
+            self.assertEqual(len(set(xs[i:i + 20])), 1)
+    
+    def test_concurrent_appends_with_tuned_sqlite(self):
+        """Test dopisywania z wielu wątków w trybie SQLite z dziennikiem WAL (TRASY_SQLITE_PRAGMY)"""
+        if connection.vendor != 'sqlite':
+            self.skipTest('Pragmy dotyczą tylko SQLite')
+        pragmy = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000, 'mmap_size': 1 << 26}
+        tryby = []
+        
+        def praca(numer):
+            for i in range(self.PUNKTY_NA_WATEK):
+                dodaj_punkt(PunktTrasy(trasa_id=self.trasa.id, x=numer, y=i))
+            # Każdy wątek ma własne połączenie - pragmy ustawia odbiornik connection_created
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                tryby.append(cursor.fetchone()[0])
+        
+        try:
+            with override_settings(TRASY_SQLITE_PRAGMY=pragmy):
+                self._uruchom_watki(praca)
+        finally:
+            # Tryb dziennika zostaje zapisany w pliku bazy - przywracamy domyślny dla pozostałych testów
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode = DELETE')
+        
+        self.assertEqual(tryby, ['wal'] * self.WATKI)
+        kolejnosci = list(PunktTrasy.objects.filter(trasa=self.trasa).values_list('kolejnosc', flat=True))
+        liczba = self.WATKI * self.PUNKTY_NA_WATEK
+        self.assertEqual(kolejnosci, list(range(KROK_KOLEJNOSCI, (liczba + 1) * KROK_KOLEJNOSCI, KROK_KOLEJNOSCI)))
+
+
+class ChangeChannelTests(TransactionTestCase):
+    """
+    Testy kanału zmian tras odczytującego rewizje zapisane przez inne procesy
+    """
+    
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Baza SQLite w pamięci nie obsługuje równoległych połączeń')
+        self.user = User.objects.create_user(username='channeluser', password='channelpass')
+        self.obraz_tla = ObrazTla.objects.create(nazwa='Channel Test Tło', szerokosc=800, wysokosc=600)
+        self.trasa = Trasa.objects.create(nazwa='Channel Test Trasa', uzytkownik=self.user, obraz_tla=self.obraz_tla)
+    
+    def test_database_channel_shares_one_poller(self):
+        """Test kanału bazodanowego - jeden wątek odpytujący bazę dla wszystkich subskrybentów procesu"""
+        kanal = KanalBazodanowy()
+        kanal.interwal = 0.05
+        inna = Trasa.objects.create(nazwa='Channel Test Inna', uzytkownik=self.user, obraz_tla=self.obraz_tla)
+        
+        def zapis_w_innym_procesie():
+            # Nowa rewizja bez publikacji w kanale tego procesu
+            Trasa.objects.filter(id=self.trasa.id).update(rewizja=7)
+            connection.close()
+        
+        async def subskrybenci():
+            with kanal.subskrybuj(self.trasa.id) as pierwsza, kanal.subskrybuj(inna.id), \
+                    kanal.subskrybuj(self.trasa.id) as druga:
+                watek = kanal._watek
+                threading.Thread(target=zapis_w_innym_procesie).start()
+                wyniki = await asyncio.gather(pierwsza.czekaj(0, 5), druga.czekaj(0, 5))
+                self.assertIs(kanal._watek, watek)
+                return wyniki
+        
+        self.assertEqual(asyncio.run(subskrybenci()), [7, 7])
+        # Bez subskrybentów wątek kończy pracę
+        for _ in range(100):
+            if kanal._watek is None:
+                break
+            time.sleep(0.01)
+        self.assertIsNone(kanal._watek)
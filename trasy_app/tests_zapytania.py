@@ -0,0 +1,121 @@
+import io
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .models import GeometriaTrasy, ObrazTla, Trasa, PunktTrasy
+from .rewizje import zmiany_od
+from .services import KROK_KOLEJNOSCI, dodaj_punkt
+
+MEDIA_TESTOWE = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_TESTOWE)
+class ListingQueryCountTests(TestCase):
+    """
+    Testy regresji liczby zapytań - listy nie mogą wykonywać zapytań na każdy wiersz
+    """
+    
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_TESTOWE, ignore_errors=True)
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='queryuser', password='querypass')
+        self.client.force_login(self.user)
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+        self.trasa = self._dodaj_trase()
+    
+    def _dodaj_trase(self):
+        obraz_tla = ObrazTla.objects.create(
+            nazwa='Query Test Tło',
+            szerokosc=800,
+            wysokosc=600,
+            obraz=SimpleUploadedFile("query_background.jpg", b"file_content", content_type="image/jpeg")
+        )
+        trasa = Trasa.objects.create(nazwa='Query Test Trasa', uzytkownik=self.user, obraz_tla=obraz_tla)
+        PunktTrasy.objects.bulk_create(
+            PunktTrasy(trasa=trasa, x=i, y=i, kolejnosc=i) for i in range(1, 4)
+        )
+        return trasa
+    
+    def _liczba_zapytan(self, klient, url):
+        with CaptureQueriesContext(connection) as zapytania:
+            response = klient.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(zapytania)
+    
+    def assertQueryCountConstant(self, klient, url, dodaj_wiersze):
+        """Liczba zapytań dla jednego wiersza i dla wielu wierszy musi być taka sama"""
+        przed = self._liczba_zapytan(klient, url)
+        for _ in range(5):
+            dodaj_wiersze()
+        po = self._liczba_zapytan(klient, url)
+        self.assertEqual(przed, po, f'Liczba zapytań {url} rośnie z liczbą wierszy: {przed} -> {po}')
+    
+    def test_user_trasy_page(self):
+        self.assertQueryCountConstant(self.client, reverse('user_trasy'), self._dodaj_trase)
+    
+    def test_tlo_list_page(self):
+        self.assertQueryCountConstant(self.client, reverse('tlo_list'), self._dodaj_trase)
+    
+    def test_api_trasy_list(self):
+        self.assertQueryCountConstant(self.api_client, reverse('trasa-list'), self._dodaj_trase)
+    
+    def test_api_obrazy_tla_list(self):
+        self.assertQueryCountConstant(self.api_client, reverse('obraztla-list'), self._dodaj_trase)
+    
+    def test_api_punkty_list(self):
+        url = reverse('punkty-list', kwargs={'trasa_id': self.trasa.id})
+        self.assertQueryCountConstant(
+            self.api_client, url,
+            lambda: PunktTrasy.objects.create(trasa=self.trasa, x=0, y=0, kolejnosc=self.trasa.punkty.count() + 1)
+        )
+    
+    def test_get_punkty(self):
+        url = reverse('get_punkty', args=[self.trasa.id])
+        self.assertQueryCountConstant(
+            self.client, url,
+            lambda: PunktTrasy.objects.create(trasa=self.trasa, x=0, y=0, kolejnosc=self.trasa.punkty.count() + 1)
+        )
+    
+    def test_dodaj_punkt(self):
+        """Dopisanie punktu to jeden UPDATE trasy (licznik, metryki i rewizja) i kilka zapytań w sumie"""
+        przed = Trasa.objects.get(id=self.trasa.id)
+        with CaptureQueriesContext(connection) as zapytania:
+            punkt = dodaj_punkt(PunktTrasy(trasa=self.trasa, x=6, y=7))
+        instrukcje = [z['sql'] for z in zapytania.captured_queries if not z['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(instrukcje), 5)
+        self.assertEqual(len([sql for sql in instrukcje if sql.startswith('UPDATE "trasy_app_trasa"')]), 1)
+        
+        po = Trasa.objects.get(id=self.trasa.id)
+        # Punkty trasy mają klucze 1-3, ostatni z nich to (3, 3)
+        self.assertEqual(punkt.kolejnosc, 3 + KROK_KOLEJNOSCI)
+        self.assertEqual((po.liczba_punktow, po.rewizja, po.max_x, po.max_y),
+                         (przed.liczba_punktow + 1, przed.rewizja + 1, 6, 7))
+        self.assertAlmostEqual(po.dlugosc, przed.dlugosc + 5.0)
+        self.assertEqual(zmiany_od(self.trasa.id, przed.rewizja)[1],
+                         [{'operacja': 'dodanie', 'id': punkt.id, 'x': 6, 'y': 7, 'kolejnosc': punkt.kolejnosc}])
+    
+    def test_dodaj_punkt_do_spakowanej_trasy(self):
+        """Dopisanie do spakowanej trasy przywraca wiersze i liczy odcinek od ostatniego punktu"""
+        call_command('spakuj_trasy', self.trasa.id, stdout=io.StringIO())
+        przed = Trasa.objects.get(id=self.trasa.id)
+        punkt = dodaj_punkt(PunktTrasy(trasa=self.trasa, x=6, y=7))
+        
+        po = Trasa.objects.get(id=self.trasa.id)
+        self.assertFalse(GeometriaTrasy.objects.filter(trasa=self.trasa).exists())
+        self.assertEqual(punkt.kolejnosc, 3 + KROK_KOLEJNOSCI)
+        self.assertEqual(PunktTrasy.objects.filter(trasa=self.trasa).count(), 4)
+        self.assertEqual(po.liczba_punktow, przed.liczba_punktow + 1)
+        self.assertAlmostEqual(po.dlugosc, przed.dlugosc + 5.0)
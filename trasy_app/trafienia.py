@@ -0,0 +1,176 @@
+"""
+Trafianie kliknięciem w trasę w edytorze: najbliższy punkt i najbliższy odcinek.
+
+Odcinki trasy są rozłożone na siatkę kwadratowych komórek - każdy odcinek jest wpisany do
+komórek, przez które przechodzi jego prostokąt otaczający. Bok komórki zależy od typowej
+długości odcinka, więc zwykle odcinek zajmuje kilka komórek. Nieliczne bardzo długie
+odcinki są sprawdzane przy każdym zapytaniu. Numery komórek jednej kolumny siatki tworzą
+ciągły zakres posortowanej tablicy (jak w siatka.py), więc zapytanie o otoczenie kliknięcia
+to kilka wyszukiwań binarnych zamiast przeglądania wszystkich punktów.
+
+Indeks zależy tylko od punktów trasy i jest trzymany w pamięci podręcznej dla jej rewizji.
+"""
+import math
+
+import numpy as np
+from django.core.cache import cache
+
+from .services import tablica_punktow
+
+# Czas przechowywania indeksu w pamięci podręcznej (sekundy) - klucz zawiera rewizję trasy
+CZAS_PAMIECI_TRAFIEN = 60 * 60
+MIN_BOK = 4.0
+# Odcinki zajmujące więcej komórek są sprawdzane przy każdym zapytaniu
+MAKS_KOMOREK_ODCINKA = 16
+# Zapytania obejmujące więcej komórek sprawdzają wszystkie odcinki
+MAKS_KOMOREK_ZAPYTANIA = 1024
+PRZESUNIECIE = 2 ** 30
+WIERSZE = 2 ** 31
+DOMYSLNY_PROMIEN = 10
+MAKS_PROMIEN = 1000
+
+
+def _klucz(kolumna, wiersz):
+    return (kolumna + PRZESUNIECIE) * WIERSZE + (wiersz + PRZESUNIECIE)
+
+
+class IndeksTrafien:
+    """
+    Siatka odcinków trasy zbudowana z tablicy punktów (id, x, y, kolejnosc) w kolejności trasy
+    """
+    def __init__(self, tablica):
+        self.punkty = tablica
+        self.xy = tablica[:, 1:3].astype(np.float64)
+        self.bok = MIN_BOK
+        self.klucze = np.empty(0, dtype=np.int64)
+        self.odcinki = np.empty(0, dtype=np.int64)
+        self.dlugie = np.empty(0, dtype=np.int64)
+        if len(self.xy) < 2:
+            return
+
+        a, b = self.xy[:-1], self.xy[1:]
+        self.bok = max(MIN_BOK, 2 * float(np.median(np.hypot(*(b - a).T))))
+        poczatek = np.floor(np.minimum(a, b) / self.bok).astype(np.int64)
+        koniec = np.floor(np.maximum(a, b) / self.bok).astype(np.int64)
+        rozmiar = koniec - poczatek + 1
+        liczba = rozmiar[:, 0] * rozmiar[:, 1]
+
+        krotkie = np.flatnonzero(liczba <= MAKS_KOMOREK_ODCINKA)
+        self.dlugie = np.flatnonzero(liczba > MAKS_KOMOREK_ODCINKA)
+        # Jeden wiersz na parę (odcinek, komórka); k to numer komórki w prostokącie odcinka
+        powtorzenia = liczba[krotkie]
+        odcinki = np.repeat(krotkie, powtorzenia)
+        k = np.arange(len(odcinki)) - np.repeat(np.cumsum(powtorzenia) - powtorzenia, powtorzenia)
+        szerokosc = rozmiar[odcinki, 0]
+        klucze = _klucz(poczatek[odcinki, 0] + k % szerokosc, poczatek[odcinki, 1] + k // szerokosc)
+
+        porzadek = np.argsort(klucze, kind='stable')
+        self.klucze = klucze[porzadek]
+        self.odcinki = odcinki[porzadek]
+
+    def kandydaci(self, x, y, promien):
+        """
+        Numery odcinków (odcinek i łączy punkty i oraz i + 1), które mogą leżeć w promieniu od (x, y)
+        """
+        kolumna0, kolumna1 = math.floor((x - promien) / self.bok), math.floor((x + promien) / self.bok)
+        wiersz0, wiersz1 = math.floor((y - promien) / self.bok), math.floor((y + promien) / self.bok)
+        if (kolumna1 - kolumna0 + 1) * (wiersz1 - wiersz0 + 1) > MAKS_KOMOREK_ZAPYTANIA:
+            return np.arange(len(self.xy) - 1)
+
+        czesci = [self.dlugie]
+        for kolumna in range(kolumna0, kolumna1 + 1):
+            od = np.searchsorted(self.klucze, _klucz(kolumna, wiersz0), side='left')
+            do = np.searchsorted(self.klucze, _klucz(kolumna, wiersz1), side='right')
+            czesci.append(self.odcinki[od:do])
+        return np.unique(np.concatenate(czesci))
+
+    def szukaj(self, x, y, promien):
+        """
+        Najbliższy punkt i najbliższy odcinek trasy w promieniu od (x, y).
+        Zwraca parę (punkt, odcinek): punkt to (indeks, odleglosc), odcinek to
+        (indeks, rzut_x, rzut_y, odleglosc); brak trafienia to None.
+        """
+        if len(self.xy) == 0:
+            return None, None
+        klik = np.array([x, y], dtype=np.float64)
+        odcinki = self.kandydaci(x, y, promien)
+        # Punkt w promieniu należy do odcinka-kandydata; trasa z jednym punktem nie ma odcinków
+        wierzcholki = np.unique(np.concatenate([odcinki, odcinki + 1])) if len(odcinki) else np.arange(1)
+
+        punkt = None
+        odleglosci = np.hypot(*(self.xy[wierzcholki] - klik).T)
+        i = int(np.argmin(odleglosci))
+        if odleglosci[i] <= promien:
+            punkt = (int(wierzcholki[i]), float(odleglosci[i]))
+
+        odcinek = None
+        if len(odcinki):
+            a, b = self.xy[odcinki], self.xy[odcinki + 1]
+            ab = b - a
+            dlugosc2 = (ab * ab).sum(axis=1)
+            t = np.clip(((klik - a) * ab).sum(axis=1) / np.where(dlugosc2 > 0, dlugosc2, 1), 0.0, 1.0)
+            rzuty = a + t[:, None] * ab
+            odleglosci = np.hypot(*(rzuty - klik).T)
+            j = int(np.argmin(odleglosci))
+            if odleglosci[j] <= promien:
+                odcinek = (int(odcinki[j]), float(rzuty[j, 0]), float(rzuty[j, 1]), float(odleglosci[j]))
+        return punkt, odcinek
+
+
+def indeks_trafien(trasa_id, rewizja):
+    """
+    Indeks trafień trasy - z pamięci podręcznej
+    """
+    klucz = f'trasy:trafienia:{trasa_id}:{rewizja}'
+    indeks = cache.get(klucz)
+    if indeks is None:
+        indeks = IndeksTrafien(tablica_punktow(trasa_id))
+        cache.set(klucz, indeks, CZAS_PAMIECI_TRAFIEN)
+    return indeks
+
+
+def parametry_trafienia(parametry):
+    """
+    Odczytuje (x, y, promien) z parametrów zapytania ?x=, ?y= i ?radius=.
+    Niepoprawne wartości zgłaszają ValueError.
+    """
+    try:
+        x, y = float(parametry['x']), float(parametry['y'])
+    except (KeyError, ValueError):
+        raise ValueError('Podaj współrzędne kliknięcia w parametrach x i y.')
+    if not (math.isfinite(x) and math.isfinite(y)):
+        raise ValueError('Podaj współrzędne kliknięcia w parametrach x i y.')
+
+    promien = parametry.get('radius')
+    if promien is None:
+        return x, y, DOMYSLNY_PROMIEN
+    try:
+        promien = float(promien)
+    except ValueError:
+        raise ValueError('Parametr radius musi być liczbą.')
+    if not 0 <= promien <= MAKS_PROMIEN:
+        raise ValueError(f'Parametr radius musi być liczbą od 0 do {MAKS_PROMIEN}.')
+    return x, y, promien
+
+
+def najblizsze_trafienie(trasa_id, rewizja, x, y, promien):
+    """
+    Punkt i odcinek trasy najbliższe kliknięciu (x, y) w promieniu, jako słowniki dla API.
+    Pozycja odcinka (od 1) to miejsce, w które trzeba wstawić punkt, żeby leżał na tym odcinku.
+    """
+    indeks = indeks_trafien(trasa_id, rewizja)
+    punkt, odcinek = indeks.szukaj(x, y, promien)
+
+    wynik = {'rewizja': rewizja, 'punkt': None, 'odcinek': None}
+    if punkt is not None:
+        i, odleglosc = punkt
+        id_punktu, px, py, kolejnosc = indeks.punkty[i].tolist()
+        wynik['punkt'] = {'id': id_punktu, 'x': px, 'y': py, 'kolejnosc': kolejnosc,
+                          'pozycja': i + 1, 'odleglosc': odleglosc}
+    if odcinek is not None:
+        i, rx, ry, odleglosc = odcinek
+        wynik['odcinek'] = {
+            'od': int(indeks.punkty[i, 0]), 'do': int(indeks.punkty[i + 1, 0]),
+            'pozycja': i + 2, 'x': round(rx), 'y': round(ry), 'odleglosc': odleglosc,
+        }
+    return wynik
@@ -1,24 +1,28 @@
 from django.urls import path, include
 from django.contrib.auth import views as auth_views
-from . import views
+from . import views, async_views
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken.views import obtain_auth_token
-from .api_views import ObrazTlaViewSet, TrasaViewSet, PunktTrasyViewSet
+from .api_views import ObrazTlaViewSet, TrasaViewSet, PunktTrasyViewSet, ImportTrasViewSet, pamiec_statystyki
 
 router = DefaultRouter()
 router.register(r'obrazy-tla', ObrazTlaViewSet)
 router.register(r'trasy', TrasaViewSet, basename='trasa')
+router.register(r'importy', ImportTrasViewSet, basename='import')
 
 api_urlpatterns = [
     path('', include(router.urls)),
     path('token-auth/', obtain_auth_token, name='api_token_auth'),
+    path('pamiec/', pamiec_statystyki, name='pamiec-statystyki'),
     path('trasy/<int:trasa_id>/punkty/', PunktTrasyViewSet.as_view({'get': 'list', 'post': 'create'}), name='punkty-list'),
+    path('trasy/<int:trasa_id>/punkty/bulk/', PunktTrasyViewSet.as_view({'post': 'bulk_create'}), name='punkty-bulk'),
     path('trasy/<int:trasa_id>/punkty/<int:pk>/', PunktTrasyViewSet.as_view({
         'get': 'retrieve', 
         'put': 'update', 
         'patch': 'partial_update', 
         'delete': 'destroy'
     }), name='punkt-detail'),
+    path('trasy/<int:trasa_id>/punkty/<int:pk>/move-to/', PunktTrasyViewSet.as_view({'post': 'move_to'}), name='punkt-move-to'),
 ]
 
 urlpatterns = [
@@ -27,6 +31,9 @@ urlpatterns = [
     path('login/', auth_views.LoginView.as_view(template_name='trasy_app/login.html'), name='login'),
     path('logout/', auth_views.LogoutView.as_view(template_name='trasy_app/logout.html'), name='logout'),
     path('tla/', views.tlo_list, name='tlo_list'),
+    path('tla/<int:tlo_id>/miniatura/', views.tlo_miniatura, name='tlo_miniatura'),
+    path('tla/<int:tlo_id>/kafelki.dzi', views.tlo_dzi, name='tlo_dzi'),
+    path('tla/<int:tlo_id>/kafelki_files/<int:poziom>/<int:kolumna>_<int:wiersz>.jpg', views.tlo_kafelek, name='tlo_kafelek'),
     path('trasa/create/<int:tlo_id>/', views.trasa_create, name='trasa_create'),
     path('trasa/edit/<int:trasa_id>/', views.trasa_edit, name='trasa_edit'),
     path('punkt/delete/<int:punkt_id>/', views.punkt_delete, name='punkt_delete'),
@@ -34,6 +41,14 @@ urlpatterns = [
     path('trasa/<int:trasa_id>/add-point-click/', views.add_point_click, name='add_point_click'),
     path('punkt/move/<int:punkt_id>/<str:kierunek>/', views.punkt_move, name='punkt_move'),
     path('trasa/<int:trasa_id>/punkty/', views.get_punkty, name='get_punkty'),
+    path('trasa/<int:trasa_id>/zmiany/', views.trasa_zmiany, name='trasa_zmiany'),
+    path('trasa/<int:trasa_id>/strumien/', views.trasa_strumien, name='trasa_strumien'),
+    
+    # Odczyty w wersji asynchronicznej - pod ASGI nie zajmują wątku na czas przesyłania (async_views.py)
+    path('async/trasa/<int:trasa_id>/punkty/', async_views.punkty_trasy, name='get_punkty_async'),
+    path('async/trasy/', async_views.lista_tras, name='trasy_async'),
+    path('async/trasy/eksport/', async_views.eksport_tras, name='eksport_async'),
+    path('async/trasy/<int:trasa_id>/', async_views.szczegoly_trasy, name='trasa_async'),
     
     # API URL-e
     path('api/', include(api_urlpatterns)),
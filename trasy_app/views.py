@@ -1,9 +1,55 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, FileResponse, Http404, StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from .models import ObrazTla, Trasa, PunktTrasy
 from .forms import UserRegisterForm, TrasaForm, PunktTrasyForm
+from .kodowanie import TYP_SPAKOWANY, KOLUMNY, spakuj_punkty, akceptuje_spakowane
+from .magazyn import geometrie_tras, rozpakuj_trase
+from .services import dodaj_punkt, tablica_punktow, usun_punkt, zamien_z_sasiadem
+from .rewizje import zmiany_od
+from .geometria import parametry_uproszczenia, punkty_uproszczone
+from .kanaly import strumien_zmian
+from .obrazy import opis_dzi, sciezka_kafelka
+from .warunkowe import odpowiedz_dla_trasy
+
+def odpowiedz_punktami(request, trasa_id, tolerancja=None, max_punktow=None):
+    """
+    Odpowiedź z aktualną listą punktów trasy - JSON albo spakowany format binarny,
+    jeśli klient poprosił o niego nagłówkiem Accept. Podanie tolerancji lub limitu
+    punktów zwraca trasę uproszczoną (patrz geometria.py).
+    """
+    # Rewizję czytamy przed punktami - klient może dostać punkty nowsze niż rewizja,
+    # ale nigdy starsze, więc późniejsze pobranie zmian niczego nie zgubi
+    rewizja = Trasa.objects.filter(id=trasa_id).values_list('rewizja', flat=True).get()
+    if tolerancja is None and max_punktow is None:
+        tablica = tablica_punktow(trasa_id)
+    else:
+        tablica = punkty_uproszczone(trasa_id, rewizja, tolerancja, max_punktow)
+    if akceptuje_spakowane(request):
+        response = HttpResponse(spakuj_punkty(tablica), content_type=TYP_SPAKOWANY)
+        response['X-Trasa-Rewizja'] = rewizja
+    else:
+        data = [dict(zip(KOLUMNY, wiersz)) for wiersz in tablica.tolist()]
+        response = JsonResponse({'success': True, 'rewizja': rewizja, 'punkty': data})
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+def odpowiedz_zmianami(request, trasa_id):
+    """
+    Odpowiedź po edycji trasy - tylko punkty zmienione od rewizji podanej przez klienta
+    w parametrze 'rewizja'. Bez parametru (lub gdy nie da się odtworzyć zmian) zwraca pełną listę.
+    """
+    od_rewizji = request.GET.get('rewizja', request.POST.get('rewizja', ''))
+    if not od_rewizji.isdigit():
+        return odpowiedz_punktami(request, trasa_id)
+    
+    rewizja, zmiany = zmiany_od(trasa_id, int(od_rewizji))
+    if zmiany is None:
+        return odpowiedz_punktami(request, trasa_id)
+    return JsonResponse({'success': True, 'rewizja': rewizja, 'zmiany': zmiany})
 
 def home(request):
     return render(request, 'trasy_app/home.html')
@@ -48,23 +94,17 @@ def trasa_create(request, tlo_id):
 @login_required
 def trasa_edit(request, trasa_id):
     trasa = get_object_or_404(Trasa, id=trasa_id, uzytkownik=request.user)
-    punkty = trasa.punkty.all().order_by('kolejnosc')
     
     # Formularz do dodawania nowych punktów
     if request.method == 'POST':
+        # Dodanie punktu działa na wierszach - spakowana trasa wraca do nich (magazyn.py)
+        rozpakuj_trase(trasa.id)
         form = PunktTrasyForm(request.POST, trasa=trasa)
         if form.is_valid():
             form.save()
             # AJAX
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                punkty = trasa.punkty.all().order_by('kolejnosc')
-                data = [{
-                    'id': p.id,
-                    'x': p.x,
-                    'y': p.y,
-                    'kolejnosc': p.kolejnosc
-                } for p in punkty]
-                return JsonResponse({'success': True, 'punkty': data})
+                return odpowiedz_zmianami(request, trasa.id)
             else:
                 messages.success(request, 'Punkt został dodany do trasy!')
                 return redirect('trasa_edit', trasa_id=trasa.id)
@@ -73,44 +113,50 @@ def trasa_edit(request, trasa_id):
     
     context = {
         'trasa': trasa,
-        'punkty': punkty,
+        # Lista punktów czyta też spakowaną trasę, bez przywracania wierszy
+        'punkty': [dict(zip(KOLUMNY, wiersz)) for wiersz in tablica_punktow(trasa.id).tolist()],
         'form': form,
+        # Strumień zmian działa tylko pod ASGI (patrz trasy_app/kanaly.py)
+        'strumien_zmian': isinstance(request, ASGIRequest),
     }
     return render(request, 'trasy_app/trasa_edit.html', context)
 
+def punkt_uzytkownika(request, punkt_id):
+    """
+    Punkt trasy zalogowanego użytkownika albo 404. Punkt spakowanej trasy nie ma wiersza -
+    jego trasa jest szukana w blobach użytkownika i wraca do wierszy (magazyn.py).
+    """
+    punkt = PunktTrasy.objects.filter(id=punkt_id, trasa__uzytkownik=request.user).first()
+    if punkt is not None:
+        return punkt
+    for trasa_id, tablica in geometrie_tras(Trasa.objects.filter(uzytkownik=request.user)):
+        if (tablica[:, KOLUMNY.index('id')] == punkt_id).any():
+            rozpakuj_trase(trasa_id)
+            break
+    return get_object_or_404(PunktTrasy, id=punkt_id, trasa__uzytkownik=request.user)
+
 @login_required
 def punkt_delete(request, punkt_id):
-    punkt = get_object_or_404(PunktTrasy, id=punkt_id, trasa__uzytkownik=request.user)
-    trasa_id = punkt.trasa.id
-    usunieta_kolejnosc = punkt.kolejnosc
-    
-    # Usuwamy punkt
-    punkt.delete()
+    punkt = punkt_uzytkownika(request, punkt_id)
+    trasa_id = punkt.trasa_id
     
-    # Aktualizujemy kolejność pozostałych punktów
-    from django.db.models import F
-    PunktTrasy.objects.filter(
-        trasa_id=trasa_id,
-        kolejnosc__gt=usunieta_kolejnosc
-    ).update(kolejnosc=F('kolejnosc') - 1)
+    # Usuwamy tylko ten punkt - klucze kolejności pozostałych punktów zostają bez zmian
+    usun_punkt(punkt)
     
     # Obsługa zapytań AJAX
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        punkty = PunktTrasy.objects.filter(trasa_id=trasa_id).order_by('kolejnosc')
-        data = [{
-            'id': p.id, 
-            'x': p.x, 
-            'y': p.y, 
-            'kolejnosc': p.kolejnosc
-        } for p in punkty]
-        return JsonResponse({'success': True, 'punkty': data})
+        return odpowiedz_zmianami(request, trasa_id)
     
     messages.success(request, 'Punkt został usunięty z trasy!')
     return redirect('trasa_edit', trasa_id=trasa_id)
 
 @login_required
 def user_trasy(request):
-    trasy = Trasa.objects.filter(uzytkownik=request.user)
+    trasy = (
+        Trasa.objects.filter(uzytkownik=request.user)
+        .select_related('obraz_tla')
+        .order_by('-data_modyfikacji')
+    )
     return render(request, 'trasy_app/user_trasy.html', {'trasy': trasy})
 
 @login_required
@@ -120,16 +166,8 @@ def add_point_click(request, trasa_id):
         x = request.POST.get('x')
         y = request.POST.get('y')
         
-        # Znajdź kolejny numer kolejności
-        ostatni_punkt = PunktTrasy.objects.filter(trasa=trasa).order_by('-kolejnosc').first()
-        kolejnosc = 1 if not ostatni_punkt else ostatni_punkt.kolejnosc + 1
-        
-        punkt = PunktTrasy.objects.create(
-            trasa=trasa,
-            x=x,
-            y=y,
-            kolejnosc=kolejnosc
-        )
+        # Kolejność nadaje atomowo dodaj_punkt - równoległe kliknięcia nie dostaną tego samego numeru
+        punkt = dodaj_punkt(PunktTrasy(trasa=trasa, x=x, y=y))
         
         return JsonResponse({'success': True, 'punkt_id': punkt.id})
     
@@ -140,36 +178,14 @@ def punkt_move(request, punkt_id, kierunek):
     """
     Zamienia kolejność punktu z sąsiednim (w górę lub w dół)
     """
-    punkt = get_object_or_404(PunktTrasy, id=punkt_id, trasa__uzytkownik=request.user)
-    trasa_id = punkt.trasa.id
+    punkt = punkt_uzytkownika(request, punkt_id)
+    trasa_id = punkt.trasa_id
     
-    if kierunek == 'up' and punkt.kolejnosc > 1:
-        # Zamień z poprzednim punktem
-        punkt_poprzedni = get_object_or_404(PunktTrasy, trasa_id=trasa_id, kolejnosc=punkt.kolejnosc-1)
-        punkt_poprzedni.kolejnosc += 1
-        punkt.kolejnosc -= 1
-        punkt_poprzedni.save()
-        punkt.save()
-    elif kierunek == 'down':
-        # Zamień z następnym punktem
-        try:
-            punkt_nastepny = PunktTrasy.objects.get(trasa_id=trasa_id, kolejnosc=punkt.kolejnosc+1)
-            punkt_nastepny.kolejnosc -= 1
-            punkt.kolejnosc += 1
-            punkt_nastepny.save()
-            punkt.save()
-        except PunktTrasy.DoesNotExist:
-            pass
+    if kierunek in ('up', 'down'):
+        zamien_z_sasiadem(punkt, kierunek)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        punkty = PunktTrasy.objects.filter(trasa_id=trasa_id).order_by('kolejnosc')
-        data = [{
-            'id': p.id, 
-            'x': p.x, 
-            'y': p.y, 
-            'kolejnosc': p.kolejnosc
-        } for p in punkty]
-        return JsonResponse({'success': True, 'punkty': data})
+        return odpowiedz_zmianami(request, trasa_id)
     
     return redirect('trasa_edit', trasa_id=trasa_id)
 
@@ -178,15 +194,77 @@ def punkt_move(request, punkt_id, kierunek):
 def get_punkty(request, trasa_id):
     """
     Zwraca wszystkie punkty dla konkretnej trasy w formacie JSON
+    (albo trasę uproszczoną przez ?tolerance= lub ?max_points=)
     """
     trasa = get_object_or_404(Trasa, id=trasa_id, uzytkownik=request.user)
-    punkty = trasa.punkty.all().order_by('kolejnosc')
-    
-    data = [{
-        'id': p.id, 
-        'x': p.x, 
-        'y': p.y, 
-        'kolejnosc': p.kolejnosc
-    } for p in punkty]
-    
-    return JsonResponse({'success': True, 'punkty': data})
\ No newline at end of file
+    try:
+        tolerancja, max_punktow = parametry_uproszczenia(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    # Edytor pyta o punkty po każdej akcji - bez zmian trasy wystarczy 304
+    return odpowiedz_dla_trasy(
+        request, trasa.id, lambda: odpowiedz_punktami(request, trasa.id, tolerancja, max_punktow),
+        stan=(trasa.rewizja, trasa.data_modyfikacji),
+    )
+
+@login_required
+def trasa_zmiany(request, trasa_id):
+    """
+    Zwraca zmiany punktów trasy od rewizji podanej w parametrze 'rewizja'
+    """
+    trasa = get_object_or_404(Trasa, id=trasa_id, uzytkownik=request.user)
+    return odpowiedz_zmianami(request, trasa.id)
+
+@login_required
+def trasa_strumien(request, trasa_id):
+    """
+    Strumień Server-Sent Events ze zmianami punktów trasy od rewizji z nagłówka Last-Event-ID
+    albo parametru 'rewizja' (patrz trasy_app/kanaly.py). Tylko pod serwerem ASGI.
+    """
+    trasa = get_object_or_404(Trasa, id=trasa_id, uzytkownik=request.user)
+    if not isinstance(request, ASGIRequest):
+        # Pod WSGI otwarte połączenie zajmowałoby wątek roboczy serwera przez cały czas jego trwania
+        return HttpResponse('Strumień zmian wymaga serwera ASGI (trasy_projekt/asgi.py).',
+                            status=501, content_type='text/plain; charset=utf-8')
+    od_rewizji = request.headers.get('Last-Event-ID') or request.GET.get('rewizja', '')
+    od_rewizji = int(od_rewizji) if od_rewizji.isdigit() else trasa.rewizja
+    response = StreamingHttpResponse(strumien_zmian(trasa.id, od_rewizji), content_type='text/event-stream')
+    patch_cache_control(response, no_cache=True)
+    # Serwer pośredniczący (nginx) nie może buforować zdarzeń
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def odpowiedz_plikiem(storage, nazwa, content_type=None):
+    """
+    Plik z magazynu mediów z nagłówkami pozwalającymi przeglądarce trzymać go w pamięci podręcznej
+    """
+    if not nazwa or not storage.exists(nazwa):
+        raise Http404('Brak pliku.')
+    response = FileResponse(storage.open(nazwa), content_type=content_type)
+    patch_cache_control(response, private=True, max_age=60 * 60)
+    return response
+
+@login_required
+def tlo_miniatura(request, tlo_id):
+    """
+    Miniatura obrazu tła (oryginał, jeśli miniatura nie została jeszcze wygenerowana)
+    """
+    tlo = get_object_or_404(ObrazTla, id=tlo_id)
+    plik = tlo.miniatura if tlo.miniatura else tlo.obraz
+    return odpowiedz_plikiem(plik.storage, plik.name)
+
+@login_required
+def tlo_dzi(request, tlo_id):
+    """
+    Deskryptor piramidy kafelków obrazu tła w formacie Deep Zoom
+    """
+    tlo = get_object_or_404(ObrazTla, id=tlo_id, status=ObrazTla.GOTOWY)
+    return HttpResponse(opis_dzi(tlo), content_type='application/xml')
+
+@login_required
+def tlo_kafelek(request, tlo_id, poziom, kolumna, wiersz):
+    """
+    Pojedynczy kafelek piramidy - adres zgodny z konwencją Deep Zoom (<nazwa>_files/<poziom>/<kolumna>_<wiersz>.jpg)
+    """
+    tlo = get_object_or_404(ObrazTla, id=tlo_id, status=ObrazTla.GOTOWY)
+    return odpowiedz_plikiem(tlo.obraz.storage, sciezka_kafelka(tlo, poziom, kolumna, wiersz), 'image/jpeg')
@@ -0,0 +1,80 @@
+"""
+Zapytania warunkowe HTTP (ETag, Last-Modified) dla tras i punktów.
+
+Stan trasy to jej rewizja i data modyfikacji - zmiana punktów podbija obie (rewizje.py),
+a zapis samej trasy datę modyfikacji. Odpowiedzi ze szczegółami obrazu tła (obraz_tla_details)
+zależą też od jego wiersza, więc ich stan obejmuje pola tła. Znacznik ETag powstaje ze stanu
+i wariantu odpowiedzi (pełny adres z parametrami i nagłówek Accept), więc da się go policzyć
+bez czytania punktów.
+Klient wysyłający If-None-Match lub If-Modified-Since z aktualnymi wartościami dostaje
+304 Not Modified, a odpowiedź nie jest w ogóle budowana.
+"""
+import hashlib
+from functools import partial
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import Trasa
+from .pamiec import zapamietana_odpowiedz
+from .serializers import ObrazTlaSerializer
+
+# Pola obrazu tła widoczne w obraz_tla_details - obraz tła nie ma daty modyfikacji
+POLA_TLA = [f'obraz_tla__{pole}' for pole in ObrazTlaSerializer.Meta.fields]
+
+
+def stan_trasy(trasa_id, uzytkownik, z_tlem=False):
+    """
+    (rewizja, data_modyfikacji) trasy użytkownika albo None, jeśli jej nie ma.
+    Z z_tlem=True po nich następują pola obrazu tła trasy.
+    """
+    if not str(trasa_id).isdigit():
+        return None
+    return Trasa.objects.filter(id=trasa_id, uzytkownik=uzytkownik).values_list(
+        'rewizja', 'data_modyfikacji', *(POLA_TLA if z_tlem else ())).first()
+
+
+def znacznik(request, *stan):
+    """
+    ETag odpowiedzi na zapytanie dla podanego stanu zasobu
+    """
+    dane = '|'.join([*map(str, stan), request.build_absolute_uri(), request.META.get('HTTP_ACCEPT', '')])
+    return f'"{hashlib.blake2b(dane.encode(), digest_size=12).hexdigest()}"'
+
+
+def odpowiedz_warunkowo(request, etag, ostatnia_zmiana, widok):
+    """
+    Odpowiedź 304, jeśli klient ma aktualną wersję, a w przeciwnym razie wynik widok()
+    z nagłówkami ETag i Last-Modified. Przeglądarka ma zawsze pytać serwer o aktualność.
+    """
+    # Last-Modified ma dokładność do sekundy
+    sekundy = int(ostatnia_zmiana.timestamp()) if ostatnia_zmiana is not None else None
+    response = get_conditional_response(request, etag, sekundy)
+    if response is None:
+        response = widok()
+        if not 200 <= response.status_code < 300:
+            return response
+    response['ETag'] = etag
+    if sekundy is not None:
+        response['Last-Modified'] = http_date(sekundy)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def odpowiedz_dla_trasy(request, trasa_id, widok, stan=None, z_tlem=False, zapamietaj=True):
+    """
+    odpowiedz_warunkowo() dla odpowiedzi zależnej tylko od trasy użytkownika i jej punktów,
+    a z z_tlem=True także od obrazu tła trasy (stan jak w stan_trasy()).
+    Gotowe odpowiedzi są trzymane w pamięci podręcznej pod swoim znacznikiem (pamiec.py).
+    """
+    if stan is None:
+        stan = stan_trasy(trasa_id, request.user, z_tlem)
+    if stan is None:
+        # Brak trasy - widok sam zwróci 404
+        return widok()
+    rewizja, data_modyfikacji, *tlo = stan
+    etag = znacznik(request, trasa_id, rewizja, data_modyfikacji.isoformat(), *tlo)
+    if zapamietaj:
+        widok = partial(zapamietana_odpowiedz, trasa_id, etag, widok)
+    # Zmiana tła nie zmienia daty modyfikacji trasy - wtedy tylko ETag
+    return odpowiedz_warunkowo(request, etag, None if z_tlem else data_modyfikacji, widok)
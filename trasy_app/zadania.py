@@ -0,0 +1,130 @@
+"""
+Kolejka zadań wykonywanych poza wątkiem obsługującym żądanie.
+
+Implementację wybiera ustawienie TRASY_KOLEJKA_ZADAN (ścieżka klasy):
+    KolejkaWatkowa       - wątek roboczy w procesie serwera (domyślnie); zadania
+                           niewykonane przed zatrzymaniem serwera przepadają
+    KolejkaBazodanowa    - zadania zapisane w tabeli Zadanie, wykonywane przez
+                           osobny proces: manage.py uruchom_zadania
+    KolejkaSynchroniczna - zadanie wykonuje się od razu (testy, skrypty)
+
+Zadanie to funkcja na poziomie modułu z argumentami zapisywalnymi w JSON.
+"""
+import logging
+import queue
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DOMYSLNA_KOLEJKA = 'trasy_app.zadania.KolejkaWatkowa'
+
+_kolejki = {}
+_blokada = threading.Lock()
+
+
+def _nazwa_funkcji(funkcja):
+    return f'{funkcja.__module__}.{funkcja.__qualname__}'
+
+
+class KolejkaSynchroniczna:
+    def zlec(self, funkcja, *argumenty):
+        funkcja(*argumenty)
+
+
+class KolejkaWatkowa:
+    """
+    Zadania wykonywane kolejno przez jeden wątek roboczy w procesie serwera
+    """
+    def __init__(self):
+        self._kolejka = queue.Queue()
+        self._watek = None
+        self._blokada = threading.Lock()
+
+    def zlec(self, funkcja, *argumenty):
+        # Wątek ma własne połączenie z bazą - musi widzieć zatwierdzone dane
+        transaction.on_commit(lambda: self._dodaj(funkcja, argumenty))
+
+    def _dodaj(self, funkcja, argumenty):
+        with self._blokada:
+            if self._watek is None or not self._watek.is_alive():
+                self._watek = threading.Thread(target=self._pracuj, name='trasy-zadania', daemon=True)
+                self._watek.start()
+        self._kolejka.put((funkcja, argumenty))
+
+    def _pracuj(self):
+        while True:
+            funkcja, argumenty = self._kolejka.get()
+            try:
+                funkcja(*argumenty)
+            except Exception:
+                logger.exception('Zadanie %s nie powiodło się', _nazwa_funkcji(funkcja))
+            finally:
+                close_old_connections()
+                self._kolejka.task_done()
+
+    def czekaj(self):
+        """
+        Czeka na wykonanie wszystkich zleconych zadań
+        """
+        self._kolejka.join()
+
+
+class KolejkaBazodanowa:
+    """
+    Zadania zapisywane w bazie w tej samej transakcji co zmiana, która je zleciła
+    """
+    def zlec(self, funkcja, *argumenty):
+        from .models import Zadanie
+        Zadanie.objects.create(funkcja=_nazwa_funkcji(funkcja), argumenty=list(argumenty))
+
+    def wykonaj_oczekujace(self, limit=None):
+        """
+        Wykonuje oczekujące zadania w kolejności zlecenia. Zwraca liczbę wykonanych zadań.
+        Kilka procesów może pracować równolegle - zadanie przejmuje ten, którego UPDATE je zmienił.
+        """
+        from .models import Zadanie
+
+        wykonane = 0
+        while limit is None or wykonane < limit:
+            zadanie = Zadanie.objects.filter(status=Zadanie.OCZEKUJE).order_by('id').first()
+            if zadanie is None:
+                break
+            przejete = Zadanie.objects.filter(id=zadanie.id, status=Zadanie.OCZEKUJE).update(
+                status=Zadanie.W_TOKU, proby=F('proby') + 1
+            )
+            if not przejete:
+                continue
+
+            try:
+                import_string(zadanie.funkcja)(*zadanie.argumenty)
+            except Exception:
+                logger.exception('Zadanie %s (%s) nie powiodło się', zadanie.id, zadanie.funkcja)
+                Zadanie.objects.filter(id=zadanie.id).update(status=Zadanie.BLAD, blad=traceback.format_exc())
+            else:
+                Zadanie.objects.filter(id=zadanie.id).update(status=Zadanie.ZAKONCZONE)
+            wykonane += 1
+        return wykonane
+
+
+def kolejka():
+    """
+    Kolejka zadań wybrana w ustawieniach (jedna instancja na proces)
+    """
+    sciezka = getattr(settings, 'TRASY_KOLEJKA_ZADAN', DOMYSLNA_KOLEJKA)
+    with _blokada:
+        if sciezka not in _kolejki:
+            _kolejki[sciezka] = import_string(sciezka)()
+        return _kolejki[sciezka]
+
+
+def zlec(funkcja, *argumenty):
+    """
+    Zleca wykonanie funkcja(*argumenty) w tle
+    """
+    kolejka().zlec(funkcja, *argumenty)
@@ -0,0 +1,18 @@
+"""
+ASGI config for trasy_projekt project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Odczyty tras w trasy_app/async_views.py są wysyłane strumieniowo z pętli zdarzeń,
+np. uvicorn trasy_projekt.asgi:application
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trasy_projekt.settings')
+
+application = get_asgi_application()